@@ -0,0 +1,20 @@
+from polymers.walk import convert_walk
+import os
+
+def main():
+    from glob import glob
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rewrite walk files saved as (dim, N) as (N, dim)")
+    parser.add_argument('files', nargs='*',
+                        help="walk files, by default every file in data/dimers")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob(os.path.join(os.path.dirname(__file__),
+                                                   "../data/dimers/*.npy")))
+    for file in files:
+        if convert_walk(file):
+            print('converted', file)
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,97 @@
-from polymers.pivot.fast import attempt_pivot
-from polymers.analysis import Re2, Rg2, Rm2
-import numpy as np
-from tqdm import trange
-from polymers.random import rand_Gd, RNG
-import time
-
-Rx2 = [Re2, Rg2, Rm2]
-
-def init_log(file, keys):
-    """
-    Initializes the log file
-    """
-    with open(file, 'w') as f:
-        f.write(','.join(keys) + '\n')
-        
-def write_log(file, values):
-    with open(file, 'a') as f:
-        f.write(','.join(map(lambda x: f"{x}", values)) + '\n')
-
-def run_SAW(init_walk, batch_size, batches, log_file):
-    """
-    Runs a batch of SAWs and returns the squared end-to-end distance
-    """
-    keys = ['batch', 'acceptance', 'Re2', 'Rg2', 'Rm2', 'time_elapsed']
-
-    init_log(log_file, keys)
-    dim = init_walk.shape[0]
-    walk = init_walk.copy()
-    for i in range(batches):
-        acceptance = 0
-        tic = time.time()
-        for _ in trange(batch_size, desc=f"Batch {i}/{batches}", ncols=80):
-            idx = RNG.integers(0, len(walk[0]))
-            sym = rand_Gd(dim)
-            walk,pivoted = attempt_pivot(walk, idx, sym)
-            acceptance += pivoted
-        toc = time.time()
-        acceptance = acceptance / batch_size
-        values = [(i+1)*batch_size, acceptance, Re2(walk), Rg2(walk), Rm2(walk), toc-tic]
-        write_log(log_file, values)
+from polymers.dimer.batch import select_walk
+from polymers.walk import PACKED_SUFFIX, load_walk
+from polymers.experiment import ENGINES, THERMAL_ENGINES, run_SAW, run_parallel, run_batched
+from polymers.pivot.moves import MOVE_SETS
+from polymers.results import is_complete
+import polymers.random
 
 def main():
     from glob import glob
+    import argparse
     import os
-    
+
+    parser = argparse.ArgumentParser(description="Sample observables of SAWs with the pivot algorithm")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='fast',
+                        help="pivot engine; 'tree' scales to N >= 10^6")
+    parser.add_argument('--chains', type=int, default=1,
+                        help="independent chains per walk file")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes; chains run in this process if 1")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="root seed for the random streams of all chains")
+    parser.add_argument('--target-error', type=float, default=None,
+                        help="stop a chain once the relative errors of Re2, Rg2 and Rm2 are below this")
+    parser.add_argument('--per-step', action='store_true',
+                        help="also record the observables after every pivot attempt (fast, hybrid and isaw engines)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue unfinished chains from their last checkpoint")
+    parser.add_argument('--moves', choices=MOVE_SETS, default='all',
+                        help="symmetries to pivot with")
+    parser.add_argument('--batched', action='store_true',
+                        help="run the chains of each file together in this process, on all cores (fast engine only)")
+    parser.add_argument('--beta', type=float, default=None,
+                        help="inverse temperature of interacting SAWs, in units of the contact energy (isaw engine)")
+    args = parser.parse_args()
+    if args.beta is not None and (args.batched or args.engine not in THERMAL_ENGINES):
+        parser.error("--beta needs --engine " + " or ".join(THERMAL_ENGINES) + " without --batched")
+    if args.batched and (args.per_step or args.resume or args.target_error is not None):
+        parser.error("--batched does not support --per-step, --resume or --target-error")
+    if args.batched and args.engine != 'fast':
+        parser.error("--batched always runs the fast engine, not --engine " + args.engine)
+
     dirname = os.path.dirname(__file__)
     
     def sort_fmt(file):
-        dim = file.split('_')[-1].split('dimer')[0].lstrip('d')
-        N = file.split('_')[-1].split('dimer')[1].rstrip('.npy')
+        name = os.path.splitext(file)[0]
+        dim = name.split('_')[-1].split('dimer')[0].lstrip('d')
+        N = name.split('_')[-1].split('dimer')[1]
         return N + ' ' + dim
 
-    files = sorted(glob(dirname+'/../data/dimers/*.npy'), key=sort_fmt)
+    # walks stored as .npy sites or as packed steps; both share a result set,
+    # so a walk stored in both formats is only run from its .npy file
+    files = {os.path.splitext(file)[0]: file
+             for file in glob(dirname+f'/../data/dimers/*{PACKED_SUFFIX}')}
+    files.update((os.path.splitext(file)[0], file)
+                 for file in glob(dirname+'/../data/dimers/*.npy'))
+    files = sorted(files.values(), key=sort_fmt)
     print(dirname)
+    batch_size = int(10**4)
+    batches = 1000
+    jobs = []
     for file in files:
-        walk = np.load(file)
-        log_file = os.path.join(dirname, f'../data/dimers/{os.path.basename(file)[:-4]}.csv')
-        if os.path.exists(log_file):
+        out = os.path.join(dirname, f'../data/dimers/{os.path.splitext(os.path.basename(file))[0]}.saw')
+        if is_complete(out):
             continue
+        if os.path.exists(out) and not args.resume:
+            print(f"{out} is incomplete, starting it over (use --resume to continue it)")
+        jobs.append((file, out))
+
+    if args.batched:
+        run_batched(jobs, batch_size, batches, chains=args.chains, seed=args.seed,
+                    moves=args.moves)
+        return
+
+    if args.workers > 1 or args.chains > 1:
+        run_parallel(jobs, batch_size, batches, chains=args.chains, workers=args.workers,
+                     seed=args.seed, engine=args.engine, target_error=args.target_error,
+                     per_step=args.per_step, resume=args.resume, moves=args.moves,
+                     beta=args.beta)
+        return
+
+    if args.seed is not None:
+        polymers.random.set_seed(args.seed)
+    for file, out in jobs:
+        walk = select_walk(load_walk(file)).T
         dim = walk.shape[0]
         N = walk.shape[1]
         print('d =', dim, 'N =', N)
-        batch_size = int(10**4)
-        batches = 1000
-        run_SAW(walk, batch_size, batches, log_file)
+        stats = run_SAW(walk, batch_size, batches, out, engine=args.engine,
+                        target_error=args.target_error, per_step=args.per_step,
+                        metadata=dict(walk_file=file, seed=args.seed), resume=args.resume,
+                        moves=args.moves, beta=args.beta)
+        for name, s in stats.summary().items():
+            print(f"{name} = {s['mean']:.6g} ± {s['error']:.2g} "
+                  f"(tau = {s['tau']:.3g} samples, burn-in = {s['burn_in']})")
         
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,23 +1,47 @@
 import polymers.dimer as dm
+from polymers.walk import PACKED_SUFFIX, save_walk
 import numpy as np
 from tqdm import tqdm
 import os
-import sys
 
 def main():
-    sys.setrecursionlimit(10**6)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate starting SAWs by dimerization")
+    parser.add_argument('--count', type=int, default=1,
+                        help="independent walks per (N, d), stacked into one file if > 1")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for --count > 1, by default one per core")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="root seed of the random streams")
+    parser.add_argument('--packed', action='store_true',
+                        help=f"store the walks as packed steps ({PACKED_SUFFIX}) instead of .npy sites")
+    args = parser.parse_args()
+    suffix = PACKED_SUFFIX if args.packed else '.npy'
 
     basename = os.path.join(os.path.dirname(__file__), "../data/dimers/")
     dimer_lengths = np.logspace(2, 5, 20, dtype=int)
+    seeds = np.random.SeedSequence(args.seed).spawn(2 * len(dimer_lengths))
 
-    for N in tqdm(dimer_lengths, desc=f"Generating dimers", ncols=80):
+    for k, N in enumerate(tqdm(dimer_lengths, desc="Generating dimers", ncols=80)):
         for dim in (2,3):
-            fname = basename + f"dimer_d{dim}dimer{str(N).zfill(5)}.npy"
-            if os.path.exists(fname):
+            seed = seeds[2 * k + dim - 2]
+            stem = basename + f"dimer_d{dim}dimer{str(N).zfill(5)}"
+            # either format of the walk counts, or critical_exp would run it twice
+            if any(os.path.exists(stem + ext) for ext in ('.npy', PACKED_SUFFIX)):
                 continue
+            fname = stem + suffix
 
-            walk = dm.dimer_pivot(N, dim)
-            np.save(fname, walk)
+            if args.count > 1 and args.packed:
+                # packing needs every walk, so they are kept in memory rather than streamed
+                save_walk(fname, dm.dimer_batch(N, dim, args.count, workers=args.workers,
+                                                seed=seed, progress=False))
+            elif args.count > 1:
+                dm.dimer_batch(N, dim, args.count, workers=args.workers, seed=seed,
+                               out=fname, progress=False)
+            else:
+                walk = dm.dimer_iterative(N, dim, np.random.default_rng(seed))
+                save_walk(fname, walk.T)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
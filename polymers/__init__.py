@@ -1,3 +1,17 @@
-from polymers.naive import naive_self_avoiding_walk
-from polymers.dimer import naive_dimer, dimer_pivot
-from polymers.random import set_seed
\ No newline at end of file
+import importlib
+
+# The compiled (numba) modules are only imported once one of their names is
+# used, so that numba-free modules such as polymers.pivot.slow can be
+# imported without numba installed.
+_LAZY = {
+    'naive_self_avoiding_walk': 'polymers.naive',
+    'naive_dimer': 'polymers.dimer',
+    'dimer_pivot': 'polymers.dimer',
+    'set_seed': 'polymers.random',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,32 +1,117 @@
-from numba import njit
+from numba import njit, prange
 import numpy as np
 
+# All observables are computed in one O(N) pass from the first and second
+# moments of the sites relative to the first site, accumulated in float64.
+# Working relative to the first site keeps the sums small however far the
+# walk has drifted from the origin.
+
+@njit
+def _moments(w, S1, S2):
+    """Accumulates S1[k] = sum_i (w[k, i] - w[k, 0]) and
+    S2[k] = sum_i (w[k, i] - w[k, 0])**2 for a walk w (dim, N)."""
+    dim, N = w.shape
+    for k in range(dim):
+        x0 = w[k, 0]
+        s1 = 0.0
+        s2 = 0.0
+        for i in range(N):
+            y = np.float64(w[k, i] - x0)
+            s1 += y
+            s2 += y * y
+        S1[k] = s1
+        S2[k] = s2
+
+@njit
+def _from_moments(w, S1, S2, X):
+    """Re2, Rg2, Rm2 and X2 from the moments of `_moments`, writing X into X"""
+    dim, N = w.shape
+    re2 = 0.0
+    rg2 = 0.0
+    rm2 = 0.0
+    x2 = 0.0
+    for k in range(dim):
+        x0 = np.float64(w[k, 0])
+        ye = np.float64(w[k, N - 1] - w[k, 0])
+        mean = S1[k] / N
+        re2 += ye * ye
+        rg2 += S2[k] / N - mean * mean
+        rm2 += 2 * S2[k] - 2 * S1[k] * ye + N * ye * ye
+        X[k] = S1[k] + N * x0
+        x2 += S2[k] + 2 * x0 * S1[k] + N * x0 * x0
+    return re2, 2 * rg2, rm2 / (2 * N), x2
+
+@njit
+def observables(w):
+    """Computes every observable of a walk in a single O(N) pass.
+
+    Parameters
+    ----------
+    w (dim, N) : np.ndarray
+        Walk
+
+    Returns
+    -------
+    float, float, float, np.ndarray (dim), float
+        Re2, Rg2, Rm2, X and X2, see the functions of the same name
+    """
+    dim = w.shape[0]
+    S1 = np.empty(dim)
+    S2 = np.empty(dim)
+    X = np.empty(dim)
+    _moments(w, S1, S2)
+    re2, rg2, rm2, x2 = _from_moments(w, S1, S2, X)
+    return re2, rg2, rm2, X, x2
+
+@njit(parallel=True)
+def observables_batch(ws):
+    """`observables` for a batch of walks of equal length.
+
+    Parameters
+    ----------
+    ws (B, dim, N) : np.ndarray
+        Walks
+
+    Returns
+    -------
+    np.ndarray (B), (B), (B), (B, dim), (B)
+        Re2, Rg2, Rm2, X and X2 of every walk
+    """
+    B, dim, N = ws.shape
+    re2 = np.empty(B)
+    rg2 = np.empty(B)
+    rm2 = np.empty(B)
+    X = np.empty((B, dim))
+    x2 = np.empty(B)
+    for b in prange(B):
+        S1 = np.empty(dim)
+        S2 = np.empty(dim)
+        _moments(ws[b], S1, S2)
+        re2[b], rg2[b], rm2[b], x2[b] = _from_moments(ws[b], S1, S2, X[b])
+    return re2, rg2, rm2, X, x2
+
 @njit
 def Re2(w):
     """squared end to end distance"""
-    w = w.T.astype(np.float32)
-    return np.linalg.norm((w[-1] - w[0]))**2
+    out = 0.0
+    for k in range(w.shape[0]):
+        y = np.float64(w[k, -1] - w[k, 0])
+        out += y * y
+    return out
 
 @njit
 def Rg2(w):
-    w = w.T.astype(np.float32)
-    """squared radius of gyration"""
-    out = 0
-    N = len(w)
-    for i in range(N):
-        for j in range(N):
-            out += np.linalg.norm((w[i] - w[j]))**2
-    out /= N**2
-    return out
+    """squared radius of gyration, (1/N^2) sum_ij |w_i - w_j|^2
+
+    This is the pairwise definition, i.e. twice the centroid form
+    (1/N) sum_i |w_i - <w>|^2, evaluated from the first and second moments.
+    """
+    return observables(w)[1]
 
 @njit
 def Rm2(w):
-    w = w.T.astype(np.float32)
-    out = 0
-    N = len(w)
-    for i in range(N):
-        out += np.linalg.norm(w[i]-w[0])**2 + np.linalg.norm(w[i]-w[-1])**2
-    return out / (2*N)
+    """mean squared distance of a monomer from the endpoints"""
+    return observables(w)[2]
 
 def Xe(w):
     w = w.T
@@ -38,8 +123,77 @@ def X(w):
 
 @njit
 def X2(w):
-    w = w.T
-    out = 0
-    for i in range(len(w)):
-        out += (w[i] * w[i]).sum()
-    return out
+    """sum of squared distances of the monomers from the origin"""
+    return observables(w)[4]
+
+# Running moments of a walk that is being pivoted, for O(1) observables.
+# m[:dim] = sum_i (x_i - ref) and m[dim] = sum_i |x_i - ref|^2 for the sites
+# x_i (N, dim) of the walk and a fixed integer reference site ref.
+
+@njit
+def track_moments(sites, ref, m):
+    """Computes the running moments of sites (N, dim) relative to ref into m"""
+    N, dim = sites.shape
+    m[:] = 0.0
+    for i in range(N):
+        for k in range(dim):
+            y = np.float64(sites[i, k] - ref[k])
+            m[k] += y
+            m[dim] += y * y
+
+@njit
+def update_moments(m, ref, old, new):
+    """Updates the running moments for a site that moved from old to new"""
+    dim = len(ref)
+    for k in range(dim):
+        yo = np.float64(old[k] - ref[k])
+        yn = np.float64(new[k] - ref[k])
+        m[k] += yn - yo
+        m[dim] += yn * yn - yo * yo
+
+@njit
+def tracked_observables(m, ref, x0, xe, N):
+    """Re2, Rg2, Rm2 and X2 of a walk from its running moments in O(1).
+
+    Parameters
+    ----------
+    m (dim + 1) : np.ndarray
+        Running moments, see `track_moments`
+    ref (dim) : np.ndarray
+        Reference site of the moments
+    x0, xe (dim) : np.ndarray
+        First and last site of the walk
+    N : int
+        Number of sites
+
+    Returns
+    -------
+    float, float, float, float
+        Re2, Rg2, Rm2 and X2
+    """
+    dim = len(ref)
+    S2 = m[dim]
+    re2 = 0.0
+    c2 = 0.0
+    a1 = 0.0
+    a2 = 0.0
+    b1 = 0.0
+    b2 = 0.0
+    r1 = 0.0
+    r2 = 0.0
+    for k in range(dim):
+        a = np.float64(x0[k] - ref[k])
+        b = np.float64(xe[k] - ref[k])
+        r = np.float64(ref[k])
+        re2 += (b - a) * (b - a)
+        c2 += m[k] * m[k]
+        a1 += a * m[k]
+        a2 += a * a
+        b1 += b * m[k]
+        b2 += b * b
+        r1 += r * m[k]
+        r2 += r * r
+    rg2 = 2 * (S2 / N - c2 / (N * N))
+    rm2 = (2 * S2 - 2 * (a1 + b1) + N * (a2 + b2)) / (2 * N)
+    x2 = S2 + 2 * r1 + N * r2
+    return re2, rg2, rm2, x2
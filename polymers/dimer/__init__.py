@@ -1,2 +1,4 @@
 from .naive_dimer import dimer_naive
-from .pivot_dimer import dimer_pivot
\ No newline at end of file
+from .pivot_dimer import dimer_pivot
+from .iterative_dimer import dimer_iterative
+from .batch import dimer_batch
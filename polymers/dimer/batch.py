@@ -0,0 +1,77 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from polymers.dimer.iterative_dimer import dimer_iterative
+from polymers.walk import walk_dtype
+
+__all__ = ['dimer_batch', 'select_walk']
+
+
+def _generate(n, dim, seed):
+    """Worker: the sites (n + 1, dim) of one walk from its own random stream"""
+    return dimer_iterative(n, dim, np.random.default_rng(seed)).T
+
+
+def dimer_batch(n, dim, count, workers=None, seed=None, out=None, progress=True):
+    """Generates many independent SAWs of length n by dimerization in parallel.
+
+    Every walk is generated by `dimer_iterative` from its own random stream,
+    spawned from `np.random.SeedSequence(seed)`, so walk i depends only on the
+    seed and i, however the work is split between processes.
+
+    Parameters
+    ----------
+    n : int
+        Length of each walk
+    dim : int
+        Dimension
+    count : int
+        Number of walks
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count()
+    seed : int, optional
+        Root seed, by default fresh entropy
+    out : str, optional
+        .npy file to write the walks to as they are generated, instead of
+        keeping them all in memory. It only appears once every walk is done.
+    progress : bool, optional
+        Show a progress bar
+
+    Returns
+    -------
+    np.ndarray (count, n + 1, dim)
+        Sites of the walks in the narrowest safe dtype, in the layout of
+        `polymers.walk.load_walk`, memory-mapped from out if it was given
+    """
+    shape = (count, n + 1, dim)
+    dtype = walk_dtype(n + 1)
+    if out is None:
+        walks = np.empty(shape, dtype=dtype)
+    else:
+        tmp = out + '.tmp'
+        walks = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=shape)
+
+    seqs = np.random.SeedSequence(seed).spawn(count)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_generate, n, dim, seq): i for i, seq in enumerate(seqs)}
+        for future in tqdm(as_completed(pending), total=count, desc=f"Walks of {n}",
+                           ncols=80, disable=not progress):
+            walks[pending[future]] = future.result()
+
+    if out is not None:
+        walks.flush()
+        del walks
+        os.replace(tmp, out)
+        walks = np.load(out, mmap_mode='r')
+    return walks
+
+
+def select_walk(walks, i=0):
+    """Walk i of a stack of walks (count, N, dim), or walks itself if it is a
+    single walk (N, dim), as loaded by `polymers.walk.load_walk`"""
+    if walks.ndim == 3:
+        return walks[i % len(walks)]
+    return walks
@@ -0,0 +1,314 @@
+"""Bottom-up dimerization.
+
+`dimer_pivot` recursively builds the two halves of a walk, pivots each once
+and joins them, starting over from scratch whenever the join intersects.
+Here the same split is walked bottom-up instead: the walk is kept as one
+(n, dim) buffer of steps, every segment of the recursion is joined in
+place once both of its halves are done, and a failed join is retried with
+the same two halves rather than rebuilding them: the right half is tried
+in several orientations about the joint against a persistent hash of the
+left half, and if none fits both halves are pivoted near the joint. All of it
+runs in a single compiled call on buffers allocated once.
+
+Retrying only the join keeps both halves self-avoiding, so the result is
+always a valid SAW, but it is slightly biased towards halves that join
+easily. That is harmless for starting configurations of pivot runs, which
+equilibrate away from their initial state anyway.
+"""
+import numpy as np
+from numba import njit
+
+import polymers.random
+from polymers.naive.growth import grow_steps
+from polymers.walk import walk_dtype
+from polymers.pivot.chain import pivot_inplace
+from polymers.symmetry import sym_code, transform_site_code
+from polymers.pivot.sitehash import (key_bits, site_set, clear_site_set, add_site,
+                                     contains_site)
+
+__all__ = ['INIT_METHODS', 'dimer_iterative', 'dimerize_steps', 'steps_to_walk']
+
+# segments of at most this many steps are rods, as in `dimer_pivot`, or
+# grown by `grow_steps`, which draws them uniformly: up to 3 steps, nothing
+# but its predecessor can block the end of a walk
+_BASE = 3
+# base segments accepted by dimer_iterative, named as in `dimer_pivot`
+INIT_METHODS = ('rod', 'naive')
+# orientations of the right half tried before both halves are reshaped
+_ORIENTATIONS = 8
+
+
+@njit
+def _join_order(n):
+    """Segments [a, b) of steps that have to be joined, children first.
+
+    The segments are those of the recursion of `dimer_pivot`: a segment of
+    more than _BASE steps is split into its first (b - a) // 2 steps and the
+    rest. Listing them breadth-first and reversing the list puts every
+    segment after both of its halves.
+    """
+    nodes = np.empty((max(n, 1), 2), dtype=np.int64)
+    nodes[0, 0], nodes[0, 1] = 0, n
+    count = 1 if n > _BASE else 0
+    head = 0
+    while head < count:
+        a, b = nodes[head]
+        m = a + (b - a) // 2
+        if m - a > _BASE:
+            nodes[count, 0], nodes[count, 1] = a, m
+            count += 1
+        if b - m > _BASE:
+            nodes[count, 0], nodes[count, 1] = m, b
+            count += 1
+        head += 1
+    return nodes[:count][::-1]
+
+
+@njit
+def _load(steps, a, b, w):
+    """Positions of the sites of segment [a, b) into w[:b - a + 1], starting
+    at the origin"""
+    dim = steps.shape[1]
+    for k in range(dim):
+        w[0, k] = 0
+    for i in range(b - a):
+        for k in range(dim):
+            w[i + 1, k] = w[i, k] + steps[a + i, k]
+
+
+@njit
+def _grow(steps, a, b, w, ss, rng):
+    """Fills segment [a, b) of steps with a uniformly random SAW, grown in
+    w[:b - a + 1]"""
+    w = w[:b - a + 1]
+    while grow_steps(w, ss, rng)[0] < b - a:
+        pass
+    for i in range(b - a):
+        for k in range(w.shape[1]):
+            steps[a + i, k] = w[i + 1, k] - w[i, k]
+
+
+@njit
+def _store(w, sym, steps, a):
+    """Steps of the walk w, transformed by sym, back into steps[a:]"""
+    code = sym_code(sym)
+    for i in range(len(w) - 1):
+        transform_site_code(code, w[i + 1], w[i], steps[a + i])
+
+
+@njit
+def _random_pivot(w, wt, ss, syms, rng):
+    """Attempts one pivot of w at a random site with a random symmetry, as
+    `dimer_pivot` does before every join"""
+    j = rng.integers(0, len(w))
+    sym = syms[rng.integers(0, len(syms))]
+    pivot_inplace(w, wt, ss, j, sym)
+
+
+@njit
+def _joint_pivot(w, wt, ss, syms, rng, at_end):
+    """Attempts a pivot of w that rotates the d sites nearest to its end
+    (or start), with d log-uniform in [1, len(w) / 2].
+
+    Such pivots reshape the walk around the joint at every scale and are
+    accepted far more often than pivots at uniformly random sites.
+    """
+    N = len(w)
+    d = min(int((N // 2 + 1) ** rng.random()), N // 2)
+    sym = syms[rng.integers(0, len(syms))]
+    pivot_inplace(w, wt, ss, N - 1 - d if at_end else d, sym)
+
+
+@njit
+def _fits(wl, wr, ss):
+    """Whether wr, attached by its first site to the last site of wl, avoids
+    wl, checked outward from the joint with a single site set. This is the
+    cheapest check when it is likely to succeed, see `_can_join` for retries."""
+    nl = len(wl)
+    nr = len(wr)
+    clear_site_set(ss)
+    bits = key_bits(wl.shape[1], nl + nr)
+    refl = wl[nl - 1]
+    refr = wr[0]
+    for step in range(max(nl, nr - 1)):
+        jj = nl - 1 - step
+        if jj >= 0 and not add_site(ss, wl[jj], refl, bits):
+            return False
+        ii = step + 1
+        if ii < nr and not add_site(ss, wr[ii], refr, bits):
+            return False
+    return True
+
+
+@njit
+def _can_join(wl, wr, sym, left, filled, right, y):
+    """Whether wr, transformed by sym and attached by its first site to the
+    last site of wl, avoids wl.
+
+    Sites are checked outward from the joint, where collisions are most
+    likely, so a failing join usually costs only a few lookups. The sites of
+    wl go into the site set left, which persists across calls for as long as
+    wl does not change: its first `filled` sites from the joint are already
+    in it, and it is only extended as far as a check needs to go. The sites
+    of wr only go into right, which is cleared for every call. A pair of
+    colliding sites is caught when whichever of them is inserted second is
+    looked up in the other set.
+
+    Returns
+    -------
+    bool, int
+        Whether the halves can be joined, and the new value of filled
+    """
+    nl = len(wl)
+    nr = len(wr)
+    clear_site_set(right)
+    bits = key_bits(wl.shape[1], nl + nr)
+    # wl is keyed relative to its last site and the transformed wr relative
+    # to the origin, so the two halves meet at key zero
+    refl = wl[nl - 1]
+    refr = wr[0]
+    origin = np.zeros_like(y)
+    code = sym_code(sym)
+    for step in range(max(nl, nr - 1)):
+        jj = nl - 1 - step
+        if step >= filled and jj >= 0:
+            if contains_site(right, wl[jj], refl, bits):
+                return False, filled
+            add_site(left, wl[jj], refl, bits)
+            filled = step + 1
+        ii = step + 1
+        if ii < nr:
+            transform_site_code(code, wr[ii], refr, y)
+            if contains_site(left, y, origin, bits):
+                return False, filled
+            add_site(right, y, origin, bits)
+    return True, filled
+
+
+@njit
+def _shuffle(order, rng):
+    for i in range(len(order) - 1, 0, -1):
+        j = rng.integers(0, i + 1)
+        order[i], order[j] = order[j], order[i]
+
+
+@njit
+def dimerize_steps(n, dim, syms, rng, grow=False):
+    """Generates the steps of a SAW with n steps by bottom-up dimerization.
+
+    Parameters
+    ----------
+    n : int
+        Number of steps
+    dim : int
+        Dimension
+    syms (|G|, dim, dim) : np.ndarray
+        Symmetries to pivot the halves with, e.g. `polymers.random.Gd_array(dim)`
+    rng : np.random.Generator
+        Random generator, advanced in place
+    grow : bool, optional
+        Grow every base segment as a uniformly random SAW instead of starting
+        it as a rod along the first axis. The joins then fail more often, so
+        this is slower.
+
+    Returns
+    -------
+    np.ndarray (n, dim) int8
+        Steps of the walk, each a unit vector
+    """
+    steps = np.zeros((n, dim), dtype=np.int8)
+    if not grow:
+        steps[:, 0] = 1
+    nl = n // 2 + 1
+    nr = n - n // 2 + 1
+    wl = np.empty((nl, dim), dtype=np.int32)
+    wr = np.empty((nr, dim), dtype=np.int32)
+    wt = np.empty_like(wr)
+    ss = site_set(nr)
+    left = site_set(nl)
+    right = site_set(nr)
+    y = np.empty(dim, dtype=np.int64)
+    identity = np.eye(dim, dtype=np.int64)
+    order = np.arange(len(syms))
+    if grow and n <= _BASE:
+        _grow(steps, 0, n, np.empty((n + 1, dim), dtype=np.int32), ss, rng)
+    for node in _join_order(n):
+        a, b = node[0], node[1]
+        m = a + (b - a) // 2
+        # segments are listed children first, so a base segment is grown
+        # just before its first join
+        if grow and m - a <= _BASE:
+            _grow(steps, a, m, wl, ss, rng)
+        if grow and b - m <= _BASE:
+            _grow(steps, m, b, wr, ss, rng)
+        wa = wl[:m - a + 1]
+        wb = wr[:b - m + 1]
+        _load(steps, a, m, wa)
+        _load(steps, m, b, wb)
+        _random_pivot(wa, wt, ss, syms, rng)
+        _random_pivot(wb, wt, ss, syms, rng)
+        ok = _fits(wa, wb, ss)
+        sym = identity
+        clear_site_set(left)
+        filled = 0
+        while not ok:
+            # try other orientations of wb about the joint against the hash
+            # of wa, then reshape both halves near the joint
+            _shuffle(order, rng)
+            for k in order[:_ORIENTATIONS]:
+                sym = syms[k]
+                ok, filled = _can_join(wa, wb, sym, left, filled, right, y)
+                if ok:
+                    break
+            if ok:
+                break
+            _joint_pivot(wa, wt, ss, syms, rng, True)
+            _joint_pivot(wb, wt, ss, syms, rng, False)
+            clear_site_set(left)
+            sym = identity
+            ok, filled = _can_join(wa, wb, sym, left, 0, right, y)
+        _store(wa, identity, steps, a)
+        _store(wb, sym, steps, m)
+    return steps
+
+
+@njit
+def _steps_to_sites(steps, sites):
+    n, dim = steps.shape
+    sites[0] = 0
+    for i in range(n):
+        for k in range(dim):
+            sites[i + 1, k] = sites[i, k] + steps[i, k]
+
+
+def steps_to_walk(steps):
+    """Walk (dim, n + 1) with the given steps, starting at the origin, in the
+    narrowest safe dtype (see `polymers.walk`). It is the transpose of a
+    C-contiguous (n + 1, dim) array of sites, which is what `walk.T` returns
+    without a copy, ready for `polymers.walk.save_walk`."""
+    n, dim = steps.shape
+    sites = np.empty((n + 1, dim), dtype=walk_dtype(n + 1))
+    _steps_to_sites(steps, sites)
+    return sites.T
+
+
+def dimer_iterative(n, dim=2, rng=None, init_method='rod'):
+    """
+    Generates a SAW of length n by bottom-up dimerization, see `dimerize_steps`
+
+    Args:
+        n (int): the length of the walk
+        dim (int): the dimension
+        rng (np.random.Generator): random generator, by default `polymers.random.RNG`
+        init_method (str): base segments, one of `INIT_METHODS`: 'rod' starts
+            them as rods, 'naive' grows them uniformly with `grow_steps`
+    Returns:
+        np.ndarray (dim, n + 1): SAW of length n, starting at the origin,
+            in the narrowest safe dtype
+    """
+    if init_method not in INIT_METHODS:
+        raise ValueError(f"unknown init method '{init_method}', expected one of {INIT_METHODS}")
+    if rng is None:
+        rng = polymers.random.RNG
+    syms = polymers.random.Gd_array(dim)
+    return steps_to_walk(dimerize_steps(n, dim, syms, rng, init_method == 'naive'))
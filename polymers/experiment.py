@@ -0,0 +1,364 @@
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm, trange
+
+import polymers.random
+from polymers.dimer.batch import select_walk
+from polymers.walk import load_walk
+from polymers.pivot.chain import PivotChain, OBSERVABLES
+from polymers.pivot.tree import TreeChain
+from polymers.pivot.lazy import LazyChain
+from polymers.pivot.batch import BatchChain
+from polymers.pivot.local import HybridChain
+from polymers.pivot.isaw import ContactChain
+from polymers.random import Gd_array
+from polymers.results import ResultWriter, load_results, save_checkpoint, load_checkpoint
+from polymers.stats import StreamingStats
+
+__all__ = ['ENGINES', 'THERMAL_ENGINES', 'BATCH_COLUMNS', 'STEP_COLUMNS', 'run_SAW', 'run_parallel', 'run_batched']
+
+# engine name -> chain class, see `polymers.pivot.chain.PivotChain`
+ENGINES = {
+    'fast': PivotChain,
+    'tree': TreeChain,
+    'lazy': LazyChain,
+    'hybrid': HybridChain,
+    'isaw': ContactChain,
+}
+
+# columns of the result set written by run_SAW, one row per batch
+BATCH_COLUMNS = {
+    'batch': np.int64,
+    'acceptance': np.float64,
+    'Re2': np.float64,
+    'Rg2': np.float64,
+    'Rm2': np.float64,
+    'time_elapsed': np.float64,
+}
+
+# columns of the per-step result set, one row per pivot attempt
+STEP_COLUMNS = {name: np.float64 for name in OBSERVABLES}
+
+# engines that take an inverse temperature beta
+THERMAL_ENGINES = ('isaw',)
+
+# checkpoint file inside a result set
+CHECKPOINT = 'checkpoint.pkl'
+
+def run_SAW(init_walk, batch_size, batches, out, engine='fast', rng=None, progress=True,
+            target_error=None, min_batches=100, per_step=False, metadata=None,
+            resume=False, checkpoint_interval=600, moves='all', beta=None):
+    """
+    Runs a batch of SAWs and returns the statistics of their observables
+
+    engine selects how the walk is stored while pivoting: 'fast' keeps the
+    (dim, N) array, 'tree' uses the SAW-tree of `polymers.pivot.tree` and
+    'lazy' defers accepted pivots as segment transforms, see `polymers.pivot.lazy`,
+    'hybrid' follows every pivot attempt with local moves, see
+    `polymers.pivot.local`, and 'isaw' samples interacting SAWs at inverse
+    temperature beta, see `polymers.pivot.isaw`; beta is only taken by the
+    engines in `THERMAL_ENGINES`.
+    rng defaults to `polymers.random.RNG`. moves selects the symmetries to
+    pivot with, see `polymers.pivot.moves.move_set`; a weight per symmetry
+    must give every symmetry the same weight as its inverse, or the chain
+    would not sample SAWs uniformly.
+
+    The observables after every batch are written to the result set out
+    (see `polymers.results`, columns `BATCH_COLUMNS`), with d, N, the engine,
+    the batch size and metadata in its manifest. With per_step, the
+    observables after every single pivot attempt are also written to
+    out/steps (columns `STEP_COLUMNS`); this needs the 'fast', 'hybrid' or
+    'isaw' engine. Engines that record more observables than `OBSERVABLES`
+    (such as the contacts C of 'isaw') add them as columns to both.
+
+    Re2, Rg2 and Rm2 are fed to a `polymers.stats.StreamingStats` (per step
+    with per_step, else per batch), whose means, errors and autocorrelation
+    times are shown on the progress bar about once a second. If target_error
+    is given, the chain stops as soon as the relative errors of all three are
+    below it, but not before min_batches batches.
+
+    Every checkpoint_interval seconds, and at the end, the chain state
+    (walk, random generator state, batch counter, statistics and committed
+    rows) is atomically saved to out/checkpoint.pkl. With resume, a run
+    continues from that checkpoint exactly as if it had not been
+    interrupted, dropping any rows written after it; rng must be a generator
+    of the same kind as the one that was checkpointed. Once a run has
+    finished, its manifest is marked complete (metadata['complete']) and
+    holds the attempted and accepted moves per symmetry and per pivot
+    position (metadata['move_stats'], see `PivotChain.move_summary`).
+    Resuming a finished run only makes sure of that, and returns its
+    statistics.
+    """
+    if rng is None:
+        rng = polymers.random.RNG
+    dim, N = init_walk.shape
+    options = {}
+    if beta is not None:
+        if engine not in THERMAL_ENGINES:
+            raise ValueError(f"engine '{engine}' does not take beta")
+        options['beta'] = beta
+    chain = ENGINES[engine](init_walk, syms=Gd_array(dim), rng=rng, moves=moves, **options)
+    if per_step and not hasattr(chain, 'sample'):
+        raise ValueError(f"engine '{engine}' cannot sample every step")
+    names = getattr(chain, 'observable_names', OBSERVABLES)
+    extra = names[len(OBSERVABLES):]
+    batch_columns = dict(BATCH_COLUMNS, **{name: np.float64 for name in extra})
+    step_columns = {name: np.float64 for name in names}
+
+    checkpoint_file = os.path.join(out, CHECKPOINT)
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_file):
+        checkpoint = load_checkpoint(checkpoint_file)
+
+    steps_out = os.path.join(out, 'steps')
+    if checkpoint is None:
+        meta = dict(d=dim, N=N, engine=engine, batch_size=batch_size,
+                    moves=moves if isinstance(moves, str) else list(moves), **options,
+                    **(metadata or {}))
+        writer = ResultWriter(out, batch_columns, metadata=meta)
+        if per_step:
+            steps = ResultWriter(steps_out, step_columns, metadata=meta)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        stats = StreamingStats(('Re2', 'Rg2', 'Rm2'))
+        start = 0
+    else:
+        writer = ResultWriter(out, batch_columns, resume=True)
+        writer.truncate(checkpoint['rows'])
+        if per_step:
+            steps = ResultWriter(steps_out, step_columns, resume=True)
+            steps.truncate(checkpoint['step_rows'])
+        chain.set_state(checkpoint['chain'])
+        stats = checkpoint['stats']
+        start = checkpoint['batch']
+
+    def save(batch, complete=False):
+        writer.flush()
+        if per_step:
+            steps.flush()
+        save_checkpoint(checkpoint_file, dict(
+            batch=batch, rows=writer.rows, step_rows=steps.rows if per_step else 0,
+            chain=chain.get_state(), stats=stats, complete=complete))
+
+    def finish():
+        if per_step:
+            steps.set_metadata(complete=True)
+        writer.set_metadata(move_stats=chain.move_summary(), complete=True)
+
+    if checkpoint is not None and checkpoint['complete']:
+        # the run has finished, but may have stopped before it marked its
+        # result sets complete
+        finish()
+        return stats
+
+    pbar = trange(start, batches, desc=f"Batches of {batch_size}", ncols=80,
+                  disable=not progress)
+    reported = saved = time.time()
+    i = start - 1
+    for i in pbar:
+        tic = time.time()
+        accepted = chain.accepted
+        if per_step:
+            samples = chain.sample(batch_size)
+        else:
+            chain.step(batch_size)
+        toc = time.time()
+        acceptance = (chain.accepted - accepted) / batch_size
+        obs = chain.observables()
+        re2, rg2, rm2 = obs[:3]
+        writer.append(batch=(i+1)*batch_size, acceptance=acceptance, Re2=re2, Rg2=rg2,
+                      Rm2=rm2, time_elapsed=toc-tic,
+                      **{name: obs[len(OBSERVABLES) + k] for k, name in enumerate(extra)})
+        if per_step:
+            steps.extend(**{name: samples[:, k] for k, name in enumerate(names)})
+            stats.add(samples[:, :3])
+        else:
+            stats.add([re2, rg2, rm2])
+        if progress and toc - reported > 1:
+            pbar.set_postfix_str(stats.report())
+            reported = toc
+        if target_error is not None and i + 1 >= min_batches and stats.converged(target_error):
+            break
+        if toc - saved > checkpoint_interval:
+            save(i + 1)
+            saved = time.time()
+    pbar.close()
+
+    save(i + 1, complete=True)
+    finish()
+    return stats
+
+def _chain_out(out, c):
+    root, ext = os.path.splitext(out)
+    return f"{root}.chain{c}{ext}"
+
+def _run_chain(file, c, out, seed, batch_size, batches, engine, target_error, per_step,
+               resume, moves, beta):
+    """Worker: runs chain c, started from the walk in file (or from its c-th
+    walk if it holds a stack of walks, see `polymers.dimer.dimer_batch`)"""
+    walk = select_walk(load_walk(file), c).T
+    rng = np.random.default_rng(seed)
+    metadata = dict(walk_file=file, seed=seed.entropy, spawn_key=list(seed.spawn_key))
+    stats = run_SAW(walk, batch_size, batches, out, engine=engine, rng=rng, progress=False,
+                    target_error=target_error, per_step=per_step, metadata=metadata,
+                    resume=resume, moves=moves, beta=beta)
+    return stats.summary()
+
+# metadata that differs between the chains of a merged result set
+_CHAIN_KEYS = ('seed', 'spawn_key', 'move_stats')
+
+def _merge_results(chain_outs, out, subdir=''):
+    """Concatenates per-chain result sets into out, adding a chain column"""
+    parts = [load_results(os.path.join(chain_out, subdir)) for chain_out in chain_outs]
+    columns = {'chain': np.int64}
+    columns.update((name, col.dtype) for name, col in parts[0][0].items())
+    metadata = {k: v for k, v in parts[0][1].items()
+                if k not in _CHAIN_KEYS + ('complete',)}
+    metadata['chains'] = [{k: meta.get(k) for k in _CHAIN_KEYS} for _, meta in parts]
+    writer = ResultWriter(os.path.join(out, subdir), columns, metadata=metadata)
+    for c, (cols, _) in enumerate(parts):
+        rows = len(next(iter(cols.values())))
+        writer.extend(chain=np.full(rows, c), **cols)
+    writer.set_metadata(complete=True)
+
+def run_parallel(jobs, batch_size, batches, chains=1, workers=None, seed=None, engine='fast',
+                 target_error=None, per_step=False, resume=False, moves='all', beta=None):
+    """Runs independent pivot chains for many walk files on a process pool.
+
+    Every (file, chain) pair is a separate task with its own random stream:
+    the root `np.random.SeedSequence(seed)` is spawned once per file and each
+    file's sequence once per chain, so a chain's stream depends only on the
+    seed, the position of its file in jobs and its chain index. If a walk
+    file holds a stack of walks, chain c starts from walk c (modulo their
+    number), so chains need not share a starting state. Chains write
+    their own result sets, which are merged into the file's (with a `chain`
+    column) once all of its chains are done. The merged result set is only
+    marked complete once it has been fully written.
+
+    Parameters
+    ----------
+    jobs : list of (str, str)
+        (walk file, result set) pairs
+    batch_size : int
+        Pivot attempts between samples
+    batches : int
+        Number of samples per chain
+    chains : int, optional
+        Chains per walk file, by default 1
+    workers : int, optional
+        Number of worker processes, by default os.cpu_count()
+    seed : int, optional
+        Root seed, by default fresh entropy
+    engine : str, optional
+        Pivot engine, see `ENGINES`
+    target_error : float, optional
+        Relative error at which each chain stops early, see `run_SAW`
+    per_step : bool, optional
+        Also record every pivot attempt, see `run_SAW`
+    resume : bool, optional
+        Continue every chain from its last checkpoint, see `run_SAW`
+    moves : str or array_like, optional
+        Symmetries to pivot with, see `run_SAW`
+    beta : float, optional
+        Inverse temperature of a thermal engine, see `run_SAW`
+
+    Returns
+    -------
+    dict
+        result set -> list of `StreamingStats.summary` of its chains
+    """
+    seqs = np.random.SeedSequence(seed).spawn(len(jobs))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for (file, out), seq in zip(jobs, seqs):
+            chain_outs = [_chain_out(out, c) for c in range(chains)]
+            for c, chain_seq in enumerate(seq.spawn(chains)):
+                future = pool.submit(_run_chain, file, c, chain_outs[c], chain_seq, batch_size,
+                                     batches, engine, target_error, per_step, resume, moves,
+                                     beta)
+                pending[future] = (out, chain_outs, c)
+
+        remaining = {out: chains for _, out in jobs}
+        summaries = {out: [None] * chains for _, out in jobs}
+        for future in tqdm(as_completed(pending), total=len(pending), desc="Chains", ncols=80):
+            out, chain_outs, c = pending[future]
+            summaries[out][c] = future.result()
+            remaining[out] -= 1
+            if remaining[out] == 0:
+                if per_step:
+                    _merge_results(chain_outs, out, 'steps')
+                _merge_results(chain_outs, out)
+                for chain_out in chain_outs:
+                    shutil.rmtree(chain_out)
+    return summaries
+
+def run_batched(jobs, batch_size, batches, chains=1, seed=None, moves='all', progress=True):
+    """Runs the chains of every walk file together in this process.
+
+    The chains of a file are advanced by one `polymers.pivot.batch.BatchChain`,
+    which spreads them over all cores without any worker processes, and are
+    written straight to the file's result set in the merged layout of
+    `run_parallel` (`BATCH_COLUMNS` and a `chain` column). Chain c starts
+    from walk c of the file as in `run_parallel`, and its random stream is
+    spawned from the seed in the same way, but is a xoshiro256** stream
+    (see `polymers.random.stream_states`).
+
+    Unlike `run_SAW`, chains are not checkpointed and do not stop early.
+
+    Parameters
+    ----------
+    jobs : list of (str, str)
+        (walk file, result set) pairs
+    batch_size : int
+        Pivot attempts between samples
+    batches : int
+        Number of samples per chain
+    chains : int, optional
+        Chains per walk file, by default 1
+    seed : int, optional
+        Root seed, by default fresh entropy
+    moves : str or array_like, optional
+        Symmetries to pivot with, see `run_SAW`
+    progress : bool, optional
+        Whether to show a progress bar
+
+    Returns
+    -------
+    dict
+        result set -> list of `StreamingStats.summary` of its chains
+    """
+    seqs = np.random.SeedSequence(seed).spawn(len(jobs))
+    summaries = {}
+    for (file, out), seq in zip(jobs, seqs):
+        walks = load_walk(file)
+        walks = np.stack([select_walk(walks, c) for c in range(chains)])
+        _, N, dim = walks.shape
+        chain = BatchChain(walks, syms=Gd_array(dim), seed=seq, moves=moves)
+        columns = {'chain': np.int64}
+        columns.update(BATCH_COLUMNS)
+        meta = dict(d=dim, N=N, engine='batch', batch_size=batch_size,
+                    moves=moves if isinstance(moves, str) else list(moves), walk_file=file,
+                    chains=[dict(seed=seq.entropy, spawn_key=list(seq.spawn_key) + [c])
+                            for c in range(chains)])
+        writer = ResultWriter(out, columns, metadata=meta)
+        stats = [StreamingStats(('Re2', 'Rg2', 'Rm2')) for _ in range(chains)]
+        for i in trange(batches, desc=f"{chains} chains, batches of {batch_size}", ncols=80,
+                        disable=not progress):
+            tic = time.time()
+            accepted = chain.step(batch_size)
+            toc = time.time()
+            obs = chain.observables()
+            writer.extend(chain=np.arange(chains), batch=np.full(chains, (i+1)*batch_size),
+                          acceptance=accepted / batch_size, Re2=obs[:, 0], Rg2=obs[:, 1],
+                          Rm2=obs[:, 2], time_elapsed=np.full(chains, toc-tic))
+            for c in range(chains):
+                stats[c].add(obs[c, :3])
+        for c, chain_meta in enumerate(meta['chains']):
+            chain_meta['move_stats'] = chain.move_summary(c)
+        writer.set_metadata(chains=meta['chains'], complete=True)
+        summaries[out] = [s.summary() for s in stats]
+    return summaries
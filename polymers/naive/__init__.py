@@ -1 +1,2 @@
-from polymers.naive.saw import naive_self_avoiding_walk
\ No newline at end of file
+from polymers.naive.saw import naive_self_avoiding_walk
+from polymers.naive.growth import grow_walk, rosenbluth
@@ -0,0 +1,128 @@
+"""Step-direction packing of walks.
+
+Consecutive sites of a walk are lattice neighbours, so a walk of N sites is
+its first site and N - 1 steps, each one of 2d directions. Direction
+2a + s is a step along axis a, in the negative (s = 0) or positive (s = 1)
+sense, and takes `step_bits` bits: 2 in 2D, 3 in 3D. Codes are packed
+into int64 words, `steps_per_word` to a word starting from the least
+significant bits, so that no code straddles two words and every walk of a
+stack can be decoded on its own.
+
+See `polymers.walk.save_walk` for the file format built on this.
+"""
+import numpy as np
+from numba import njit
+
+from polymers.pivot.sitehash import _NJIT_NO_NRT
+
+__all__ = ['step_bits', 'steps_per_word', 'packed_words', 'pack_steps', 'unpack_steps',
+           'pack_walks', 'unpack_walks']
+
+
+@njit
+def step_bits(dim):
+    """Bits per step of a walk in dim dimensions"""
+    bits = 1
+    while (1 << bits) < 2 * dim:
+        bits += 1
+    return bits
+
+
+@njit
+def steps_per_word(dim):
+    """Steps packed into one int64 word"""
+    return 64 // step_bits(dim)
+
+
+@njit
+def packed_words(N, dim):
+    """Words holding the steps of a walk of N sites"""
+    per_word = steps_per_word(dim)
+    return (max(N - 1, 0) + per_word - 1) // per_word
+
+
+@njit
+def pack_steps(w, words):
+    """Packs the steps of w (N, dim) into words (`packed_words(N, dim)`,),
+    raising a ValueError if two consecutive sites are not neighbours"""
+    N, dim = w.shape
+    bits = step_bits(dim)
+    per_word = 64 // bits
+    words[:] = 0
+    for i in range(1, N):
+        code = -1
+        for a in range(dim):
+            d = np.int64(w[i, a]) - np.int64(w[i - 1, a])
+            if d == 0:
+                continue
+            if code >= 0 or (d != 1 and d != -1):
+                code = -1
+                break
+            code = 2 * a + (1 if d > 0 else 0)
+        if code < 0:
+            raise ValueError("consecutive sites of the walk are not neighbours")
+        k = i - 1
+        words[k // per_word] |= np.int64(code) << ((k % per_word) * bits)
+
+
+@_NJIT_NO_NRT
+def unpack_steps(words, origin, out):
+    """Decodes the steps in words, starting from origin (dim,), into the
+    sites out (N, dim) of any integer dtype wide enough to hold them.
+
+    Raises a ValueError if words has fewer than `packed_words(N, dim)`
+    words or holds a code that is not a direction in dim dimensions, so
+    that a corrupt or mismatched walk is never written out of bounds.
+    """
+    N, dim = out.shape
+    if N == 0:
+        return
+    bits = step_bits(dim)
+    per_word = 64 // bits
+    if len(words) * per_word < N - 1 or len(origin) != dim:
+        raise ValueError("packed walk does not match the shape of its buffer")
+    mask = (np.int64(1) << bits) - 1
+    for a in range(dim):
+        out[0, a] = origin[a]
+    i = 1
+    for word in words:
+        # the arithmetic shift smears the sign bit only into bits that are masked off
+        for _ in range(min(per_word, N - i)):
+            code = word & mask
+            word >>= bits
+            if code >= 2 * dim:
+                raise ValueError("invalid step code in packed walk")
+            for a in range(dim):
+                out[i, a] = out[i - 1, a]
+            out[i, code >> 1] += 2 * (code & 1) - 1
+            i += 1
+
+
+@njit
+def pack_walks(walks):
+    """Packs a stack of walks (count, N, dim).
+
+    Returns
+    -------
+    np.ndarray (count, dim), np.ndarray (count, `packed_words(N, dim)`)
+        First site and packed steps of every walk, int64
+    """
+    count, N, dim = walks.shape
+    origins = np.empty((count, dim), dtype=np.int64)
+    words = np.empty((count, packed_words(N, dim)), dtype=np.int64)
+    for c in range(count):
+        if N > 0:
+            origins[c] = walks[c, 0]
+        else:
+            origins[c] = 0
+        pack_steps(walks[c], words[c])
+    return origins, words
+
+
+@njit
+def unpack_walks(origins, words, out):
+    """Decodes the walks packed by `pack_walks` into out (count, N, dim)"""
+    if len(origins) != len(out) or len(words) != len(out):
+        raise ValueError("packed walks do not match the shape of their buffer")
+    for c in range(len(out)):
+        unpack_steps(words[c], origins[c], out[c])
@@ -1 +1,16 @@
-from .fast import attempt_pivot, is_valid_two, merge, shift_to_origin
\ No newline at end of file
+import importlib
+
+# imported on first use, see polymers/__init__.py
+_LAZY = {
+    'attempt_pivot': 'polymers.pivot.fast',
+    'is_valid_two': 'polymers.pivot.fast',
+    'merge': 'polymers.pivot.fast',
+    'shift_to_origin': 'polymers.pivot.fast',
+    'PivotChain': 'polymers.pivot.chain',
+}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        return getattr(importlib.import_module(_LAZY[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,182 @@
+"""Pivot engine that runs many chains on walks of the same length at once.
+
+For small N a chain spends most of its time in the overhead of calling into
+compiled code and of the process that runs it, rather than in pivot
+attempts. `BatchChain` holds B walks in one (B, N, dim) array, with a site
+set, running moments, a random stream (see `polymers.random.stream_states`),
+acceptance counts, move statistics and observable accumulators per walk, and
+advances all of them with a single parallel kernel, so that one process keeps
+every core busy.
+
+Each walk follows exactly the chain of `polymers.pivot.chain.PivotChain`,
+except that its moves are drawn from its xoshiro256** stream instead of a
+np.random.Generator.
+"""
+import numpy as np
+from numba import njit, prange
+
+import polymers.random
+from polymers.analysis import track_moments, tracked_observables
+from polymers.pivot.chain import OBSERVABLES, check_pivot, apply_pivot
+from polymers.pivot.moves import MoveStats, move_set, move_stats, record_move, move_summary
+from polymers.pivot.sitehash import SiteSet, site_set, bitmap_radius, walk_span
+from polymers.random import stream_states, stream_integers, stream_random
+
+__all__ = ['BatchChain', 'run_batch']
+
+
+def _site_sets(count, N, dim, radius):
+    """`SiteSet` whose arrays stack count site sets of N sites"""
+    sets = [site_set(N, dim, radius) for _ in range(count)]
+    return SiteSet(*(np.stack(field) for field in zip(*sets)))
+
+
+@njit
+def _draw_move(cdf, count, s):
+    """`polymers.pivot.moves.draw_move` from the stream s"""
+    if len(cdf) == 0:
+        return stream_integers(s, count)
+    return min(np.searchsorted(cdf, stream_random(s), side='right'), count - 1)
+
+
+@njit(parallel=True)
+def run_batch(sites, scratch, sets, syms, cdf, n, states, refs, moments, accepted, sums,
+              sym_stats, position_stats):
+    """Runs n pivot attempts on each of B walks in parallel.
+
+    Parameters
+    ----------
+    sites, scratch (B, N, dim) : np.ndarray
+        Walks and their scratch buffers, int64
+    sets : SiteSet
+        B site sets, stacked along the first axis of every array
+    syms (K, dim, dim) : np.ndarray
+        Symmetries to pivot with
+    cdf (K,) or (0,) : np.ndarray
+        Distribution of syms, see `polymers.pivot.moves.draw_move`
+    n : int
+        Pivot attempts per walk
+    states (B, 4) : np.ndarray
+        Random stream of every walk, see `polymers.random.stream_states`
+    refs (B, dim), moments (B, dim + 1) : np.ndarray
+        Running moments of every walk, see `polymers.analysis.track_moments`
+    accepted (B,) : np.ndarray
+        Accepted pivots per walk, incremented in place
+    sums (B, 2, 4) : np.ndarray
+        Sums of the observables (`OBSERVABLES`) and of their squares after
+        every attempt, incremented in place
+    sym_stats (B, K, 2), position_stats (B, P, 2) : np.ndarray
+        `MoveStats` of every walk, incremented in place
+    """
+    B, N, dim = sites.shape
+    for b in prange(B):
+        w = sites[b]
+        wt = scratch[b]
+        ref = refs[b]
+        m = moments[b]
+        s = states[b]
+        ss = SiteSet(sets.lo[b], sets.hi[b], sets.stamp[b], sets.meta[b], sets.words[b],
+                     sets.touched[b])
+        stats = MoveStats(sym_stats[b], position_stats[b])
+        # keep the moments accurate, as `PivotChain.resync` does
+        if np.abs(w[0] - ref).max() > N:
+            ref[:] = w[0]
+            track_moments(w, ref, m)
+        for _ in range(n):
+            j = stream_integers(s, N)
+            k = _draw_move(cdf, len(syms), s)
+            moved = check_pivot(w, wt, ss, j, syms[k])
+            if moved:
+                apply_pivot(w, wt, j, ref, m)
+                accepted[b] += 1
+            record_move(stats, k, j, N, moved)
+            obs = tracked_observables(m, ref, w[0], w[N - 1], N)
+            for q in range(len(obs)):
+                sums[b, 0, q] += obs[q]
+                sums[b, 1, q] += obs[q] * obs[q]
+
+
+class BatchChain:
+    """B pivot Markov chains on walks of N sites, advanced together.
+
+    Parameters
+    ----------
+    walks (B, N, dim) : np.ndarray
+        Initial self-avoiding walks, in the layout of
+        `polymers.walk.load_walk`. They are copied.
+    syms (|G|, dim, dim) : np.ndarray, optional
+        Symmetries to pivot with, by default every non-identity element of G_d
+    seed : int or np.random.SeedSequence, optional
+        Seed of the random streams, one spawned per walk, by default fresh
+        entropy
+    moves : str or array_like, optional
+        Which of syms to pivot with and how often, see
+        `polymers.pivot.moves.move_set`
+    """
+
+    def __init__(self, walks, syms=None, seed=None, moves='all'):
+        B, N, dim = walks.shape
+        self.sites = np.array(walks, dtype=np.int64, order='C')
+        self.scratch = np.empty_like(self.sites)
+        span = max((walk_span(w) for w in self.sites), default=0)
+        self.site_sets = _site_sets(B, N, dim, bitmap_radius(dim, span))
+        if syms is None:
+            syms = polymers.random.Gd_array(dim)
+        self.syms, self.cdf = move_set(syms, moves)
+        self.states = stream_states(seed, B)
+        stats = move_stats(len(self.syms), N)
+        self.sym_stats = np.zeros((B,) + stats.sym.shape, dtype=np.int64)
+        self.position_stats = np.zeros((B,) + stats.position.shape, dtype=np.int64)
+        self.attempts = 0
+        self.accepted = np.zeros(B, dtype=np.int64)
+        self.sums = np.zeros((B, 2, len(OBSERVABLES)))
+        self.refs = self.sites[:, 0].copy()
+        self.moments = np.zeros((B, dim + 1))
+        for b in range(B):
+            track_moments(self.sites[b], self.refs[b], self.moments[b])
+
+    def __len__(self):
+        return len(self.sites)
+
+    @property
+    def acceptance(self):
+        """Fraction of attempted pivots that were accepted, per chain"""
+        return self.accepted / max(self.attempts, 1)
+
+    def step(self, n=1):
+        """Run n pivot attempts on every chain, returning the number accepted
+        per chain"""
+        before = self.accepted.copy()
+        run_batch(self.sites, self.scratch, self.site_sets, self.syms, self.cdf, n,
+                  self.states, self.refs, self.moments, self.accepted, self.sums,
+                  self.sym_stats, self.position_stats)
+        self.attempts += n
+        return self.accepted - before
+
+    def observables(self):
+        """Re2, Rg2, Rm2 and X2 of the current walks, in O(B)
+
+        Returns
+        -------
+        np.ndarray (B, 4)
+            See `OBSERVABLES`
+        """
+        N = self.sites.shape[1]
+        return np.array([tracked_observables(m, ref, w[0], w[-1], N)
+                         for m, ref, w in zip(self.moments, self.refs, self.sites)])
+
+    def means(self):
+        """Means and variances of the observables over every attempt so far
+
+        Returns
+        -------
+        np.ndarray (B, 4), np.ndarray (B, 4)
+            Per chain, see `OBSERVABLES`
+        """
+        mean = self.sums[:, 0] / max(self.attempts, 1)
+        return mean, self.sums[:, 1] / max(self.attempts, 1) - mean ** 2
+
+    def move_summary(self, b):
+        """Attempted and accepted moves of chain b, see
+        `polymers.pivot.moves.move_summary`"""
+        return move_summary(self.syms, MoveStats(self.sym_stats[b], self.position_stats[b]))
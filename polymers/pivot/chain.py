@@ -0,0 +1,335 @@
+import numpy as np
+from numba import njit
+
+import polymers.random
+from polymers.analysis import track_moments, update_moments, tracked_observables
+from polymers.pivot.fast import copy_site
+from polymers.pivot.moves import (MoveStats, move_set, draw_move, move_stats, record_move,
+                                  move_summary)
+from polymers.pivot.sitehash import (key_bits, site_set, bitmap_radius, walk_span,
+                                     clear_site_set, add_site, contains_site, _NJIT_NO_NRT)
+from polymers.symmetry import sym_code, rotate_site_code
+from polymers.walk import promote, walk_limit
+
+__all__ = ['PivotChain', 'OBSERVABLES', 'check_pivot', 'apply_pivot', 'pivot_inplace',
+           'run_pivots']
+
+# observables recorded by PivotChain.sample, in column order
+OBSERVABLES = ('Re2', 'Rg2', 'Rm2', 'X2')
+
+
+@njit
+def _rotated_side(j, N):
+    """Direction (-1 before the pivot, +1 after it) and length of the
+    shorter side of a walk of N sites pivoted about site j"""
+    if j < N / 2:
+        return -1, j
+    return 1, N - 1 - j
+
+
+@_NJIT_NO_NRT
+def check_pivot(w, wt, ss, j, sym):
+    """Checks whether pivoting walk w about site j keeps it self-avoiding.
+
+    The shorter side of the walk is rotated into the scratch buffer wt while
+    sites are checked outward from the pivot, as in `fast.intersect_pivot`.
+    Once every rotated site has been placed, the remaining sites of the fixed
+    side only need to be looked up, not inserted. w itself is not modified.
+
+    Parameters
+    ----------
+    w (N, dim) : np.ndarray
+        Walk to pivot
+    wt (N, dim) : np.ndarray
+        Scratch buffer, only the rotated side is written
+    ss : SiteSet
+        Site set with room for N sites, cleared on entry
+    j : int
+        Index of site to pivot about
+    sym (dim, dim) : np.ndarray
+        Symmetry matrix, a signed permutation (see `polymers.symmetry`)
+
+    Returns
+    -------
+    bool
+        Whether the pivot is valid
+    """
+    N, dim = w.shape
+    code = sym_code(sym)
+    clear_site_set(ss)
+    bits = key_bits(dim, N)
+    ref = w[j]
+    add_site(ss, ref, ref, bits)
+
+    direction, nrot = _rotated_side(j, N)
+    for step in range(1, nrot + 1):
+        jj = j + direction * step
+        rotate_site_code(code, ref, w[jj], wt[jj])
+        if not add_site(ss, wt[jj], ref, bits):
+            return False
+        ii = j - direction * step
+        if not add_site(ss, w[ii], ref, bits):
+            return False
+
+    for step in range(nrot + 1, N):
+        ii = j - direction * step
+        if ii < 0 or ii >= N:
+            break
+        if contains_site(ss, w[ii], ref, bits):
+            return False
+    return True
+
+
+@njit
+def apply_pivot(w, wt, j, ref, m):
+    """Copies the rotated side left in wt by `check_pivot` back into w.
+
+    If m is non-empty, the running moments m (relative to ref, see
+    `polymers.analysis.track_moments`) are updated for every moved site.
+    """
+    direction, nrot = _rotated_side(j, len(w))
+    track = len(m) > 0
+    for step in range(1, nrot + 1):
+        jj = j + direction * step
+        if track:
+            update_moments(m, ref, w[jj], wt[jj])
+        copy_site(wt[jj], w[jj])
+
+
+@njit
+def pivot_inplace(w, wt, ss, j, sym):
+    """Attempt to pivot walk w about site j, rewriting only the rotated side.
+
+    See `check_pivot` for the arguments. On rejection w is untouched.
+
+    Returns
+    -------
+    bool
+        Whether the pivot was accepted
+    """
+    if not check_pivot(w, wt, ss, j, sym):
+        return False
+    apply_pivot(w, wt, j, w[j], np.empty(0))
+    return True
+
+
+@njit
+def _step(w, wt, ss, syms, cdf, n, rng, ref, m, out, limit, stats):
+    """Runs n pivot attempts with symmetries drawn from syms and cdf (see
+    `polymers.pivot.moves.draw_move`), keeping the moments m up to date if
+    non-empty, recording observables after every attempt into out if
+    non-empty and counting every attempt in the `MoveStats` stats.
+
+    Stops early once the first site of the walk is further than limit from
+    the origin in any coordinate, after which the next pivot could overflow
+    the walk's dtype (see `polymers.walk`).
+
+    Returns
+    -------
+    int, int
+        Number of accepted pivots, and number of attempts made
+    """
+    N = len(w)
+    sample = len(out) > 0
+    accepted = 0
+    for t in range(n):
+        j = rng.integers(0, N)
+        k = draw_move(cdf, len(syms), rng)
+        moved = False
+        if check_pivot(w, wt, ss, j, syms[k]):
+            apply_pivot(w, wt, j, ref, m)
+            accepted += 1
+            moved = True
+        record_move(stats, k, j, N, moved)
+        if sample:
+            out[t, 0], out[t, 1], out[t, 2], out[t, 3] = tracked_observables(
+                m, ref, w[0], w[N - 1], N)
+        if moved and np.abs(w[0]).max() > limit:
+            return accepted, t + 1
+    return accepted, n
+
+
+@njit
+def run_pivots(walk, syms, n, rng):
+    """Runs a batch of n pivot attempts on a copy of walk in one compiled call.
+
+    Each attempt picks a uniformly random site and a uniformly random
+    symmetry from syms, drawing from rng in the same order as
+    `critical_exp.run_SAW` did with `rand_Gd`.
+
+    Parameters
+    ----------
+    walk (dim, N) : np.ndarray
+        Walk to start from
+    syms (|G|, dim, dim) : np.ndarray
+        Symmetries to pivot with, e.g. `polymers.random.Gd_array(dim)`
+    n : int
+        Number of pivot attempts
+    rng : np.random.Generator
+        Random generator, advanced in place
+
+    Returns
+    -------
+    int, np.ndarray (dim, N)
+        Number of accepted pivots, and the final walk
+    """
+    w = walk.T.astype(np.int64)
+    wt = np.empty_like(w)
+    ss = site_set(len(w), w.shape[1], bitmap_radius(w.shape[1], walk_span(w)))
+    stats = MoveStats(np.zeros((len(syms), 2), dtype=np.int64),
+                      np.zeros((64, 2), dtype=np.int64))
+    accepted, _ = _step(w, wt, ss, syms, np.empty(0), n, rng, w[0], np.empty(0),
+                        np.empty((0, 4)), np.iinfo(np.int64).max, stats)
+    return accepted, w.T
+
+
+class PivotChain:
+    """A pivot Markov chain that owns its walk and all of its work buffers.
+
+    The walk is kept as a C-contiguous (N, dim) array next to a scratch
+    buffer of the same shape and a site set sized for N sites, so pivot
+    attempts never allocate. `step` runs many attempts in one compiled call.
+    The site set also gets a dense bitmap around the pivot if the bounding
+    box of the initial walk is small enough (see `bitmap_radius` in
+    `polymers.pivot.sitehash`), which is faster than hashing.
+
+    The walk keeps its integer dtype (see `polymers.walk`) for as long as
+    that is safe, and is promoted to a wider one once it has drifted too far
+    from the origin.
+
+    The chain also keeps running first and second moments of its sites,
+    updated from the rotated side of every accepted pivot, so that the
+    observables of the current walk cost O(1) (see `observables` and
+    `sample`). The moments are taken relative to a reference site that is
+    moved back onto the walk whenever the walk has drifted far from it.
+
+    Every attempt is counted per symmetry and per pivot position in
+    `move_stats` (see `polymers.pivot.moves`).
+
+    Parameters
+    ----------
+    walk (dim, N) : np.ndarray
+        Initial self-avoiding walk. It is copied once, straight into the
+        chain's sites (N, dim), if it is the transpose of a C-contiguous
+        array such as `polymers.walk.load_walk(file).T`.
+    syms (|G|, dim, dim) : np.ndarray, optional
+        Symmetries to pivot with, by default every non-identity element of G_d
+    rng : np.random.Generator, optional
+        Random generator to use, by default `polymers.random.RNG`
+    moves : str or array_like, optional
+        Which of syms to pivot with and how often, see
+        `polymers.pivot.moves.move_set`. By default all of them, uniformly.
+    """
+
+    def __init__(self, walk, syms=None, rng=None, moves='all'):
+        dim, N = walk.shape
+        self._set_sites(np.array(promote(walk).T, order='C'))
+        self.site_set = site_set(N, dim, bitmap_radius(dim, walk_span(self.sites)))
+        if syms is None:
+            syms = polymers.random.Gd_array(dim)
+        self.syms, self.cdf = move_set(syms, moves)
+        self.move_stats = move_stats(len(self.syms), N)
+        self.rng = polymers.random.RNG if rng is None else rng
+        self.attempts = 0
+        self.accepted = 0
+        self.ref = np.zeros(dim, dtype=np.int64)
+        self.moments = np.zeros(dim + 1)
+        self.resync()
+
+    def _set_sites(self, sites):
+        self.sites = sites
+        self.scratch = np.empty_like(sites)
+        self.limit = walk_limit(sites.dtype, len(sites))
+
+    @property
+    def walk(self):
+        """Current walk as a (dim, N) view"""
+        return self.sites.T
+
+    @property
+    def acceptance(self):
+        """Fraction of attempted pivots that were accepted"""
+        return self.accepted / max(self.attempts, 1)
+
+    def resync(self):
+        """Recomputes the running moments from scratch, relative to the first site"""
+        self.ref[:] = self.sites[0]
+        track_moments(self.sites, self.ref, self.moments)
+
+    def _check_drift(self):
+        if np.abs(self.sites[0] - self.ref).max() > len(self.sites):
+            self.resync()
+
+    def get_state(self):
+        """Everything needed to continue the chain exactly, see `set_state`"""
+        return dict(sites=self.sites.copy(), ref=self.ref.copy(), moments=self.moments.copy(),
+                    attempts=self.attempts, accepted=self.accepted,
+                    move_stats=[a.copy() for a in self.move_stats],
+                    rng=self.rng.bit_generator.state)
+
+    def set_state(self, state):
+        """Restores a state from `get_state`, including that of the random generator"""
+        self._set_sites(np.array(state['sites'], order='C'))
+        self.ref[:] = state['ref']
+        self.moments[:] = state['moments']
+        self.attempts = state['attempts']
+        self.accepted = state['accepted']
+        if 'move_stats' in state:
+            for a, saved in zip(self.move_stats, state['move_stats']):
+                a[:] = saved
+        self.rng.bit_generator.state = state['rng']
+
+    def move_summary(self):
+        """Attempted and accepted moves per symmetry and per pivot position,
+        see `polymers.pivot.moves.move_summary`"""
+        return move_summary(self.syms, self.move_stats)
+
+    def observables(self):
+        """Re2, Rg2, Rm2 and X2 of the current walk, in O(1)"""
+        return tracked_observables(self.moments, self.ref, self.sites[0],
+                                   self.sites[-1], len(self.sites))
+
+    def attempt_pivot(self, nt, sym):
+        """Attempt a single pivot about site nt, returning whether it was accepted"""
+        accepted = check_pivot(self.sites, self.scratch, self.site_set, nt,
+                               np.asarray(sym, dtype=np.int64))
+        if accepted:
+            apply_pivot(self.sites, self.scratch, nt, self.ref, self.moments)
+            if np.abs(self.sites[0]).max() > self.limit:
+                self._set_sites(np.ascontiguousarray(promote(self.walk).T))
+        self.attempts += 1
+        self.accepted += accepted
+        return accepted
+
+    def step(self, n=1):
+        """Run n pivot attempts at uniformly random sites with uniformly random
+        symmetries, returning the number accepted"""
+        return self._run(n, np.empty((0, len(OBSERVABLES))))
+
+    def sample(self, n=1):
+        """Like `step`, but records the observables after every attempt.
+
+        Returns
+        -------
+        np.ndarray (n, 4)
+            Re2, Rg2, Rm2 and X2 after each attempt, see `OBSERVABLES`
+        """
+        out = np.empty((n, len(OBSERVABLES)))
+        self._run(n, out)
+        return out
+
+    def _run(self, n, out):
+        total = 0
+        done = 0
+        while done < n:
+            self._check_drift()
+            accepted, k = _step(self.sites, self.scratch, self.site_set, self.syms,
+                                self.cdf, n - done, self.rng, self.ref, self.moments,
+                                out[done:], self.limit, self.move_stats)
+            total += accepted
+            done += k
+            if done < n:
+                self._set_sites(np.ascontiguousarray(promote(self.walk).T))
+        self.attempts += n
+        self.accepted += total
+        return total
@@ -1,7 +1,9 @@
 import numpy as np
 from numba import njit
 
-@njit
+from polymers.pivot.sitehash import key_bits, site_set, bitmap_radius, walk_span, add_site
+from polymers.walk import walk_dtype, extent
+
 def merge(walk1, walk2) -> np.ndarray:
     """Given two walks, merge them together quickly.
 
@@ -15,37 +17,48 @@ def merge(walk1, walk2) -> np.ndarray:
     Returns
     -------
     np.ndarray (dim, N1+N2-1)
-        
+        In the wider of the input dtypes and the narrowest one that is safe
+        for the merged walk, see `polymers.walk`
     """
-    walk_concat = np.zeros((walk1.shape[0], walk1.shape[1] + walk2.shape[1] - 1),
-                           dtype=np.int64)
-    walk_concat[:,:walk1.shape[1]] = walk1
+    N = walk1.shape[1] + walk2.shape[1] - 1
+    dtype = np.promote_types(np.promote_types(walk1.dtype, walk2.dtype),
+                             walk_dtype(N, extent(walk1)))
+    walk_concat = np.empty((walk1.shape[0], N), dtype=dtype)
+    _merge(walk1, walk2, walk_concat)
+    return walk_concat
 
+@njit
+def _merge(walk1, walk2, out):
+    n1 = walk1.shape[1]
+    out[:, :n1] = walk1
     # add last pt onto walk2
     for i in range(walk2.shape[0]):
-        walk2[i] += walk1[:,-1][i]
-    walk_concat[:,walk1.shape[1]-1:] = walk2
-    return walk_concat
+        for j in range(1, walk2.shape[1]):
+            out[i, n1 - 1 + j] = walk2[i, j] + walk1[i, n1 - 1]
 
 @njit
-def attempt_pivot(walk, nt, sym):
+def attempt_pivot(walk, nt, sym, string_keys=False):
     walk = walk.T
     wt = np.zeros_like(walk)
-    intersects = intersect_pivot(nt, 0, walk, wt, sym)
+    intersects = intersect_pivot(nt, 0, walk, wt, sym, string_keys)
     if intersects == 0:
         copy_walk(wt, walk)
     return walk.T, intersects != 0
 
 @njit
-def intersect_pivot(j:int, nmax:int, w:np.ndarray, wt:np.ndarray, sym:np.ndarray) -> int:
+def intersect_pivot(j:int, nmax:int, w:np.ndarray, wt:np.ndarray, sym:np.ndarray,
+                    string_keys:bool=False) -> int:
     """
     Given a walk w, attempt to pivot at site j using symmetry matrix sym.
     If the pivot is valid, return 0. Otherwise, return the number of intersections.
     
-    This uses a dictionary to keep track of sites that have been visited, and checks sites
+    This uses a hash set to keep track of sites that have been visited, and checks sites
     starting at the pivot and going outward. Using a hashmap makes this O(N), and checking
     sites outward from the pivot makes this O(N^(1-p)), where p > 0, on average.
 
+    Sites are packed into integer keys relative to the pivot (see `sitehash`). The
+    original string-keyed dictionary is kept behind `string_keys` for comparison.
+
     Parameters
     ----------
     j : int
@@ -58,13 +71,61 @@ def intersect_pivot(j:int, nmax:int, w:np.ndarray, wt:np.ndarray, sym:np.ndarray
         Copy of w
     sym : np.ndarray
         Symmetry matrix
+    string_keys : bool
+        Hash sites as strings (slow) instead of packed integers
 
     Returns
     -------
     int
         Number of intersections
     """
-    
+    if string_keys:
+        return _intersect_pivot_str(j, nmax, w, wt, sym)
+    return _intersect_pivot_int(j, nmax, w, wt, sym)
+
+@njit
+def _intersect_pivot_int(j, nmax, w, wt, sym):
+    N = len(w)
+    ref = w[j]
+    dim = w.shape[1]
+    bits = key_bits(dim, N)
+    # a bitmap is only worth zeroing if it has no more words than sites
+    ss = site_set(N, dim, bitmap_radius(dim, walk_span(w), 64 * N))
+    nintersect = 0
+    copy_site(w[j], wt[j])
+    add_site(ss, w[j], ref, bits)
+
+    # rotate the shorter side, checking sites outward from the pivot
+    direction = -1 if j < N / 2 else 1
+    for step in range(1, max(j, N - 1 - j) + 1):
+        jj = j + direction * step
+        if 0 <= jj < N:
+            rotate_site(sym, w[j], w[jj], wt[jj])
+            added = add_site(ss, wt[jj], ref, bits)
+            if not added:
+                nintersect += 1
+                if nintersect > nmax:
+                    break
+
+        ii = j - direction * step
+        if 0 <= ii < N:
+            added = add_site(ss, w[ii], ref, bits)
+            if not added:
+                nintersect += 1
+                if nintersect > nmax:
+                    break
+
+    if nintersect <= nmax:
+        for step in range(1, N):
+            ii = j - direction * step
+            if ii < 0 or ii >= N:
+                break
+            copy_site(w[ii], wt[ii])
+
+    return nintersect
+
+@njit
+def _intersect_pivot_str(j, nmax, w, wt, sym):
     N = len(w)
     nintersect = 0
     site_dict = dict()
@@ -204,7 +265,61 @@ def rotate_site(sym, x0, x, y):
             y[i] += sym[(i, j)] * (x[j] - x0[j])
 
 @njit
-def is_valid_two(walk1, walk2):
+def is_valid_two(walk1, walk2, string_keys=False):
+    """Checks that walk2, translated onto the last site of walk1, does not
+    intersect walk1. Sites are checked outward from the joint so that
+    collisions near it are found first.
+
+    Parameters
+    ----------
+    walk1 (dim, N1): np.ndarray
+        Left walk
+    walk2 (dim, N2): np.ndarray
+        Right walk. First site should be at origin.
+    string_keys : bool
+        Hash sites as strings (slow) instead of packed integers
+
+    Returns
+    -------
+    bool
+        Whether the merged walk is self-avoiding
+    """
+    if string_keys:
+        return _is_valid_two_str(walk1, walk2)
+    return _is_valid_two_int(walk1, walk2)
+
+@njit
+def _is_valid_two_int(walk1, walk2):
+    walk1 = walk1.T
+    walk2 = walk2.T
+    n_w1 = walk1.shape[0]
+    n_w2 = walk2.shape[0]
+    bits = key_bits(walk1.shape[1], n_w1 + n_w2)
+
+    # walk1 is keyed relative to its last site, which is where the (unshifted)
+    # walk2 starts, so walk2 is keyed relative to the origin
+    ref = walk1[-1]
+    origin = np.zeros_like(walk2[0])
+    dim = walk1.shape[1]
+    span = max(walk_span(walk1), walk_span(walk2))
+    ss = site_set(n_w1 + n_w2, dim, bitmap_radius(dim, span, 64 * (n_w1 + n_w2)))
+    for step in range(max(n_w1, n_w2 - 1)):
+        jj = n_w1 - 1 - step
+        if jj >= 0:
+            added = add_site(ss, walk1[jj], ref, bits)
+            if not added:
+                return False
+
+        ii = step + 1
+        if ii < n_w2:
+            added = add_site(ss, walk2[ii], origin, bits)
+            if not added:
+                return False
+
+    return True
+
+@njit
+def _is_valid_two_str(walk1, walk2):
     # add last pt onto walk2
     walk1 = walk1.T
     walk2 = walk2.copy().T
@@ -231,7 +346,7 @@ def is_valid_two(walk1, walk2):
             site_dict[s] = ii + 1
             
     if n_w2-1 > n_w1:
-        for ii in range(ii,n_w2):
+        for ii in range(ii+1,n_w2):
             s = site_to_str(walk2[ii])
             if s in site_dict:
                 return False
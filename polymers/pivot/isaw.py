@@ -0,0 +1,273 @@
+"""Pivot chain for interacting self-avoiding walks (ISAW).
+
+Every contact, a pair of sites that are lattice neighbours without being
+consecutive on the walk, has energy -epsilon, so a walk with C contacts has
+Boltzmann weight exp(beta C) with beta = epsilon / kT. `ContactChain`
+samples it with pivots accepted by Metropolis: a self-avoiding pivot that
+changes the number of contacts by dC is accepted with probability
+min(1, exp(beta dC)).
+
+A pivot only changes the contacts between its rotated side R and its fixed
+side F, so dC = A(R', F) - A(R, F), where A counts neighbouring pairs across
+the two sides. Both are counted from the lattice neighbourhood of the
+shorter, rotated side: a neighbour belongs to F iff it is in the occupancy
+set of the whole walk (as kept by `polymers.pivot.local.HybridChain`) but
+not in a set of the old sites of R. That costs O(d |R|) lookups and never
+a full recount.
+
+Samples taken at one beta can be reweighted to nearby temperatures with
+`reweight`, so a single chain serves several temperatures, e.g. to locate
+the theta point.
+"""
+import numpy as np
+from numba import njit
+
+from polymers.analysis import tracked_observables
+from polymers.pivot.chain import PivotChain, OBSERVABLES, check_pivot, apply_pivot, _rotated_side
+from polymers.pivot.local import occupy, _occupancy_bits, _pivot_occupancy, _recenter
+from polymers.pivot.moves import draw_move, record_move
+from polymers.pivot.sitehash import (site_set, clear_site_set, add_site, contains_site,
+                                     _NJIT_NO_NRT)
+
+__all__ = ['CONTACT_OBSERVABLES', 'ContactChain', 'count_contacts', 'contact_change',
+           'reweight']
+
+# observables recorded by ContactChain.sample, in column order
+CONTACT_OBSERVABLES = OBSERVABLES + ('C',)
+
+
+@_NJIT_NO_NRT
+def _neighbours(occ, x, ref, bits, y):
+    """Number of lattice neighbours of x in occ. y is a (dim,) buffer."""
+    count = 0
+    for a in range(len(x)):
+        y[a] = x[a]
+    for a in range(len(x)):
+        for d in (-1, 1):
+            y[a] = x[a] + d
+            count += contains_site(occ, y, ref, bits)
+        y[a] = x[a]
+    return count
+
+
+@_NJIT_NO_NRT
+def _fixed_neighbours(occ, rot, x, ref, bits, y):
+    """Number of lattice neighbours of x in occ but not in rot. y is a
+    (dim,) buffer."""
+    count = 0
+    for a in range(len(x)):
+        y[a] = x[a]
+    for a in range(len(x)):
+        for d in (-1, 1):
+            y[a] = x[a] + d
+            if contains_site(occ, y, ref, bits) and not contains_site(rot, y, ref, bits):
+                count += 1
+        y[a] = x[a]
+    return count
+
+
+@njit
+def count_contacts(w, occ, ref):
+    """Number of contacts of w (N, dim), whose sites occ holds relative to
+    ref (see `polymers.pivot.local.occupy`), in O(N)"""
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    y = np.empty(dim, dtype=np.int64)
+    pairs = 0
+    for i in range(N):
+        pairs += _neighbours(occ, w[i], ref, bits, y)
+    # every neighbouring pair is counted from both ends, and N - 1 of them are bonds
+    return pairs // 2 - (N - 1)
+
+
+@_NJIT_NO_NRT
+def contact_change(w, wt, occ, ref, rot, j, y):
+    """Change in the number of contacts of w (N, dim) if its rotated side
+    were replaced by the sites left in wt by a successful `check_pivot` about
+    site j.
+
+    Parameters
+    ----------
+    w, wt (N, dim) : np.ndarray
+        Walk and scratch buffer
+    occ : SiteSet
+        Every site of w, relative to ref (see `polymers.pivot.local.occupy`)
+    ref (dim,) : np.ndarray
+        Reference site of occ
+    rot : SiteSet
+        Scratch set with room for N sites, filled with the old rotated side
+    j : int
+        Pivot site
+    y (dim,) : np.ndarray
+        Buffer
+
+    Returns
+    -------
+    int
+        dC
+    """
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    direction, nrot = _rotated_side(j, N)
+    clear_site_set(rot)
+    for step in range(1, nrot + 1):
+        add_site(rot, w[j + direction * step], ref, bits)
+    change = 0
+    for step in range(1, nrot + 1):
+        jj = j + direction * step
+        change += _fixed_neighbours(occ, rot, wt[jj], ref, bits, y)
+        change -= _fixed_neighbours(occ, rot, w[jj], ref, bits, y)
+    return change
+
+
+@njit
+def _metropolis_pivot(w, wt, ss, occ, rot, j, sym, beta, rng, ref, m, contacts, y):
+    """Attempts a pivot of w about site j with Metropolis acceptance at beta,
+    returning whether it was made"""
+    if not check_pivot(w, wt, ss, j, sym):
+        return False
+    change = contact_change(w, wt, occ, ref, rot, j, y)
+    if change * beta < 0 and rng.random() >= np.exp(beta * change):
+        return False
+    _pivot_occupancy(w, wt, occ, j, ref)
+    apply_pivot(w, wt, j, ref, m)
+    _recenter(w, occ, ref, m)
+    contacts[0] += change
+    return True
+
+
+@njit
+def _step(w, wt, ss, occ, rot, syms, cdf, n, beta, rng, ref, m, contacts, out, stats):
+    """Runs n Metropolis pivot attempts at inverse temperature beta, as
+    `polymers.pivot.chain._step` does for the athermal chain (on int64
+    sites), keeping contacts[0] up to date. Observables, followed by the
+    number of contacts, are recorded after every attempt into out if it is
+    non-empty.
+
+    Returns
+    -------
+    int
+        Number of accepted pivots
+    """
+    N, dim = w.shape
+    sample = len(out) > 0
+    y = np.empty(dim, dtype=np.int64)
+    accepted = 0
+    for t in range(n):
+        j = rng.integers(0, N)
+        k = draw_move(cdf, len(syms), rng)
+        moved = _metropolis_pivot(w, wt, ss, occ, rot, j, syms[k], beta, rng, ref, m, contacts, y)
+        accepted += moved
+        record_move(stats, k, j, N, moved)
+        if sample:
+            out[t, 0], out[t, 1], out[t, 2], out[t, 3] = tracked_observables(
+                m, ref, w[0], w[N - 1], N)
+            out[t, 4] = contacts[0]
+    return accepted
+
+
+class ContactChain(PivotChain):
+    """A `PivotChain` for interacting SAWs at inverse temperature beta, in
+    units of the contact energy (see the module docstring). beta = 0 samples
+    the same distribution as `PivotChain`, beta > 0 attracts contacts.
+
+    Parameters
+    ----------
+    walk, syms, rng, moves
+        See `PivotChain`
+    beta : float, optional
+        Inverse temperature, epsilon / kT
+    """
+
+    observable_names = CONTACT_OBSERVABLES
+
+    def __init__(self, walk, syms=None, rng=None, moves='all', beta=0.0):
+        dim, N = walk.shape
+        self.beta = float(beta)
+        self.occupancy = site_set(N)
+        self.rotated = site_set(N)
+        self.contacts = np.zeros(1, dtype=np.int64)
+        super().__init__(walk, syms=syms, rng=rng, moves=moves)
+
+    def _set_sites(self, sites):
+        # as in HybridChain, the occupancy keys need int64 sites
+        super()._set_sites(np.ascontiguousarray(sites, dtype=np.int64))
+
+    def resync(self):
+        """Recomputes the running moments, the occupancy set and the number of
+        contacts from scratch, relative to the first site"""
+        super().resync()
+        occupy(self.occupancy, self.sites, self.ref)
+        self.contacts[0] = count_contacts(self.sites, self.occupancy, self.ref)
+
+    def set_state(self, state):
+        super().set_state(state)
+        occupy(self.occupancy, self.sites, self.ref)
+        self.contacts[0] = count_contacts(self.sites, self.occupancy, self.ref)
+
+    def observables(self):
+        """Re2, Rg2, Rm2, X2 and the number of contacts C of the current walk,
+        in O(1)"""
+        return super().observables() + (int(self.contacts[0]),)
+
+    def attempt_pivot(self, nt, sym):
+        """Attempt a single pivot about site nt, returning whether it was accepted"""
+        accepted = _metropolis_pivot(self.sites, self.scratch, self.site_set, self.occupancy,
+                                     self.rotated, nt, np.asarray(sym, dtype=np.int64),
+                                     self.beta, self.rng, self.ref, self.moments, self.contacts,
+                                     np.empty(len(self.ref), dtype=np.int64))
+        self.attempts += 1
+        self.accepted += accepted
+        return accepted
+
+    def sample(self, n=1):
+        """Like `step`, but records the observables after every attempt.
+
+        Returns
+        -------
+        np.ndarray (n, 5)
+            Re2, Rg2, Rm2, X2 and C after each attempt, see `CONTACT_OBSERVABLES`
+        """
+        out = np.empty((n, len(CONTACT_OBSERVABLES)))
+        self._run(n, out)
+        return out
+
+    def _run(self, n, out):
+        self._check_drift()
+        accepted = _step(self.sites, self.scratch, self.site_set, self.occupancy, self.rotated,
+                         self.syms, self.cdf, n, self.beta, self.rng, self.ref, self.moments,
+                         self.contacts, out, self.move_stats)
+        self.attempts += n
+        self.accepted += accepted
+        return accepted
+
+
+def reweight(values, contacts, beta, betas):
+    """Histogram reweighting of samples taken at beta to other temperatures.
+
+    A sample with C contacts taken at beta has weight exp((beta' - beta) C)
+    at beta'. This is only reliable while the distribution of C at beta'
+    overlaps well with the one sampled.
+
+    Parameters
+    ----------
+    values (n,) or (n, k) : np.ndarray
+        Observables of every sample
+    contacts (n,) : np.ndarray
+        Number of contacts of every sample
+    beta : float
+        Inverse temperature the samples were taken at
+    betas (m,) : array_like
+        Inverse temperatures to reweight to
+
+    Returns
+    -------
+    np.ndarray (m,) or (m, k)
+        Mean of values at every beta in betas
+    """
+    values = np.asarray(values, dtype=np.float64)
+    contacts = np.asarray(contacts, dtype=np.float64)
+    log_w = np.outer(np.asarray(betas, dtype=np.float64) - beta, contacts)
+    w = np.exp(log_w - log_w.max(axis=1, keepdims=True))
+    w /= w.sum(axis=1, keepdims=True)
+    return w @ values
@@ -0,0 +1,325 @@
+"""Pivot engine that applies accepted pivots lazily.
+
+The walk is stored as sites in a base frame, split into at most
+max_segments contiguous segments [start[s], start[s + 1]) that each carry a
+pending transform: a symmetry (as a `polymers.symmetry.sym_code`) and a
+translation, so that site i of segment s is at
+
+    x_i = sym_s base_i + shift_s.
+
+An accepted pivot with symmetry g about p = x_j does not touch any sites.
+It splits the segment holding the pivot site, if needed, and composes
+g(x - p) + p into the transform of every segment on the rotated side, which
+costs O(segments) instead of O(N). Coordinates are only materialized where
+they are read: site by site while an attempt is checked, and for the whole
+walk when observables are needed. Once there are more than max_segments
+segments, the transforms are written into the base sites and the walk is
+a single segment again.
+
+A check decodes the transform of a segment once, with the pivot composed
+into it on the rotated side, so reading a site costs one signed permutation,
+as rotating it does in the eager engine of `polymers.pivot.chain`. Since a
+rejected attempt leaves the walk untouched in both engines, what this saves
+is the rewrite of the rotated side of every accepted pivot, which pays off
+where acceptance is high (d = 3).
+"""
+from collections import namedtuple
+
+import numpy as np
+from numba import njit
+
+import polymers.random
+from polymers.analysis import observables
+from polymers.pivot.chain import _rotated_side
+from polymers.pivot.moves import move_set, draw_move, move_stats, record_move, move_summary
+from polymers.pivot.sitehash import (key_bits, site_set, bitmap_radius, walk_span,
+                                     clear_site_set, add_site, contains_site, _NJIT_NO_NRT)
+from polymers.symmetry import sym_code, identity_code, compose_codes, rotate_site_code
+
+__all__ = ['LazyWalk', 'LazyChain', 'lazy_walk', 'to_sites', 'check_pivot', 'apply_pivot',
+           'flatten', 'run_pivots']
+
+# base (N, dim)          : sites in the base frame
+# start (K + 1,)         : first site of every segment, start[count] = N
+# code (K,), shift (K, dim) : pending transform of every segment
+# meta                   : [count, max_segments]
+LazyWalk = namedtuple('LazyWalk', ['base', 'start', 'code', 'shift', 'meta'])
+
+
+def lazy_walk(walk, max_segments=64):
+    """`LazyWalk` of a walk (dim, N), as a single segment"""
+    dim, N = walk.shape
+    w = LazyWalk(np.array(walk.T, dtype=np.int64, order='C'),
+                 np.zeros(max_segments + 3, dtype=np.int64),
+                 np.zeros(max_segments + 2, dtype=np.int64),
+                 np.zeros((max_segments + 2, dim), dtype=np.int64),
+                 np.array([1, max_segments], dtype=np.int64))
+    _reset(w)
+    return w
+
+
+@njit
+def _reset(w):
+    """Makes w a single segment with the identity transform"""
+    N, dim = w.base.shape
+    w.meta[0] = 1
+    w.start[0], w.start[1] = 0, N
+    w.code[0] = identity_code(dim)
+    w.shift[0] = 0
+
+
+@njit
+def _segment_of(w, i):
+    return np.searchsorted(w.start[1:w.meta[0] + 1], i, side='right')
+
+
+@njit
+def _advance(w, s, i, direction):
+    """Segment of site i, moving from segment s in the given direction"""
+    if direction > 0:
+        while i >= w.start[s + 1]:
+            s += 1
+    else:
+        while i < w.start[s]:
+            s -= 1
+    return s
+
+
+@njit
+def _site(w, s, i, out):
+    """Global position of site i of segment s into out"""
+    code = w.code[s]
+    for r in range(len(out)):
+        byte = (code >> (8 * r)) & 255
+        v = w.base[i, byte & 127]
+        out[r] = (-v if byte & 128 else v) + w.shift[s, r]
+
+
+@njit
+def to_sites(w, out):
+    """Global positions (N, dim) of all sites into out"""
+    for s in range(w.meta[0]):
+        for i in range(w.start[s], w.start[s + 1]):
+            _site(w, s, i, out[i])
+
+
+@njit
+def flatten(w):
+    """Writes every pending transform into the base sites"""
+    x = np.empty(w.base.shape[1], dtype=np.int64)
+    for s in range(w.meta[0]):
+        for i in range(w.start[s], w.start[s + 1]):
+            _site(w, s, i, x)
+            w.base[i] = x
+    _reset(w)
+
+
+@njit
+def _load_transform(w, s, g, p, rotate, perm, sign, shift):
+    """Decodes the transform of segment s into perm, sign and shift, followed
+    by g(x - p) + p if rotate, so that a site costs a single signed
+    permutation however many pivots are pending on it"""
+    code = w.code[s]
+    if rotate:
+        code = compose_codes(g, code, len(perm))
+        rotate_site_code(g, p, w.shift[s], shift)
+    else:
+        for r in range(len(shift)):
+            shift[r] = w.shift[s, r]
+    for r in range(len(perm)):
+        byte = (code >> (8 * r)) & 255
+        perm[r] = byte & 127
+        sign[r] = -1 if byte & 128 else 1
+
+
+@njit
+def _read(w, i, perm, sign, shift, out):
+    for r in range(len(out)):
+        out[r] = sign[r] * w.base[i, perm[r]] + shift[r]
+
+
+@_NJIT_NO_NRT
+def check_pivot(w, ss, j, g, p, buf):
+    """Checks whether pivoting w about site j with the symmetry of code g
+    keeps it self-avoiding, as `polymers.pivot.chain.check_pivot` does but
+    reading sites through their segment transforms. w is not modified.
+
+    p is a (dim,) buffer, left holding the pivot site, and buf a (7, dim)
+    int64 scratch buffer.
+    """
+    N, dim = w.base.shape
+    clear_site_set(ss)
+    bits = key_bits(dim, N)
+    s = _segment_of(w, j)
+    _site(w, s, j, p)
+    add_site(ss, p, p, bits)
+
+    x = buf[0]
+    rperm, rsign, rshift = buf[1], buf[2], buf[3]
+    fperm, fsign, fshift = buf[4], buf[5], buf[6]
+    direction, nrot = _rotated_side(j, N)
+    rot = fixed = s
+    _load_transform(w, rot, g, p, True, rperm, rsign, rshift)
+    _load_transform(w, fixed, g, p, False, fperm, fsign, fshift)
+    for step in range(1, nrot + 1):
+        jj = j + direction * step
+        if w.start[rot] > jj or jj >= w.start[rot + 1]:
+            rot = _advance(w, rot, jj, direction)
+            _load_transform(w, rot, g, p, True, rperm, rsign, rshift)
+        _read(w, jj, rperm, rsign, rshift, x)
+        if not add_site(ss, x, p, bits):
+            return False
+        ii = j - direction * step
+        if w.start[fixed] > ii or ii >= w.start[fixed + 1]:
+            fixed = _advance(w, fixed, ii, -direction)
+            _load_transform(w, fixed, g, p, False, fperm, fsign, fshift)
+        _read(w, ii, fperm, fsign, fshift, x)
+        if not add_site(ss, x, p, bits):
+            return False
+
+    for step in range(nrot + 1, N):
+        ii = j - direction * step
+        if ii < 0 or ii >= N:
+            break
+        if w.start[fixed] > ii or ii >= w.start[fixed + 1]:
+            fixed = _advance(w, fixed, ii, -direction)
+            _load_transform(w, fixed, g, p, False, fperm, fsign, fshift)
+        _read(w, ii, fperm, fsign, fshift, x)
+        if contains_site(ss, x, p, bits):
+            return False
+    return True
+
+
+@njit
+def _split(w, i):
+    """Index of the segment starting at site i, splitting the one holding
+    it if needed"""
+    s = _segment_of(w, i)
+    if w.start[s] == i:
+        return s
+    k = w.meta[0]
+    for q in range(k, s, -1):
+        w.start[q + 1] = w.start[q]
+        w.code[q] = w.code[q - 1]
+        w.shift[q] = w.shift[q - 1]
+    w.start[s + 1] = i
+    w.meta[0] = k + 1
+    return s + 1
+
+
+@njit
+def apply_pivot(w, j, g, p, y):
+    """Pivots w about site j, at p, with the symmetry of code g, rotating the
+    same side as `check_pivot` by composing g into its segment transforms.
+    y is a (dim,) buffer."""
+    N, dim = w.base.shape
+    direction, nrot = _rotated_side(j, N)
+    if nrot == 0:
+        return
+    s = _split(w, j + 1 if direction > 0 else j)
+    lo, hi = (s, w.meta[0]) if direction > 0 else (0, s)
+    for q in range(lo, hi):
+        w.code[q] = compose_codes(g, w.code[q], dim)
+        rotate_site_code(g, p, w.shift[q], y)
+        w.shift[q] = y
+    if w.meta[0] > w.meta[1]:
+        flatten(w)
+
+
+@njit
+def run_pivots(w, ss, codes, cdf, n, rng, stats):
+    """Runs n pivot attempts on w with symmetries drawn from codes and cdf,
+    see `polymers.pivot.chain._step`, returning the number accepted"""
+    N, dim = w.base.shape
+    p = np.empty(dim, dtype=np.int64)
+    buf = np.empty((7, dim), dtype=np.int64)
+    accepted = 0
+    for _ in range(n):
+        j = rng.integers(0, N)
+        k = draw_move(cdf, len(codes), rng)
+        moved = check_pivot(w, ss, j, codes[k], p, buf)
+        if moved:
+            apply_pivot(w, j, codes[k], p, buf[0])
+            accepted += 1
+        record_move(stats, k, j, N, moved)
+    return accepted
+
+
+class LazyChain:
+    """A pivot Markov chain on a `LazyWalk`, with the interface of
+    `polymers.pivot.chain.PivotChain` except that observables cost O(N).
+
+    Parameters
+    ----------
+    walk (dim, N) : np.ndarray
+        Initial self-avoiding walk. It is copied.
+    syms (|G|, dim, dim) : np.ndarray, optional
+        Symmetries to pivot with, by default every non-identity element of G_d
+    rng : np.random.Generator, optional
+        Random generator to use, by default `polymers.random.RNG`
+    moves : str or array_like, optional
+        Which of syms to pivot with and how often, see
+        `polymers.pivot.moves.move_set`
+    max_segments : int, optional
+        Number of segments at which pending transforms are written out
+    """
+
+    def __init__(self, walk, syms=None, rng=None, moves='all', max_segments=64):
+        dim, N = walk.shape
+        self.lazy = lazy_walk(walk, max_segments)
+        self.site_set = site_set(N, dim, bitmap_radius(dim, walk_span(self.lazy.base)))
+        self.sites = np.empty((N, dim), dtype=np.int64)
+        if syms is None:
+            syms = polymers.random.Gd_array(dim)
+        self.syms, self.cdf = move_set(syms, moves)
+        self.codes = np.array([sym_code(sym) for sym in self.syms], dtype=np.int64)
+        self.move_stats = move_stats(len(self.syms), N)
+        self.rng = polymers.random.RNG if rng is None else rng
+        self.attempts = 0
+        self.accepted = 0
+
+    @property
+    def walk(self):
+        """Current walk as a (dim, N) view of a buffer that is overwritten by
+        the next call"""
+        to_sites(self.lazy, self.sites)
+        return self.sites.T
+
+    @property
+    def acceptance(self):
+        """Fraction of attempted pivots that were accepted"""
+        return self.accepted / max(self.attempts, 1)
+
+    def get_state(self):
+        """Everything needed to continue the chain exactly, see `set_state`"""
+        return dict(lazy={k: v.copy() for k, v in self.lazy._asdict().items()},
+                    attempts=self.attempts, accepted=self.accepted,
+                    move_stats=[a.copy() for a in self.move_stats],
+                    rng=self.rng.bit_generator.state)
+
+    def set_state(self, state):
+        """Restores a state from `get_state`, including that of the random generator"""
+        self.lazy = LazyWalk(**state['lazy'])
+        self.attempts = state['attempts']
+        self.accepted = state['accepted']
+        for a, saved in zip(self.move_stats, state['move_stats']):
+            a[:] = saved
+        self.rng.bit_generator.state = state['rng']
+
+    def move_summary(self):
+        """Attempted and accepted moves per symmetry and per pivot position,
+        see `polymers.pivot.moves.move_summary`"""
+        return move_summary(self.syms, self.move_stats)
+
+    def observables(self):
+        """Re2, Rg2, Rm2 and X2 of the current walk"""
+        re2, rg2, rm2, _, x2 = observables(self.walk)
+        return re2, rg2, rm2, x2
+
+    def step(self, n=1):
+        """Run n pivot attempts, returning the number accepted"""
+        accepted = run_pivots(self.lazy, self.site_set, self.codes, self.cdf, n, self.rng,
+                              self.move_stats)
+        self.attempts += n
+        self.accepted += accepted
+        return accepted
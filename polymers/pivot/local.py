@@ -0,0 +1,308 @@
+"""Local moves, and a chain that mixes them with pivots.
+
+Pivots decorrelate the large-scale shape of a walk quickly but are mostly
+rejected near the middle of long walks, so local structure relaxes slowly.
+Local moves change one or two sites at a time and are cheap to attempt:
+
+* end rotation: site 0 (or N - 1) moves to a random neighbour of site 1
+  (or N - 2);
+* corner flip: if sites i - 1 and i + 1 are diagonal to each other, site i
+  moves to the opposite corner of their square, x_{i-1} + x_{i+1} - x_i;
+* crankshaft: if sites i - 1 and i + 2 are neighbours, sites i and i + 1
+  form a U around their bond, which is turned to a random direction u
+  perpendicular to it.
+
+Every move is drawn with the same probability as its reverse and accepted
+iff the new sites are free, so the uniform distribution over SAWs is kept.
+
+To check whether a site is free in O(1), `HybridChain` keeps every site of
+its walk in a `polymers.pivot.sitehash.SiteSet`, keyed relative to the
+reference site of its running moments, and updates it for every moved site.
+"""
+import numpy as np
+from numba import njit
+
+from polymers.analysis import track_moments, update_moments, tracked_observables
+from polymers.pivot.chain import PivotChain, check_pivot, apply_pivot, _rotated_side
+from polymers.pivot.moves import draw_move, record_move
+from polymers.pivot.sitehash import (key_bits, site_set, clear_site_set, add_site,
+                                     contains_site, remove_site, _NJIT_NO_NRT)
+
+__all__ = ['LOCAL_MOVES', 'HybridChain', 'occupy', 'end_move', 'corner_move',
+           'crankshaft_move', 'local_move']
+
+# local moves, in the order of the rows of HybridChain.local_stats
+LOCAL_MOVES = ('end', 'corner', 'crankshaft')
+
+
+@njit
+def _occupancy_bits(dim, N):
+    # sites are kept within about 2N of the reference site, see _recenter
+    return key_bits(dim, 4 * N)
+
+
+@_NJIT_NO_NRT
+def occupy(occ, w, ref):
+    """Refills the site set occ with the sites of w (N, dim), relative to ref"""
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    clear_site_set(occ)
+    for i in range(N):
+        add_site(occ, w[i], ref, bits)
+
+
+@_NJIT_NO_NRT
+def _move_site(w, occ, ref, m, i, y, bits):
+    """Moves site i of w to the free site y, updating occ and the moments m"""
+    remove_site(occ, w[i], ref, bits)
+    add_site(occ, y, ref, bits)
+    update_moments(m, ref, w[i], y)
+    for a in range(len(y)):
+        w[i, a] = y[a]
+
+
+@_NJIT_NO_NRT
+def end_move(w, occ, ref, m, end, k, y):
+    """Moves an end of w (end 0 or N - 1) to neighbour k (axis k // 2, in
+    direction -1 or +1 for k even or odd) of its own neighbour on the walk,
+    if that site is free. y is a (dim,) buffer.
+
+    Returns
+    -------
+    bool
+        Whether the move was made
+    """
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    nb = 1 if end == 0 else N - 2
+    for a in range(dim):
+        y[a] = w[nb, a]
+    y[k // 2] += 1 if k % 2 else -1
+    if contains_site(occ, y, ref, bits):
+        return False
+    _move_site(w, occ, ref, m, end, y, bits)
+    return True
+
+
+@_NJIT_NO_NRT
+def corner_move(w, occ, ref, m, i, y):
+    """Flips site i (0 < i < N - 1) of w across the diagonal of its
+    neighbours, if they are diagonal to each other and the opposite corner
+    is free. y is a (dim,) buffer.
+
+    Returns
+    -------
+    bool
+        Whether the move was made
+    """
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    for a in range(dim):
+        y[a] = w[i - 1, a] + w[i + 1, a] - w[i, a]
+    # y == w[i] iff the neighbours are in line
+    same = True
+    for a in range(dim):
+        same &= y[a] == w[i, a]
+    if same or contains_site(occ, y, ref, bits):
+        return False
+    _move_site(w, occ, ref, m, i, y, bits)
+    return True
+
+
+@_NJIT_NO_NRT
+def crankshaft_move(w, occ, ref, m, i, k, y, z):
+    """Turns the U formed by sites i and i + 1 (0 < i < N - 2) of w around
+    the bond between sites i - 1 and i + 2 to direction k (see `end_move`),
+    if those are neighbours, k is perpendicular to their bond and differs
+    from the current direction, and both new sites are free. y and z are
+    (dim,) buffers.
+
+    Returns
+    -------
+    bool
+        Whether the move was made
+    """
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    a = k // 2
+    d = 1 if k % 2 else -1
+    dist = 0
+    for b in range(dim):
+        dist += abs(w[i + 2, b] - w[i - 1, b])
+    # the U is turned along axis a, which must not be that of the bond
+    if dist != 1 or w[i + 2, a] != w[i - 1, a] or w[i, a] - w[i - 1, a] == d:
+        return False
+    for b in range(dim):
+        y[b] = w[i - 1, b]
+        z[b] = w[i + 2, b]
+    y[a] += d
+    z[a] += d
+    if contains_site(occ, y, ref, bits) or contains_site(occ, z, ref, bits):
+        return False
+    _move_site(w, occ, ref, m, i, y, bits)
+    _move_site(w, occ, ref, m, i + 1, z, bits)
+    return True
+
+
+@njit
+def local_move(w, occ, ref, m, rng, buf):
+    """Attempts one local move at a uniformly random site of w: an end
+    rotation at either end, otherwise a corner flip or a crankshaft move
+    with equal probability. buf is a (2, dim) buffer.
+
+    Returns
+    -------
+    int, bool
+        Index of the move in `LOCAL_MOVES`, and whether it was made
+    """
+    N, dim = w.shape
+    # one uniform draw picks the site, the kind of move and its direction:
+    # unlike rng.integers, rng.random does not allocate
+    u = rng.random() * N
+    i = np.int64(u)
+    u = (u - i) * 4 * dim
+    k = np.int64(u) % (2 * dim)
+    if i == 0 or i == N - 1:
+        return 0, end_move(w, occ, ref, m, i, k, buf[0])
+    if u < 2 * dim:
+        return 1, corner_move(w, occ, ref, m, i, buf[0])
+    if i >= N - 2:
+        return 2, False
+    return 2, crankshaft_move(w, occ, ref, m, i, k, buf[0], buf[1])
+
+
+@_NJIT_NO_NRT
+def _pivot_occupancy(w, wt, occ, j, ref):
+    """Moves the rotated side left in wt by `check_pivot` in occ, before
+    `apply_pivot` copies it into w"""
+    N, dim = w.shape
+    bits = _occupancy_bits(dim, N)
+    direction, nrot = _rotated_side(j, N)
+    for step in range(1, nrot + 1):
+        remove_site(occ, w[j + direction * step], ref, bits)
+    for step in range(1, nrot + 1):
+        add_site(occ, wt[j + direction * step], ref, bits)
+
+
+@njit
+def _recenter(w, occ, ref, m):
+    """Moves ref (and the moments m and occupancy occ relative to it) to the
+    first site of w once that is more than N from it, so that every site
+    stays within 2N of ref"""
+    if np.abs(w[0] - ref).max() > len(w):
+        ref[:] = w[0]
+        track_moments(w, ref, m)
+        occupy(occ, w, ref)
+
+
+@njit
+def _step(w, wt, ss, occ, syms, cdf, n, local, rng, ref, m, out, stats, local_stats):
+    """Runs n pivot attempts, each followed by local attempts at local moves,
+    as `polymers.pivot.chain._step` does for pivots alone (on int64 sites,
+    which never need promoting). The observables are recorded after every
+    pivot attempt and its local moves.
+
+    Returns
+    -------
+    int
+        Number of accepted pivots
+    """
+    N, dim = w.shape
+    sample = len(out) > 0
+    buf = np.empty((2, dim), dtype=np.int64)
+    accepted = 0
+    for t in range(n):
+        j = rng.integers(0, N)
+        k = draw_move(cdf, len(syms), rng)
+        moved = False
+        if check_pivot(w, wt, ss, j, syms[k]):
+            _pivot_occupancy(w, wt, occ, j, ref)
+            apply_pivot(w, wt, j, ref, m)
+            _recenter(w, occ, ref, m)
+            accepted += 1
+            moved = True
+        record_move(stats, k, j, N, moved)
+        for _ in range(local):
+            kind, made = local_move(w, occ, ref, m, rng, buf)
+            local_stats[kind, 0] += 1
+            local_stats[kind, 1] += made
+            if made and kind == 0:
+                _recenter(w, occ, ref, m)
+        if sample:
+            out[t, 0], out[t, 1], out[t, 2], out[t, 3] = tracked_observables(
+                m, ref, w[0], w[N - 1], N)
+    return accepted
+
+
+class HybridChain(PivotChain):
+    """A `PivotChain` that follows every pivot attempt with local moves.
+
+    Parameters
+    ----------
+    walk, syms, rng, moves
+        See `PivotChain`
+    local : int, optional
+        Local move attempts per pivot attempt, by default N // 20. Local moves
+        shorten the autocorrelation time of local observables per CPU second,
+        but not those of Re2, Rg2 and Rm2, which pivots already decorrelate
+        in a few accepted moves. With local=0 the chain is the plain pivot
+        chain.
+    """
+
+    def __init__(self, walk, syms=None, rng=None, moves='all', local=None):
+        dim, N = walk.shape
+        self.local = N // 20 if local is None else int(local)
+        self.occupancy = site_set(N)
+        self.local_stats = np.zeros((len(LOCAL_MOVES), 2), dtype=np.int64)
+        super().__init__(walk, syms=syms, rng=rng, moves=moves)
+
+    def resync(self):
+        """Recomputes the running moments and the occupancy set from scratch,
+        relative to the first site"""
+        super().resync()
+        occupy(self.occupancy, self.sites, self.ref)
+
+    def get_state(self):
+        state = super().get_state()
+        state['local_stats'] = self.local_stats.copy()
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.local_stats[:] = state['local_stats']
+        occupy(self.occupancy, self.sites, self.ref)
+
+    def move_summary(self):
+        """`PivotChain.move_summary`, with the attempted and accepted local
+        moves of every kind in `LOCAL_MOVES`"""
+        summary = super().move_summary()
+        summary.update(local_moves=list(LOCAL_MOVES),
+                       local_attempts=self.local_stats[:, 0].tolist(),
+                       local_accepted=self.local_stats[:, 1].tolist())
+        return summary
+
+    def _set_sites(self, sites):
+        # local moves shift the walk a site at a time, so it is kept in int64
+        # rather than checked against the limit of its dtype after every move
+        super()._set_sites(np.ascontiguousarray(sites, dtype=np.int64))
+
+    def attempt_pivot(self, nt, sym):
+        """Attempt a single pivot about site nt, returning whether it was accepted"""
+        accepted = check_pivot(self.sites, self.scratch, self.site_set, nt,
+                               np.asarray(sym, dtype=np.int64))
+        if accepted:
+            _pivot_occupancy(self.sites, self.scratch, self.occupancy, nt, self.ref)
+            apply_pivot(self.sites, self.scratch, nt, self.ref, self.moments)
+            _recenter(self.sites, self.occupancy, self.ref, self.moments)
+        self.attempts += 1
+        self.accepted += accepted
+        return accepted
+
+    def _run(self, n, out):
+        self._check_drift()
+        accepted = _step(self.sites, self.scratch, self.site_set, self.occupancy, self.syms,
+                         self.cdf, n, self.local, self.rng, self.ref, self.moments, out,
+                         self.move_stats, self.local_stats)
+        self.attempts += n
+        self.accepted += accepted
+        return accepted
@@ -0,0 +1,141 @@
+"""Move sets and move statistics of the pivot engines.
+
+A pivot chain draws every move as a uniformly random site and a symmetry
+from its move set. By default that is every non-identity element of G_d,
+drawn uniformly; `move_set` restricts it to the rotations or reflections of
+G_d, or weights its elements individually.
+
+Pivots are accepted without a Metropolis correction, so the chain only
+samples SAWs uniformly if a symmetry is drawn as often as its inverse: the
+weights must satisfy w(g) = w(g^-1). The named move sets always do, since
+a symmetry and its inverse have the same determinant.
+
+Every attempt is also counted in a `MoveStats`, both per symmetry of the
+move set and per position of the pivot site. Positions are bucketed by the
+number s of sites on the shorter side of the pivot, which sets how far the
+move reaches: bucket b holds 2^(b-1) <= s < 2^b (and bucket 0 holds s = 0).
+"""
+from collections import namedtuple
+
+import numpy as np
+from numba import njit
+
+from polymers.symmetry import determinants, sym_code
+
+__all__ = ['MOVE_SETS', 'MoveStats', 'move_set', 'draw_move', 'position_bucket',
+           'move_stats', 'record_move', 'move_summary']
+
+# named move sets accepted by move_set
+MOVE_SETS = ('all', 'rotations', 'reflections')
+
+# sym (|G|, 2)      : attempted and accepted moves per symmetry of the move set
+# position (B, 2)   : attempted and accepted moves per position bucket
+MoveStats = namedtuple('MoveStats', ['sym', 'position'])
+
+
+def move_set(syms, moves='all'):
+    """Symmetries and their distribution for a chain to pivot with.
+
+    Parameters
+    ----------
+    syms (|G|, dim, dim) : np.ndarray
+        Candidate symmetries, e.g. `polymers.random.Gd_array(dim)`
+    moves : str or array_like, optional
+        One of `MOVE_SETS`, for every symmetry, only those with determinant
+        +1, or only those with determinant -1, each drawn uniformly; or a
+        weight for every symmetry of syms. Symmetries of weight zero are
+        dropped. Every symmetry must weigh as much as its inverse, which must
+        then also be in syms, see the module docstring.
+
+    Returns
+    -------
+    np.ndarray (K, dim, dim), np.ndarray (K,) or (0,)
+        The symmetries to pivot with, and the cumulative distribution to draw
+        them from, empty if they are drawn uniformly (see `draw_move`)
+    """
+    syms = np.ascontiguousarray(syms, dtype=np.int64)
+    if isinstance(moves, str):
+        if moves not in MOVE_SETS:
+            raise ValueError(f"unknown move set '{moves}', expected one of {MOVE_SETS}")
+        keep = np.ones(len(syms), dtype=bool)
+        if moves != 'all':
+            keep = (determinants(syms) > 0) == (moves == 'rotations')
+        weights = None
+    else:
+        weights = np.asarray(moves, dtype=np.float64)
+        if weights.shape != (len(syms),) or (weights < 0).any():
+            raise ValueError(f"expected {len(syms)} non-negative weights, got {weights}")
+        inverse = _inverses(syms)
+        paired = np.where(inverse >= 0, weights[np.maximum(inverse, 0)], 0)
+        if not np.allclose(weights, paired):
+            raise ValueError("every symmetry must have the same weight as its inverse, "
+                             f"got {weights}")
+        keep = weights > 0
+        weights = weights[keep]
+    if not keep.any():
+        raise ValueError(f"move set {moves} has no symmetries")
+    syms = np.ascontiguousarray(syms[keep])
+    if weights is None or (weights == weights[0]).all():
+        return syms, np.empty(0)
+    cdf = np.cumsum(weights / weights.sum())
+    cdf[-1] = 1
+    return syms, cdf
+
+
+def _inverses(syms):
+    """Index in syms (|G|, dim, dim) of the inverse of every symmetry, or -1
+    if it is missing"""
+    index = {sym_code(sym): k for k, sym in enumerate(syms)}
+    # the inverse of a signed permutation is its transpose
+    return np.array([index.get(sym_code(np.ascontiguousarray(sym.T)), -1) for sym in syms],
+                    dtype=np.int64)
+
+
+@njit
+def draw_move(cdf, count, rng):
+    """Index of a random symmetry out of count, drawn from cdf, or uniformly
+    if cdf is empty (as `rng.integers(0, count)`)"""
+    if len(cdf) == 0:
+        return rng.integers(0, count)
+    return min(np.searchsorted(cdf, rng.random(), side='right'), count - 1)
+
+
+@njit
+def position_bucket(j, N):
+    """Bucket of a pivot about site j of N, see the module docstring"""
+    s = min(j, N - 1 - j)
+    b = 0
+    while s > 0:
+        s >>= 1
+        b += 1
+    return b
+
+
+def move_stats(count, N):
+    """Empty `MoveStats` for count symmetries and walks of N sites"""
+    return MoveStats(np.zeros((count, 2), dtype=np.int64),
+                     np.zeros((position_bucket(N // 2, N) + 1, 2), dtype=np.int64))
+
+
+@njit
+def record_move(stats, k, j, N, accepted):
+    """Counts an attempt with symmetry k about site j of N"""
+    b = position_bucket(j, N)
+    stats.sym[k, 0] += 1
+    stats.position[b, 0] += 1
+    if accepted:
+        stats.sym[k, 1] += 1
+        stats.position[b, 1] += 1
+
+
+def move_summary(syms, stats):
+    """`MoveStats` as a JSON-friendly dict of lists: the symmetries, the
+    attempted and accepted moves per symmetry, the smallest shorter side of
+    each position bucket and the attempted and accepted moves per bucket"""
+    buckets = len(stats.position)
+    return dict(syms=syms.tolist(),
+                sym_attempts=stats.sym[:, 0].tolist(),
+                sym_accepted=stats.sym[:, 1].tolist(),
+                position_min=[0] + [1 << (b - 1) for b in range(1, buckets)],
+                position_attempts=stats.position[:, 0].tolist(),
+                position_accepted=stats.position[:, 1].tolist())
@@ -0,0 +1,325 @@
+from collections import namedtuple
+
+import numpy as np
+from numba import njit
+
+__all__ = ['SiteSet', 'BITMAP_BITS', 'key_bits', 'site_key', 'site_set', 'bitmap_radius',
+           'walk_span', 'clear_site_set', 'add_key', 'add_site', 'contains_key',
+           'contains_site', 'remove_key', 'remove_site']
+
+# Open-addressing hash set of lattice sites. Sites are packed into a pair of
+# int64 words (hi, lo); `stamp` marks which slots belong to the current
+# generation so the set can be cleared in O(1) by bumping the generation.
+#
+# A set can also have a dense bitmap of the cube of sites within `radius`
+# of the reference site, one bit per site in `words`. `add_site` and
+# `contains_site` use the bitmap for sites inside the cube and the hash for
+# the rest, so the set stays exact whatever the radius. Bitmap words that
+# become non-zero are listed in `touched`, and clearing zeroes only those.
+# Packed keys (`add_key`, `contains_key`) always go to the hash. Only sets
+# without a bitmap support removal (`remove_key`, `remove_site`).
+# meta = [generation, size, radius, side, touched words]
+#
+# The per-site functions are inlined into their callers. A kernel that calls
+# them once per site and allocates nothing itself is best compiled with
+# `@_NJIT_NO_NRT`: with reference counting on, every inlined call still
+# increments and decrements the counts of the arrays it is passed, which
+# costs several times more than the lookup itself (5-15x for whole pivot
+# attempts). Such kernels must not allocate, slice copy or return arrays.
+SiteSet = namedtuple('SiteSet', ['lo', 'hi', 'stamp', 'meta', 'words', 'touched'])
+
+
+def _njit_no_nrt():
+    """`njit(_nrt=False)` if this numba accepts its private _nrt option,
+    otherwise plain `njit`, which is only slower"""
+    def probe(x):
+        return x
+    try:
+        njit('int64(int64)', _nrt=False)(probe)
+    except Exception:
+        return njit
+    return njit(_nrt=False)
+
+
+_NJIT_NO_NRT = _njit_no_nrt()
+
+# largest bitmap `bitmap_radius` chooses, in bits (8 MB)
+BITMAP_BITS = 1 << 26
+
+_K1 = np.int64(-7046029254386353131)  # 0x9E3779B97F4A7C15
+_K2 = np.int64(-4658895280553007687)  # 0xBF58476D1CE4E5B9
+
+
+@njit
+def key_bits(dim, n):
+    """Number of bits used per coordinate when packing sites of a walk
+    with n sites in dim dimensions.
+
+    Coordinates are packed relative to a reference site of the walk, so
+    every offset is bounded by n in magnitude. If all dim offsets fit into
+    a single int64 the narrow (one word) key is used, otherwise each
+    coordinate gets 32 bits spread over a 128-bit (hi, lo) pair.
+
+    Parameters
+    ----------
+    dim : int
+        Dimension of the walk
+    n : int
+        Number of sites in the walk
+
+    Returns
+    -------
+    int
+        Bits per coordinate
+    """
+    bits = 64 // dim
+    if bits >= 64 or n < (1 << (bits - 1)):
+        return bits
+    if dim > 4 or n >= (1 << 31):
+        raise ValueError("walk is too large to pack into a 128-bit site key")
+    return 32
+
+
+@njit(inline='always')
+def site_key(x, x0, bits):
+    """Packs the offset x - x0 into a (hi, lo) pair of int64 words.
+
+    Parameters
+    ----------
+    x : np.ndarray (dim)
+        Site to pack
+    x0 : np.ndarray (dim)
+        Reference site
+    bits : int
+        Bits per coordinate, see `key_bits`
+
+    Returns
+    -------
+    (int, int)
+        High and low words of the key. The high word is zero for narrow keys.
+    """
+    dim = len(x)
+    if bits >= 64:
+        return np.int64(0), np.int64(x[0]) - np.int64(x0[0])
+    mask = (np.int64(1) << bits) - 1
+    lo = np.int64(0)
+    hi = np.int64(0)
+    for i in range(dim):
+        v = (np.int64(x[i]) - np.int64(x0[i])) & mask
+        shift = (i * bits) % 64
+        if i * bits < 64:
+            lo |= v << shift
+        else:
+            hi |= v << shift
+    return hi, lo
+
+
+@njit(inline='always')
+def _hash(hi, lo):
+    h = lo ^ (hi * _K2)
+    h ^= h >> 31
+    h *= _K1
+    h ^= h >> 29
+    return h
+
+
+@njit
+def site_set(n, dim=0, radius=0):
+    """Allocates an empty site set with room for n sites, with a bitmap of
+    the sites within radius of the reference site in dim dimensions if
+    radius > 0 (see `bitmap_radius`)"""
+    cap = 16
+    while cap < 2 * n:
+        cap *= 2
+    side = 2 * radius + 1
+    nwords = 0
+    if radius > 0:
+        nwords = (side ** dim + 63) // 64
+    return SiteSet(np.empty(cap, dtype=np.int64),
+                   np.empty(cap, dtype=np.int64),
+                   np.zeros(cap, dtype=np.int64),
+                   np.array([1, 0, radius, side, 0], dtype=np.int64),
+                   np.zeros(nwords, dtype=np.int64),
+                   np.empty(n if radius > 0 else 0, dtype=np.int64))
+
+
+@njit
+def bitmap_radius(dim, span, max_bits=BITMAP_BITS):
+    """Bitmap radius for the site set of a walk whose bounding box is span
+    sites wide along its widest axis, or 0 if that bitmap would have more
+    than max_bits bits.
+
+    Every site of such a walk, and every site of it rotated about one of
+    its sites, lies within span of that site, so a bitmap of that radius
+    around the pivot covers every check of a pivot attempt.
+    """
+    if (2.0 * span + 1) ** dim > max_bits:
+        return 0
+    return max(span, 1)
+
+
+@njit
+def walk_span(w):
+    """Width of the bounding box of the sites w (N, dim) along its widest axis"""
+    span = 0
+    if len(w) == 0:
+        return span
+    for a in range(w.shape[1]):
+        lo = hi = np.int64(w[0, a])
+        for i in range(1, len(w)):
+            lo = min(lo, np.int64(w[i, a]))
+            hi = max(hi, np.int64(w[i, a]))
+        span = max(span, hi - lo)
+    return span
+
+
+@njit
+def clear_site_set(ss):
+    """Empties a site set, in O(1) for the hash and in O(words touched)
+    for the bitmap"""
+    ss.meta[0] += 1
+    ss.meta[1] = 0
+    for k in range(ss.meta[4]):
+        ss.words[ss.touched[k]] = 0
+    ss.meta[4] = 0
+
+
+@njit(inline='always')
+def _bitmap_index(ss, x, x0):
+    """Bit index of site x relative to x0, or -1 if it is outside the bitmap"""
+    radius = ss.meta[2]
+    side = ss.meta[3]
+    index = 0
+    stride = 1
+    for i in range(len(x)):
+        v = np.int64(x[i]) - np.int64(x0[i])
+        if v < -radius or v > radius:
+            return -1
+        index += (v + radius) * stride
+        stride *= side
+    return index
+
+
+@njit(inline='always')
+def add_key(ss, hi, lo):
+    """Inserts a packed key into the set.
+
+    Returns
+    -------
+    bool
+        True if the key was inserted, False if it was already present
+    """
+    mask = len(ss.lo) - 1
+    gen = ss.meta[0]
+    i = _hash(hi, lo) & mask
+    while ss.stamp[i] == gen:
+        if ss.lo[i] == lo and ss.hi[i] == hi:
+            return False
+        i = (i + 1) & mask
+    ss.stamp[i] = gen
+    ss.lo[i] = lo
+    ss.hi[i] = hi
+    ss.meta[1] += 1
+    return True
+
+
+@njit(inline='always')
+def add_site(ss, x, x0, bits):
+    """Inserts site x (relative to x0) into the set.
+
+    Returns
+    -------
+    bool
+        True if x was inserted, False if it was already present
+    """
+    if ss.meta[2] > 0:
+        index = _bitmap_index(ss, x, x0)
+        if index >= 0:
+            word = index >> 6
+            bit = np.int64(1) << (index & 63)
+            old = ss.words[word]
+            if old & bit:
+                return False
+            if old == 0:
+                ss.touched[ss.meta[4]] = word
+                ss.meta[4] += 1
+            ss.words[word] = old | bit
+            ss.meta[1] += 1
+            return True
+    hi, lo = site_key(x, x0, bits)
+    return add_key(ss, hi, lo)
+
+
+@njit(inline='always')
+def contains_site(ss, x, x0, bits):
+    """Checks whether site x (relative to x0) is in the set"""
+    if ss.meta[2] > 0:
+        index = _bitmap_index(ss, x, x0)
+        if index >= 0:
+            return (ss.words[index >> 6] >> (index & 63)) & 1 != 0
+    hi, lo = site_key(x, x0, bits)
+    return contains_key(ss, hi, lo)
+
+
+@njit(inline='always')
+def contains_key(ss, hi, lo):
+    """Checks whether a packed key is in the set"""
+    mask = len(ss.lo) - 1
+    gen = ss.meta[0]
+    i = _hash(hi, lo) & mask
+    while ss.stamp[i] == gen:
+        if ss.lo[i] == lo and ss.hi[i] == hi:
+            return True
+        i = (i + 1) & mask
+    return False
+
+
+@njit(inline='always')
+def remove_key(ss, hi, lo):
+    """Removes a packed key from the set, moving later keys of its probe
+    sequence back so that no tombstones are needed.
+
+    Returns
+    -------
+    bool
+        True if the key was removed, False if it was not present
+    """
+    mask = len(ss.lo) - 1
+    gen = ss.meta[0]
+    i = _hash(hi, lo) & mask
+    while ss.stamp[i] == gen:
+        if ss.lo[i] == lo and ss.hi[i] == hi:
+            break
+        i = (i + 1) & mask
+    else:
+        return False
+    j = i
+    while True:
+        j = (j + 1) & mask
+        if ss.stamp[j] != gen:
+            break
+        # the key in slot j can fill the hole at i unless its home slot
+        # lies cyclically in (i, j]
+        home = _hash(ss.hi[j], ss.lo[j]) & mask
+        if (j - home) & mask >= (j - i) & mask:
+            ss.lo[i] = ss.lo[j]
+            ss.hi[i] = ss.hi[j]
+            i = j
+    ss.stamp[i] = gen - 1
+    ss.meta[1] -= 1
+    return True
+
+
+@njit(inline='always')
+def remove_site(ss, x, x0, bits):
+    """Removes site x (relative to x0) from a set without a bitmap.
+
+    Returns
+    -------
+    bool
+        True if x was removed, False if it was not present
+    """
+    if ss.meta[2] > 0:
+        raise ValueError("sites cannot be removed from a site set with a bitmap")
+    hi, lo = site_key(x, x0, bits)
+    return remove_key(ss, hi, lo)
@@ -1,11 +1,109 @@
+"""Pivot backend in plain numpy, for machines without numba.
+
+Sites are compared as int64 keys: every coordinate is shifted by its
+minimum over the sites in question and the shifted coordinates are
+combined as digits of a mixed-radix number, so that two sites collide iff
+their keys are equal. Collisions are then found by sorting, in O(N log N)
+vectorized work rather than with a Python set of tuples. This module only
+imports numpy, and importing it does not import numba.
+
+At small N a pivot attempt costs little more than the overhead of a dozen
+numpy calls, so the compiled backends (`polymers.pivot.chain`) remain
+faster there.
+"""
 import numpy as np
 
-from polymers.naive.utils import is_valid
-from polymers.random import rand_Gd
+__all__ = ['site_keys', 'is_self_avoiding', 'intersects', 'attempt_pivot', 'merge',
+           'is_valid_two']
+
+
+def site_keys(*walks):
+    """int64 keys of the sites of walks (dim, N_k), shared between walks.
+
+    Returns
+    -------
+    list of np.ndarray (N_k,), or None
+        A key per site of every walk, or None if the bounding box of the
+        sites has more than 2^63 sites
+    """
+    nonempty = [w for w in walks if w.shape[1]]
+    if not nonempty:
+        return [np.empty(0, dtype=np.int64) for _ in walks]
+    lo = nonempty[0].min(axis=1)
+    hi = nonempty[0].max(axis=1)
+    for w in nonempty[1:]:
+        lo = np.minimum(lo, w.min(axis=1))
+        hi = np.maximum(hi, w.max(axis=1))
+    strides = []
+    volume = 1
+    for a, b in zip(lo.tolist(), hi.tolist()):
+        strides.append(volume)
+        volume *= b - a + 1
+    if volume >= 2 ** 63:
+        return None
+    strides = np.array(strides, dtype=np.int64)
+    offset = int(strides @ lo.astype(np.int64))
+    return [strides @ w.astype(np.int64, copy=False) - offset for w in walks]
+
+
+def is_self_avoiding(walk):
+    """Whether no two sites of walk (dim, N) coincide"""
+    if walk.shape[1] < 2:
+        return True
+    keys = site_keys(walk)
+    if keys is None:
+        return len(np.unique(walk, axis=1).T) == walk.shape[1]
+    keys = np.sort(keys[0])
+    return not (keys[1:] == keys[:-1]).any()
+
+
+def intersects(walk1, walk2):
+    """Whether any site of walk1 (dim, N1) coincides with one of walk2 (dim, N2)"""
+    if walk1.shape[1] == 0 or walk2.shape[1] == 0:
+        return False
+    keys = site_keys(walk1, walk2)
+    if keys is None:
+        sites = set(map(tuple, walk2.T))
+        return any(tuple(x) in sites for x in walk1.T)
+    keys2 = np.sort(keys[1])
+    i = np.searchsorted(keys2, keys[0])
+    return (keys2[np.minimum(i, len(keys2) - 1)] == keys[0]).any()
+
+
+def _rotate(sym, offsets, x0, dtype):
+    """sym @ offsets + x0 as dtype, for offsets (dim, n) of sites from x0 (dim, 1)"""
+    return (np.asarray(sym, dtype=np.int64) @ offsets + x0).astype(dtype, copy=False)
+
+
+def _pivot_strides(N, dim):
+    """Mixed-radix strides (2N + 1)^a for keys of sites relative to a pivot
+    site of a walk of N sites, or None if they do not fit into int64"""
+    if (2 * N + 1) ** dim >= 2 ** 63:
+        return None
+    return (2 * N + 1) ** np.arange(dim, dtype=np.int64)
+
+
+def _collide(keys1, keys2):
+    """Whether two arrays of distinct keys share one"""
+    keys = np.concatenate([keys1, keys2])
+    keys.sort()
+    return bool((keys[1:] == keys[:-1]).any())
+
 
 def attempt_pivot(walk, nt, sym):
-    """Attempt to pivot a walk at site nt
-    using numpy linear algebra. This is slow!
+    """Attempt to pivot a walk at site nt using numpy array operations,
+    rotating the shorter side of the walk about the pivot site.
+
+    Every site of the walk, rotated or not, lies within N of the pivot site
+    p, so a site x has the key strides @ (x - p) with strides (2N + 1)^a,
+    and its image sym (x - p) + p has the key (strides @ sym) @ (x - p):
+    both sides are keyed with one matrix product each, and the rotated
+    sites are only computed once the pivot is accepted.
+
+    Collisions are most likely near the pivot, so the rotated side is first
+    checked against the fixed side within windows of `_WINDOWS` sites on
+    either side of the pivot, which rejects most failing pivots without
+    touching the whole walk.
 
     Parameters
     ----------
@@ -13,23 +111,51 @@ def attempt_pivot(walk, nt, sym):
         Walk to pivot
     nt : int
         Site to pivot about
+    sym : np.ndarray (dim, dim)
+        Symmetry matrix
 
     Returns
     -------
     np.ndarray (dim, N), int
         Pivoted walk, whether the pivot was successful
     """
-    pivot_point = walk[:,nt].reshape(-1,1)
-    walk_pre, walk_post = walk[:,:nt], walk[:,nt+1:]
-    if nt < nt / 2:
-        walk_pre = sym @ (walk_pre - pivot_point) + pivot_point
+    dim, N = walk.shape
+    pivot_point = walk[:, nt:nt + 1]
+    before = nt < N / 2
+    if before:
+        # both sides ordered outward from the pivot
+        side = walk[:, nt - 1::-1] if nt else walk[:, :0]
+        fixed = walk[:, nt + 1:]
     else:
-        walk_post = sym @ (walk_post - pivot_point) + pivot_point
-    
-    walk_pivoted = np.hstack([walk_pre, pivot_point, walk_post])
-    if is_valid(*walk_pivoted):
-        return walk_pivoted, 1
-    return walk, 0
+        side = walk[:, nt + 1:]
+        fixed = walk[:, nt - 1::-1] if nt else walk[:, :0]
+    offsets = side - pivot_point
+    strides = _pivot_strides(N, dim)
+    if strides is None:
+        # walks too long for pivot keys fall back to bounding-box keys
+        rotated = _rotate(sym, offsets, pivot_point, walk.dtype)
+        collide = lambda m: intersects(rotated[:, :m], fixed[:, :m])
+    else:
+        rotated_keys = (strides @ np.asarray(sym, dtype=np.int64)) @ offsets
+        fixed_keys = strides @ (fixed - pivot_point)
+        collide = lambda m: _collide(rotated_keys[:m], fixed_keys[:m])
+    for m in _WINDOWS:
+        if m >= side.shape[1]:
+            break
+        if collide(m):
+            return walk, 0
+    if collide(N):
+        return walk, 0
+    if strides is not None:
+        rotated = _rotate(sym, offsets, pivot_point, walk.dtype)
+    if before:
+        return np.hstack([rotated[:, ::-1], walk[:, nt:]]), 1
+    return np.hstack([walk[:, :nt + 1], rotated]), 1
+
+
+# sizes of the windows around the pivot checked before the whole walk
+_WINDOWS = (16, 256, 4096)
+
 
 def merge(walk1, walk2, shift=True):
     """Given two walks, merge them together
@@ -45,7 +171,7 @@ def merge(walk1, walk2, shift=True):
 
     Returns
     -------
-    np.ndarray (dim, N1+N2-1) 
+    np.ndarray (dim, N1+N2-1)
     """
 
     if shift:
@@ -53,11 +179,10 @@ def merge(walk1, walk2, shift=True):
     walk_concat = np.hstack([walk1, walk2[:,1:]])
     return walk_concat
 
+
 def is_valid_two(walk1, walk2, shift=True):
     """Checks if two walks are valid and do not intersect"""
-    # tests if two walks are valid don't intersect
     walk2_shifted = walk2
     if shift:
         walk2_shifted = (walk2 + walk1[:,-1].reshape(-1,1))[:,1:]
-
-    return set(zip(*walk1)).isdisjoint(set(zip(*walk2_shifted)))
\ No newline at end of file
+    return not intersects(walk1, walk2_shifted)
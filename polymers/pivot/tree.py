@@ -0,0 +1,581 @@
+"""SAW-tree pivot engine (Clisby, J. Stat. Phys. 140, 349 (2010)).
+
+The walk is stored as a balanced binary tree whose leaves are the sites of
+the walk. Every internal node covering sites [a, b) splits them at
+m = (a + b) // 2 and stores
+
+* the symmetry applied to its right child relative to its left child,
+* the position of its last site, and
+* the bounding box of its sites,
+
+all in the node's own frame, where the site before a sits at the origin.
+Since every split m is the bond (m - 1, m), node [a, b) is stored at index
+m - 1, so a walk of N sites needs exactly N - 1 internal nodes.
+
+A pivot only changes the symmetries on the path from the root to the pivot
+site, and the walk stays self-avoiding iff the two children of every node
+on that path do not intersect. Those tests prune on bounding boxes, which
+makes a pivot attempt roughly O(log N) instead of O(N).
+
+The traversals work in a `TreeWork` of stacks and buffers sized by the
+depth of the tree, allocated once per tree by `tree_work`, so that a pivot
+attempt allocates nothing.
+"""
+from collections import namedtuple
+
+import numpy as np
+from numba import njit
+
+import polymers.random
+from polymers.analysis import observables
+from polymers.pivot.moves import move_set, draw_move, move_stats, record_move, move_summary
+from polymers.pivot.sitehash import _NJIT_NO_NRT
+
+__all__ = ['SAWTree', 'TreeWork', 'TreeChain', 'from_walk', 'to_walk', 'tree_work',
+           'attempt_pivot', 'run_pivots']
+
+# steps (N, dim)       : step into each site in its leaf frame (steps[0] = 0)
+# x0 (dim), rot (dim, dim) : global position of the root frame's origin and
+#                        its orientation
+# sym (N-1, dim, dim)  : symmetry of the right child relative to the left
+# end, lo, hi (N-1, dim) : last site and bounding box of each node
+SAWTree = namedtuple('SAWTree', ['steps', 'x0', 'rot', 'sym', 'end', 'lo', 'hi'])
+
+# Work space of the traversals, int64 throughout:
+# path (D, 2)                : nodes [a, b) from the root to the pivot site
+# old_sym (D, dim, dim), old_end, old_lo, old_hi (D, dim)
+#                            : their previous contents, to undo a rejected pivot
+# ranges (S, 4), syms (S, 2, dim, dim), offs (S, 2, dim)
+#                            : stack of pairs of placed subtrees
+# mats (4, dim, dim), vecs (12, dim) : scratch matrices and vectors
+TreeWork = namedtuple('TreeWork', ['path', 'old_sym', 'old_end', 'old_lo', 'old_hi',
+                                   'ranges', 'syms', 'offs', 'mats', 'vecs'])
+
+
+@njit(inline='always')
+def _matmul(a, b, out):
+    dim = len(a)
+    for i in range(dim):
+        for j in range(dim):
+            s = 0
+            for k in range(dim):
+                s += a[i, k] * b[k, j]
+            out[i, j] = s
+
+
+@njit(inline='always')
+def _node_box(t, a, b, end, lo, hi):
+    """Reads the last site and bounding box of node [a, b) into end, lo, hi"""
+    dim = t.steps.shape[1]
+    if b - a == 1:
+        for i in range(dim):
+            end[i] = t.steps[a, i]
+            lo[i] = t.steps[a, i]
+            hi[i] = t.steps[a, i]
+    else:
+        n = (a + b) // 2 - 1
+        for i in range(dim):
+            end[i] = t.end[n, i]
+            lo[i] = t.lo[n, i]
+            hi[i] = t.hi[n, i]
+
+
+@njit(inline='always')
+def _transform_box(S, o, lo, hi, lo_out, hi_out):
+    """Bounding box of {o + S x : lo <= x <= hi} for a signed permutation S"""
+    dim = len(o)
+    for i in range(dim):
+        for c in range(dim):
+            if S[i, c] > 0:
+                lo_out[i] = o[i] + lo[c]
+                hi_out[i] = o[i] + hi[c]
+            elif S[i, c] < 0:
+                lo_out[i] = o[i] - hi[c]
+                hi_out[i] = o[i] - lo[c]
+
+
+@_NJIT_NO_NRT
+def _update_node(t, a, b, vecs):
+    """Recomputes the last site and bounding box of node [a, b) from its
+    children, using the first 8 rows of vecs as buffers"""
+    dim = t.steps.shape[1]
+    m = (a + b) // 2
+    n = m - 1
+    endl, lol, hil, endr, lor, hir, lot, hit = (vecs[0], vecs[1], vecs[2], vecs[3], vecs[4],
+                                                vecs[5], vecs[6], vecs[7])
+    _node_box(t, a, m, endl, lol, hil)
+    _node_box(t, m, b, endr, lor, hir)
+
+    S = t.sym[n]
+    _transform_box(S, endl, lor, hir, lot, hit)
+    for i in range(dim):
+        e = endl[i]
+        for c in range(dim):
+            e += S[i, c] * endr[c]
+        t.end[n, i] = e
+        t.lo[n, i] = min(lol[i], lot[i])
+        t.hi[n, i] = max(hil[i], hit[i])
+
+
+@njit
+def tree_depth(N):
+    """Number of internal nodes on the longest root-to-leaf path of the
+    SAW-tree of a walk of N sites"""
+    depth = 0
+    while (1 << depth) < N:
+        depth += 1
+    return depth
+
+
+@njit
+def tree_work(N, dim):
+    """Allocates the `TreeWork` of a SAW-tree of N sites in dim dimensions"""
+    depth = tree_depth(N)
+    # a traversal of a pair of subtrees splits one of them per level, and
+    # keeps one pending sibling per split
+    stack = 2 * depth + 2
+    return TreeWork(np.empty((depth, 2), dtype=np.int64),
+                    np.empty((depth, dim, dim), dtype=np.int64),
+                    np.empty((depth, dim), dtype=np.int64),
+                    np.empty((depth, dim), dtype=np.int64),
+                    np.empty((depth, dim), dtype=np.int64),
+                    np.empty((stack, 4), dtype=np.int64),
+                    np.empty((stack, 2, dim, dim), dtype=np.int64),
+                    np.empty((stack, 2, dim), dtype=np.int64),
+                    np.empty((4, dim, dim), dtype=np.int64),
+                    np.empty((12, dim), dtype=np.int64))
+
+
+@njit
+def from_walk(walk):
+    """Builds a SAW-tree from a walk
+
+    Parameters
+    ----------
+    walk (dim, N) : np.ndarray
+        Walk to store
+
+    Returns
+    -------
+    SAWTree
+    """
+    dim, N = walk.shape
+    steps = np.zeros((N, dim), dtype=np.int8)
+    for i in range(1, N):
+        for d in range(dim):
+            steps[i, d] = walk[d, i] - walk[d, i - 1]
+    x0 = np.empty(dim, dtype=np.int64)
+    for d in range(dim):
+        x0[d] = walk[d, 0]
+    nnodes = max(N - 1, 0)
+    sym = np.zeros((nnodes, dim, dim), dtype=np.int8)
+    for n in range(nnodes):
+        for d in range(dim):
+            sym[n, d, d] = 1
+    t = SAWTree(steps, x0, np.eye(dim, dtype=np.int64), sym,
+                np.zeros((nnodes, dim), dtype=np.int32),
+                np.zeros((nnodes, dim), dtype=np.int32),
+                np.zeros((nnodes, dim), dtype=np.int32))
+    if N < 2:
+        return t
+
+    # post-order traversal so that children are built before their parents
+    vecs = np.empty((8, dim), dtype=np.int64)
+    stack = np.empty((2 * tree_depth(N) + 2, 3), dtype=np.int64)
+    stack[0, 0], stack[0, 1], stack[0, 2] = 0, N, 0
+    top = 1
+    while top > 0:
+        a, b, visited = stack[top - 1]
+        if b - a < 2:
+            top -= 1
+        elif visited:
+            _update_node(t, a, b, vecs)
+            top -= 1
+        else:
+            m = (a + b) // 2
+            stack[top - 1, 2] = 1
+            stack[top, 0], stack[top, 1], stack[top, 2] = m, b, 0
+            stack[top + 1, 0], stack[top + 1, 1], stack[top + 1, 2] = a, m, 0
+            top += 2
+    return t
+
+
+@njit
+def to_walk(t):
+    """Exports a SAW-tree to a walk
+
+    Parameters
+    ----------
+    t : SAWTree
+
+    Returns
+    -------
+    np.ndarray (dim, N)
+    """
+    N, dim = t.steps.shape
+    walk = np.empty((dim, N), dtype=np.int64)
+    if N == 0:
+        return walk
+
+    stack = tree_depth(N) + 1
+    ranges = np.empty((stack, 2), dtype=np.int64)
+    syms = np.empty((stack, dim, dim), dtype=np.int64)
+    offs = np.empty((stack, dim), dtype=np.int64)
+    ranges[0, 0], ranges[0, 1] = 0, N
+    syms[0] = t.rot
+    offs[0] = t.x0
+    top = 1
+    endl = np.empty(dim, dtype=np.int64)
+    lol = np.empty(dim, dtype=np.int64)
+    hil = np.empty(dim, dtype=np.int64)
+    while top > 0:
+        top -= 1
+        a, b = ranges[top]
+        S = syms[top]
+        o = offs[top]
+        if b - a == 1:
+            for i in range(dim):
+                x = o[i]
+                for c in range(dim):
+                    x += S[i, c] * t.steps[a, c]
+                walk[i, a] = x
+            continue
+        m = (a + b) // 2
+        _node_box(t, a, m, endl, lol, hil)
+        # right child: o + S endl + S sym x
+        ranges[top + 1, 0], ranges[top + 1, 1] = m, b
+        _matmul(S, t.sym[m - 1], syms[top + 1])
+        for i in range(dim):
+            x = o[i]
+            for c in range(dim):
+                x += S[i, c] * endl[c]
+            offs[top + 1, i] = x
+        # left child keeps the transform (already in slot top)
+        ranges[top, 0], ranges[top, 1] = a, m
+        top += 2
+    return walk
+
+
+@_NJIT_NO_NRT
+def _intersects(t, a, m, b, o, work):
+    """Checks whether sites [a, m), placed as they are in the frame of node
+    [a, b), intersect sites [m, b) placed at o + sym x, with sym the node's
+    symmetry.
+
+    Pairs of subtrees are only descended into while their bounding boxes
+    overlap, and the halves nearest the joint (end of the first range,
+    start of the second) are examined first.
+    """
+    dim = t.steps.shape[1]
+    ranges, syms, offs = work.ranges, work.syms, work.offs
+    ranges[0, 0], ranges[0, 1], ranges[0, 2], ranges[0, 3] = a, m, m, b
+    for i in range(dim):
+        for j in range(dim):
+            syms[0, 0, i, j] = i == j
+            syms[0, 1, i, j] = t.sym[m - 1, i, j]
+        offs[0, 0, i] = 0
+        offs[0, 1, i] = o[i]
+    top = 1
+
+    vecs = work.vecs
+    end, lo, hi, lo1, hi1, lo2, hi2 = (vecs[0], vecs[1], vecs[2], vecs[3], vecs[4], vecs[5],
+                                       vecs[6])
+    while top > 0:
+        top -= 1
+        a1, b1, a2, b2 = ranges[top]
+        _node_box(t, a1, b1, end, lo, hi)
+        _transform_box(syms[top, 0], offs[top, 0], lo, hi, lo1, hi1)
+        _node_box(t, a2, b2, end, lo, hi)
+        _transform_box(syms[top, 1], offs[top, 1], lo, hi, lo2, hi2)
+        overlap = True
+        for i in range(dim):
+            if hi1[i] < lo2[i] or hi2[i] < lo1[i]:
+                overlap = False
+                break
+        if not overlap:
+            continue
+        if b1 - a1 == 1 and b2 - a2 == 1:
+            # two single sites with overlapping boxes are the same site
+            return True
+
+        if top + 2 > len(ranges):
+            raise RuntimeError("SAW-tree intersection stack overflow")
+
+        # split the larger of the two subtrees, keeping the transform of the
+        # left child in place and composing the node symmetry into the right
+        s = 0 if b1 - a1 >= b2 - a2 else 1
+        a = ranges[top, 2 * s]
+        b = ranges[top, 2 * s + 1]
+        m = (a + b) // 2
+        _node_box(t, a, m, end, lo, hi)
+        left, right = (top, top + 1) if s == 0 else (top + 1, top)
+        for q in range(4):
+            ranges[top + 1, q] = ranges[top, q]
+        for u in range(2):
+            for i in range(dim):
+                for j in range(dim):
+                    syms[top + 1, u, i, j] = syms[top, u, i, j]
+                offs[top + 1, u, i] = offs[top, u, i]
+        ranges[left, 2 * s + 1] = m
+        ranges[right, 2 * s] = m
+        S = syms[left, s]
+        o = offs[left, s]
+        _matmul(S, t.sym[m - 1], syms[right, s])
+        for i in range(dim):
+            x = o[i]
+            for c in range(dim):
+                x += S[i, c] * end[c]
+            offs[right, s, i] = x
+        top += 2
+    return False
+
+
+@njit
+def attempt_pivot(t, nt, sym, work):
+    """Attempt to pivot a SAW-tree about site nt using symmetry matrix sym.
+
+    As in `polymers.pivot.fast.attempt_pivot`, the shorter side of the walk is
+    the one that gets rotated, so both engines produce the same walk for the
+    same sequence of pivots.
+
+    Parameters
+    ----------
+    t : SAWTree
+        Walk to pivot. Modified in place if the pivot is accepted.
+    nt : int
+        Index of site to pivot about
+    sym (dim, dim) : np.ndarray
+        Symmetry matrix
+    work : TreeWork
+        Work space of the tree, see `tree_work`
+
+    Returns
+    -------
+    SAWTree, bool
+        The tree, and whether the pivot was rejected because it intersects
+    """
+    return t, _pivot_tree(t, nt, sym, work)
+
+
+@_NJIT_NO_NRT
+def _pivot_tree(t, nt, sym, work):
+    """`attempt_pivot`, returning only whether the pivot was rejected"""
+    N, dim = t.steps.shape
+    if N < 2:
+        return False
+    path, old_sym, old_end, old_lo, old_hi = (work.path, work.old_sym, work.old_end,
+                                              work.old_lo, work.old_hi)
+    g, G, tmp, S = work.mats[0], work.mats[1], work.mats[2], work.mats[3]
+
+    # Rotating the pre-side by g about p is the same as rotating the
+    # post-side by g^-1 and then the whole walk by g, so only the post-side
+    # is ever rotated inside the tree.
+    pre = nt < N / 2
+    for i in range(dim):
+        for j in range(dim):
+            g[i, j] = sym[j, i] if pre else sym[i, j]
+
+    # express g in the root frame, G = rot^T g rot
+    _matmul(g, t.rot, tmp)
+    _matmul(t.rot.T, tmp, G)
+
+    # walk down to the pivot, rotating every right child that lies after it
+    depth = 0
+    a, b = 0, N
+    while b - a >= 2:
+        m = (a + b) // 2
+        n = m - 1
+        path[depth, 0], path[depth, 1] = a, b
+        for i in range(dim):
+            for j in range(dim):
+                S[i, j] = old_sym[depth, i, j] = t.sym[n, i, j]
+            old_end[depth, i] = t.end[n, i]
+            old_lo[depth, i] = t.lo[n, i]
+            old_hi[depth, i] = t.hi[n, i]
+        if nt < m:
+            _matmul(G, S, tmp)
+            for i in range(dim):
+                for j in range(dim):
+                    t.sym[n, i, j] = tmp[i, j]
+            b = m
+        else:
+            # conjugate into the right child's frame, G = S^T G S
+            _matmul(G, S, tmp)
+            _matmul(S.T, tmp, G)
+            a = m
+        depth += 1
+
+    for k in range(depth - 1, -1, -1):
+        _update_node(t, path[k, 0], path[k, 1], work.vecs)
+
+    # only the nodes on the path can have new self-intersections; the
+    # buffers passed to _intersects are rows of vecs it does not use
+    endl, lol, hil, p, x0 = work.vecs[8], work.vecs[9], work.vecs[10], work.vecs[11], work.vecs[0]
+    intersects = False
+    for k in range(depth - 1, -1, -1):
+        a, b = path[k]
+        m = (a + b) // 2
+        _node_box(t, a, m, endl, lol, hil)
+        if _intersects(t, a, m, b, endl, work):
+            intersects = True
+            break
+
+    if intersects:
+        for k in range(depth):
+            n = (path[k, 0] + path[k, 1]) // 2 - 1
+            for i in range(dim):
+                for j in range(dim):
+                    t.sym[n, i, j] = old_sym[k, i, j]
+                t.end[n, i] = old_end[k, i]
+                t.lo[n, i] = old_lo[k, i]
+                t.hi[n, i] = old_hi[k, i]
+        return True
+
+    if pre:
+        # rotate the whole walk by sym about the pivot site
+        _site(t, nt, p, work)
+        for i in range(dim):
+            x = p[i]
+            for c in range(dim):
+                x += sym[i, c] * (t.x0[c] - p[c])
+            x0[i] = x
+        for i in range(dim):
+            t.x0[i] = x0[i]
+        _matmul(sym, t.rot, tmp)
+        for i in range(dim):
+            for j in range(dim):
+                t.rot[i, j] = tmp[i, j]
+    return False
+
+
+@njit
+def run_pivots(t, syms, cdf, n, rng, stats, work):
+    """Runs a batch of n pivot attempts on a SAW-tree in one compiled call,
+    see `polymers.pivot.chain.run_pivots`, drawing symmetries from syms and
+    cdf (see `polymers.pivot.moves.draw_move`), counting every attempt in
+    the `MoveStats` stats and working in the `TreeWork` work.
+
+    Returns
+    -------
+    int, SAWTree
+        Number of accepted pivots, and the tree (modified in place)
+    """
+    N = len(t.steps)
+    accepted = 0
+    for _ in range(n):
+        j = rng.integers(0, N)
+        k = draw_move(cdf, len(syms), rng)
+        t, intersects = attempt_pivot(t, j, syms[k], work)
+        record_move(stats, k, j, N, not intersects)
+        accepted += not intersects
+    return accepted, t
+
+
+@_NJIT_NO_NRT
+def _site(t, i, out, work):
+    """Global position of site i, found by walking down from the root, using
+    work.mats[:2] and work.vecs[:4] as buffers"""
+    N, dim = t.steps.shape
+    S, tmp = work.mats[0], work.mats[1]
+    o, end, lo, hi = work.vecs[0], work.vecs[1], work.vecs[2], work.vecs[3]
+    for r in range(dim):
+        for c in range(dim):
+            S[r, c] = t.rot[r, c]
+        o[r] = t.x0[r]
+    a, b = 0, N
+    while b - a >= 2:
+        m = (a + b) // 2
+        if i < m:
+            b = m
+        else:
+            _node_box(t, a, m, end, lo, hi)
+            for r in range(dim):
+                x = o[r]
+                for c in range(dim):
+                    x += S[r, c] * end[c]
+                o[r] = x
+            _matmul(S, t.sym[m - 1], tmp)
+            for r in range(dim):
+                for c in range(dim):
+                    S[r, c] = tmp[r, c]
+            a = m
+    for r in range(dim):
+        x = o[r]
+        for c in range(dim):
+            x += S[r, c] * t.steps[a, c]
+        out[r] = x
+
+
+class TreeChain:
+    """A pivot Markov chain on a SAW-tree, with the interface of
+    `polymers.pivot.chain.PivotChain` except that observables cost O(N).
+
+    Parameters
+    ----------
+    walk (dim, N) : np.ndarray
+        Initial self-avoiding walk
+    syms (|G|, dim, dim) : np.ndarray, optional
+        Symmetries to pivot with, by default every non-identity element of G_d
+    rng : np.random.Generator, optional
+        Random generator to use, by default `polymers.random.RNG`
+    moves : str or array_like, optional
+        Which of syms to pivot with and how often, see
+        `polymers.pivot.moves.move_set`
+    """
+
+    def __init__(self, walk, syms=None, rng=None, moves='all'):
+        dim, N = walk.shape
+        self.tree = from_walk(np.asarray(walk))
+        self.work = tree_work(N, dim)
+        if syms is None:
+            syms = polymers.random.Gd_array(dim)
+        self.syms, self.cdf = move_set(syms, moves)
+        self.move_stats = move_stats(len(self.syms), N)
+        self.rng = polymers.random.RNG if rng is None else rng
+        self.attempts = 0
+        self.accepted = 0
+
+    @property
+    def walk(self):
+        """Current walk as a (dim, N) array"""
+        return to_walk(self.tree)
+
+    @property
+    def acceptance(self):
+        """Fraction of attempted pivots that were accepted"""
+        return self.accepted / max(self.attempts, 1)
+
+    def get_state(self):
+        """Everything needed to continue the chain exactly, see `set_state`"""
+        return dict(tree={k: v.copy() for k, v in self.tree._asdict().items()},
+                    attempts=self.attempts, accepted=self.accepted,
+                    move_stats=[a.copy() for a in self.move_stats],
+                    rng=self.rng.bit_generator.state)
+
+    def set_state(self, state):
+        """Restores a state from `get_state`, including that of the random generator"""
+        self.tree = SAWTree(**state['tree'])
+        self.attempts = state['attempts']
+        self.accepted = state['accepted']
+        if 'move_stats' in state:
+            for a, saved in zip(self.move_stats, state['move_stats']):
+                a[:] = saved
+        self.rng.bit_generator.state = state['rng']
+
+    def move_summary(self):
+        """Attempted and accepted moves per symmetry and per pivot position,
+        see `polymers.pivot.moves.move_summary`"""
+        return move_summary(self.syms, self.move_stats)
+
+    def observables(self):
+        """Re2, Rg2, Rm2 and X2 of the current walk"""
+        re2, rg2, rm2, _, x2 = observables(self.walk)
+        return re2, rg2, rm2, x2
+
+    def step(self, n=1):
+        """Run n pivot attempts, returning the number accepted"""
+        accepted, self.tree = run_pivots(self.tree, self.syms, self.cdf, n, self.rng,
+                                         self.move_stats, self.work)
+        self.attempts += n
+        self.accepted += accepted
+        return accepted
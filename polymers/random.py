@@ -2,6 +2,8 @@ import numpy as np
 from numba import njit
 from functools import lru_cache
 
+from polymers.symmetry import Gd_table, Gd_codes
+
 RNG = np.random.default_rng(1)
 
 def set_seed(seed):
@@ -53,12 +55,75 @@ def random_transform(dim):
 
 @lru_cache(maxsize=None)
 def Gd(dim):
-    # this is a hack because I don't feel like implementing G_d properly
-    t = np.unique([random_transform(dim) for _ in range(10000)], axis=0)
-    t = [t for t in t if not np.allclose(t, np.eye(dim))]
-    return t
+    """The group G_d without the identity, as a list of (dim, dim) matrices,
+    see `polymers.symmetry.Gd_table`"""
+    return list(Gd_array(dim))
+
+def _non_identity(dim):
+    """Indices of the non-identity elements of `polymers.symmetry.Gd_table(dim)`"""
+    table = Gd_table(dim)
+    identity = (table == np.eye(dim, dtype=np.int8)).all(axis=(1, 2))
+    return np.flatnonzero(~identity)
+
+@lru_cache(maxsize=None)
+def Gd_array(dim):
+    """The group G_d without the identity, stacked into a contiguous
+    (|G_d| - 1, dim, dim) array for use inside numba kernels."""
+    return np.ascontiguousarray(Gd_table(dim)[_non_identity(dim)], dtype=np.int64)
+
+@lru_cache(maxsize=None)
+def Gd_array_codes(dim):
+    """`polymers.symmetry.sym_code` of every element of `Gd_array(dim)`"""
+    codes = np.ascontiguousarray(Gd_codes(dim)[_non_identity(dim)])
+    codes.flags.writeable = False
+    return codes
 
 def rand_Gd(dim):
     """Randomly sample a matrix from the group G_d of all
     possible transformations of d dimensions, not including the identity."""
-    return Gd(dim)[RNG.integers(0, len(Gd(dim)))]
\ No newline at end of file
+    syms = Gd_array(dim)
+    return syms[RNG.integers(0, len(syms))]
+
+# Independent random streams for kernels that advance many chains at once
+# (e.g. in a prange loop), where a np.random.Generator per chain cannot be
+# passed in. Each stream is the (4,) uint64 state of a xoshiro256** generator
+# (Blackman & Vigna), advanced in place.
+
+def stream_states(seed, count):
+    """States (count, 4) of count independent streams, one per sequence
+    spawned from `np.random.SeedSequence(seed)` (or from seed itself if it
+    already is a SeedSequence)"""
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    states = np.array([s.generate_state(4, np.uint64) for s in seed.spawn(count)],
+                      dtype=np.uint64).reshape(count, 4)
+    # the all-zero state is the only one xoshiro cannot leave
+    states[(states == 0).all(axis=1), 0] = 1
+    return states
+
+@njit
+def _rotl(x, k):
+    return (x << np.uint64(k)) | (x >> np.uint64(64 - k))
+
+@njit
+def stream_next(s):
+    """Next 64 random bits of the stream s"""
+    result = _rotl(s[1] * np.uint64(5), 7) * np.uint64(9)
+    t = s[1] << np.uint64(17)
+    s[2] ^= s[0]
+    s[3] ^= s[1]
+    s[1] ^= s[2]
+    s[0] ^= s[3]
+    s[2] ^= t
+    s[3] = _rotl(s[3], 45)
+    return result
+
+@njit
+def stream_random(s):
+    """Uniform float in [0, 1) from the stream s"""
+    return np.float64(stream_next(s) >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+@njit
+def stream_integers(s, n):
+    """Uniform integer in [0, n) from the stream s, for n much smaller than 2^53"""
+    return np.int64(stream_random(s) * n)
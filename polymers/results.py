@@ -0,0 +1,209 @@
+"""Columnar binary result files.
+
+A result set is a directory holding one raw little-endian file per column,
+`<column>.bin`, next to a `meta.json` manifest with the column dtypes, the
+number of committed rows and free-form metadata (d, N, seed, ...).
+
+Rows are buffered in memory and appended to the column files in chunks. The
+manifest is only rewritten (atomically, via a temporary file and
+`os.replace`) after the chunk has been flushed to disk, so after a crash the
+manifest never claims rows that were not written. Anything past the
+committed rows is ignored by `load_results` and truncated when the writer is
+reopened with `resume=True`.
+"""
+import json
+import os
+import pickle
+
+import numpy as np
+
+__all__ = ['ResultWriter', 'load_results', 'read_metadata', 'is_complete', 'write_json',
+           'save_checkpoint', 'load_checkpoint']
+
+MANIFEST = 'meta.json'
+
+
+def _replace(file, data, mode):
+    tmp = file + '.tmp'
+    with open(tmp, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file)
+
+
+def write_json(file, obj):
+    """Atomically replaces file with obj as JSON"""
+    _replace(file, json.dumps(obj, indent=1), 'w')
+
+
+def save_checkpoint(file, state):
+    """Atomically replaces file with a pickle of state"""
+    _replace(file, pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+
+
+def load_checkpoint(file):
+    """Loads a checkpoint written by `save_checkpoint`"""
+    with open(file, 'rb') as f:
+        return pickle.load(f)
+
+
+def _column_file(path, name):
+    return os.path.join(path, f'{name}.bin')
+
+
+def read_metadata(path):
+    """Manifest of the result set at path: columns, rows and metadata"""
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def is_complete(path):
+    """Whether the result set at path exists and was marked complete by its
+    writer (metadata['complete'])"""
+    try:
+        return bool(read_metadata(path)['metadata'].get('complete'))
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+class ResultWriter:
+    """Buffered, crash-safe writer of a columnar result set.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the result set, created if needed
+    columns : dict or list of (str, dtype)
+        Column names and dtypes
+    metadata : dict, optional
+        JSON-serialisable metadata stored in the manifest
+    buffer_rows : int, optional
+        Rows buffered in memory before they are flushed, by default 2**16
+    resume : bool, optional
+        Continue an existing result set, dropping any uncommitted rows,
+        instead of starting a new one. The columns must match.
+    """
+
+    def __init__(self, path, columns, metadata=None, buffer_rows=2**16, resume=False):
+        self.path = path
+        self.columns = {name: np.dtype(dtype).newbyteorder('<')
+                        for name, dtype in dict(columns).items()}
+        self.buffers = {name: np.empty(buffer_rows, dtype=dtype)
+                        for name, dtype in self.columns.items()}
+        self.buffered = 0
+        os.makedirs(path, exist_ok=True)
+        if resume:
+            meta = read_metadata(path)
+            if meta['columns'] != {name: dtype.str for name, dtype in self.columns.items()}:
+                raise ValueError(f"columns of {path} do not match")
+            self.rows = meta['rows']
+            self.metadata = meta['metadata'] if metadata is None else metadata
+            for name, dtype in self.columns.items():
+                with open(_column_file(path, name), 'r+b') as f:
+                    f.truncate(self.rows * dtype.itemsize)
+        else:
+            self.rows = 0
+            self.metadata = {} if metadata is None else metadata
+            for name in self.columns:
+                open(_column_file(path, name), 'wb').close()
+            self._commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, **row):
+        """Appends one row, given as column=value"""
+        if self.buffered == len(next(iter(self.buffers.values()))):
+            self.flush()
+        for name, buffer in self.buffers.items():
+            buffer[self.buffered] = row[name]
+        self.buffered += 1
+
+    def extend(self, **cols):
+        """Appends many rows, given as column=array"""
+        n = len(cols[next(iter(self.columns))])
+        capacity = len(next(iter(self.buffers.values())))
+        if self.buffered + n > capacity:
+            self.flush()
+        if n > capacity:
+            self._write({name: np.asarray(cols[name], dtype=dtype)
+                         for name, dtype in self.columns.items()}, n)
+            return
+        for name, buffer in self.buffers.items():
+            buffer[self.buffered:self.buffered + n] = cols[name]
+        self.buffered += n
+
+    def truncate(self, rows):
+        """Drops everything after the first rows rows, e.g. to roll back to a
+        checkpoint"""
+        self.flush()
+        if rows > self.rows:
+            raise ValueError(f"{self.path} has only {self.rows} rows")
+        for name, dtype in self.columns.items():
+            with open(_column_file(self.path, name), 'r+b') as f:
+                f.truncate(rows * dtype.itemsize)
+        self.rows = rows
+        self._commit()
+
+    def set_metadata(self, **metadata):
+        """Updates the metadata, committing everything written so far"""
+        self.flush()
+        self.metadata.update(metadata)
+        self._commit()
+
+    def flush(self):
+        """Writes the buffered rows to disk and commits them"""
+        if self.buffered:
+            self._write({name: buffer[:self.buffered]
+                         for name, buffer in self.buffers.items()}, self.buffered)
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def _write(self, chunk, n):
+        for name, values in chunk.items():
+            with open(_column_file(self.path, name), 'ab') as f:
+                f.write(values.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.rows += n
+        self._commit()
+
+    def _commit(self):
+        write_json(os.path.join(self.path, MANIFEST), {
+            'columns': {name: dtype.str for name, dtype in self.columns.items()},
+            'rows': self.rows,
+            'metadata': self.metadata,
+        })
+
+
+def load_results(path, mmap=True):
+    """Loads the committed rows of a result set.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the result set
+    mmap : bool, optional
+        Memory-map the columns read-only instead of reading them, by default True
+
+    Returns
+    -------
+    dict, dict
+        column name -> array, and the metadata
+    """
+    meta = read_metadata(path)
+    rows = meta['rows']
+    cols = {}
+    for name, dtype in meta['columns'].items():
+        file = _column_file(path, name)
+        if mmap and rows:
+            cols[name] = np.memmap(file, dtype=dtype, mode='r', shape=(rows,))
+        else:
+            cols[name] = np.fromfile(file, dtype=dtype, count=rows)
+    return cols, meta['metadata']
@@ -0,0 +1,298 @@
+"""Streaming error analysis of Markov chain time series.
+
+Everything here works on series that arrive in pieces and keeps bounded
+memory, so a running chain can report error bars and autocorrelation
+times as it goes and stop once they are good enough:
+
+* `Blocking` does online binning/blocking (Flyvbjerg & Petersen, J. Chem.
+  Phys. 91, 461 (1989)) of the full series.
+* `CoarseSeries` keeps at most `capacity` block means of the full series,
+  doubling the block length whenever it fills up.
+* `integrated_time` estimates the integrated autocorrelation time with an
+  FFT and Sokal's automatic window, and `equilibration` picks the burn-in
+  that maximises the number of effectively independent samples (Chodera,
+  J. Chem. Theory Comput. 12, 1799 (2016)).
+* `StreamingStats` combines them for several observables at once.
+
+Autocorrelation times follow Sokal's convention, tau = 1/2 + sum_t rho(t),
+so that the squared error of the mean of n samples is 2 tau var / n.
+"""
+import numpy as np
+
+__all__ = ['Blocking', 'CoarseSeries', 'StreamingStats', 'autocorrelation',
+           'integrated_time', 'equilibration']
+
+
+def autocorrelation(x):
+    """Normalised autocorrelation function of a series, computed with an FFT"""
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    f = np.fft.rfft(x - x.mean(), n=2 * n)
+    acf = np.fft.irfft(f * np.conjugate(f))[:n]
+    if acf[0] == 0:
+        return np.zeros(n)
+    return acf / acf[0]
+
+
+def integrated_time(x, c=5.0):
+    """Integrated autocorrelation time of a series, in units of its samples.
+
+    The sum over the autocorrelation function is cut off at the smallest
+    window M with M >= c tau(M) (Sokal's automatic windowing).
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Series
+    c : float, optional
+        Window constant, by default 5
+
+    Returns
+    -------
+    float
+        tau_int, 0.5 for an uncorrelated series
+    """
+    if len(x) < 2:
+        return 0.5
+    taus = np.cumsum(autocorrelation(x)) - 0.5
+    window = np.arange(len(taus)) >= c * taus
+    M = np.argmax(window) if window.any() else len(taus) - 1
+    return max(taus[M], 0.5)
+
+
+def equilibration(x, candidates=20):
+    """Number of leading samples of x to discard as burn-in.
+
+    Tries `candidates` starting points in the first half of the series and
+    returns the one after which the number of effectively independent
+    samples, (n - t0) / (2 tau), is largest.
+    """
+    n = len(x)
+    if n < 4:
+        return 0
+    best, best_neff = 0, -1.0
+    for t0 in np.unique(np.linspace(0, n // 2, candidates).astype(int)):
+        neff = (n - t0) / (2 * integrated_time(x[t0:]))
+        if neff > best_neff:
+            best, best_neff = t0, neff
+    return int(best)
+
+
+class Blocking:
+    """Online binning/blocking analysis of a scalar series.
+
+    Level l holds the running moments of the means of consecutive blocks of
+    2**l samples. The error of the mean estimated at level l,
+    sqrt(var_l / n_l), grows with l until the blocks are longer than the
+    autocorrelation time and then plateaus.
+    """
+
+    def __init__(self, min_blocks=32):
+        self.min_blocks = min_blocks
+        self.shift = None
+        self.count = []
+        self.sum = []
+        self.sumsq = []
+        self.pending = []
+
+    def add(self, x):
+        """Adds a single sample"""
+        self.add_many(np.atleast_1d(x))
+
+    def add_many(self, xs):
+        """Adds consecutive samples"""
+        xs = np.asarray(xs, dtype=np.float64).ravel()
+        if xs.size == 0:
+            return
+        if self.shift is None:
+            # accumulate around the first sample to avoid cancellation
+            self.shift = xs[0]
+        xs = xs - self.shift
+        level = 0
+        while xs.size:
+            if level == len(self.count):
+                self.count.append(0)
+                self.sum.append(0.0)
+                self.sumsq.append(0.0)
+                self.pending.append(None)
+            self.count[level] += xs.size
+            self.sum[level] += xs.sum()
+            self.sumsq[level] += (xs * xs).sum()
+            if self.pending[level] is not None:
+                xs = np.concatenate(([self.pending[level]], xs))
+                self.pending[level] = None
+            if xs.size % 2:
+                self.pending[level] = xs[-1]
+                xs = xs[:-1]
+            xs = 0.5 * (xs[0::2] + xs[1::2])
+            level += 1
+
+    @property
+    def n(self):
+        """Number of samples"""
+        return self.count[0] if self.count else 0
+
+    @property
+    def mean(self):
+        if not self.n:
+            return np.nan
+        return self.shift + self.sum[0] / self.n
+
+    def variance(self, level=0):
+        """Sample variance of the block means at a level"""
+        n = self.count[level]
+        if n < 2:
+            return np.nan
+        return (self.sumsq[level] - self.sum[level] ** 2 / n) / (n - 1)
+
+    def errors(self):
+        """Error of the mean estimated at every level with at least two blocks"""
+        return np.array([np.sqrt(max(self.variance(l), 0.0) / self.count[l])
+                         for l in range(len(self.count)) if self.count[l] >= 2])
+
+    def error(self):
+        """Error of the mean: the largest estimate over the levels that still
+        have at least `min_blocks` blocks"""
+        errors = self.errors()
+        levels = [l for l in range(len(errors)) if self.count[l] >= self.min_blocks]
+        if not levels:
+            return np.inf
+        return errors[levels].max()
+
+    def tau(self):
+        """Integrated autocorrelation time implied by `error`"""
+        if self.n < 2 or self.variance() == 0:
+            return 0.5
+        return 0.5 * self.error() ** 2 * self.n / self.variance()
+
+
+class CoarseSeries:
+    """Bounded-memory copy of a series made of means of consecutive blocks.
+
+    Once `capacity` blocks are stored, neighbouring blocks are merged and the
+    block length doubles, so the whole series is always covered at the finest
+    resolution that fits.
+    """
+
+    def __init__(self, capacity=4096):
+        if capacity % 2:
+            raise ValueError("capacity must be even")
+        self.capacity = capacity
+        self.block = 1
+        self.values = np.empty(capacity)
+        self.size = 0
+        self.partial_sum = 0.0
+        self.partial_n = 0
+
+    def add_many(self, xs):
+        """Adds consecutive samples"""
+        xs = np.asarray(xs, dtype=np.float64).ravel()
+        while xs.size:
+            if self.partial_n or xs.size < self.block:
+                k = min(self.block - self.partial_n, xs.size)
+                self.partial_sum += xs[:k].sum()
+                self.partial_n += k
+                xs = xs[k:]
+                if self.partial_n == self.block:
+                    self._push(np.array([self.partial_sum / self.block]))
+                    self.partial_sum = 0.0
+                    self.partial_n = 0
+                continue
+            k = min(xs.size // self.block, self.capacity - self.size)
+            full, xs = xs[:k * self.block], xs[k * self.block:]
+            self._push(full.reshape(k, self.block).mean(axis=1))
+
+    def _push(self, means):
+        self.values[self.size:self.size + len(means)] = means
+        self.size += len(means)
+        if self.size == self.capacity:
+            half = self.capacity // 2
+            self.values[:half] = 0.5 * (self.values[0::2] + self.values[1::2])
+            self.size = half
+            self.block *= 2
+
+    @property
+    def data(self):
+        """Complete block means"""
+        return self.values[:self.size]
+
+
+class StreamingStats:
+    """Live means, error bars, autocorrelation times and burn-in for several
+    observables of a chain.
+
+    Samples are fed in with `add`. `summary` discards the detected burn-in
+    from the coarse-grained series and estimates the error of the mean from
+    its FFT autocorrelation time; the blocking error of the full series is
+    reported alongside.
+
+    Parameters
+    ----------
+    names : sequence of str
+        Names of the observables, in the column order of the samples
+    capacity : int, optional
+        Blocks kept per observable, see `CoarseSeries`
+    min_blocks : int, optional
+        Fewest blocks a blocking level may have to be used, see `Blocking`
+    """
+
+    def __init__(self, names, capacity=4096, min_blocks=32):
+        self.names = tuple(names)
+        self.blocking = [Blocking(min_blocks) for _ in self.names]
+        self.series = [CoarseSeries(capacity) for _ in self.names]
+
+    def add(self, samples):
+        """Adds one row of samples, or an (n, len(names)) array of rows"""
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, len(self.names))
+        for k in range(len(self.names)):
+            self.blocking[k].add_many(samples[:, k])
+            self.series[k].add_many(samples[:, k])
+
+    @property
+    def n(self):
+        """Number of samples of each observable"""
+        return self.blocking[0].n
+
+    def _summarize(self, k):
+        blocking = self.blocking[k]
+        series = self.series[k]
+        data = series.data
+        t0 = equilibration(data)
+        data = data[t0:]
+        out = dict(n=blocking.n, burn_in=t0 * series.block,
+                   blocking_error=blocking.error())
+        if len(data) < 16:
+            out.update(mean=blocking.mean, error=np.inf, tau=np.nan)
+            return out
+        tau_b = integrated_time(data)
+        var_b = data.var(ddof=1)
+        var_0 = blocking.variance()
+        out['mean'] = data.mean()
+        out['error'] = np.sqrt(var_b * 2 * tau_b / len(data))
+        out['tau'] = var_b * tau_b * series.block / var_0 if var_0 > 0 else 0.5
+        return out
+
+    def summary(self):
+        """For each observable: mean, error (of the mean after burn-in), tau
+        (integrated autocorrelation time in samples), burn_in (samples
+        discarded), blocking_error (of the full series) and n"""
+        return {name: self._summarize(k) for k, name in enumerate(self.names)}
+
+    def converged(self, target):
+        """Whether every observable's relative error is at most target.
+
+        The cheap blocking errors are checked first, so that the full
+        `summary` is only computed once they are small enough.
+        """
+        for b in self.blocking:
+            if not b.error() <= target * abs(b.mean):
+                return False
+        for s in self.summary().values():
+            if not s['error'] <= target * abs(s['mean']):
+                return False
+        return True
+
+    def report(self):
+        """One-line summary for progress bars"""
+        return ' '.join(f"{name}={s['mean']:.4g}±{s['error']:.2g}(τ={s['tau']:.3g})"
+                        for name, s in self.summary().items())
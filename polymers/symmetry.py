@@ -0,0 +1,121 @@
+"""The symmetry group G_d of the hypercubic lattice.
+
+G_d is the hyperoctahedral group: the 2^d d! signed permutation matrices,
+each with a single entry of +-1 in every row and column. It is enumerated
+exactly here, rather than sampled, and cached per dimension.
+
+Applying a signed permutation to a site does not need a matrix multiply:
+row i of the matrix only picks coordinate perm[i] of the site and maybe
+flips its sign. `sym_code` packs (perm, signs) into a single int64, 8 bits
+per row (7 bits of perm[i], then the sign bit), so numba kernels can pass
+symmetries around as scalars and apply them in O(d) with `rotate_site_code`.
+"""
+from functools import lru_cache
+from itertools import permutations, product
+
+import numpy as np
+from numba import njit
+
+__all__ = ['group_order', 'Gd_table', 'Gd_codes', 'determinants', 'sym_code', 'identity_code',
+           'compose_codes', 'rotate_site_code', 'transform_site_code']
+
+# codes have 8 bits per dimension
+MAX_CODE_DIM = 8
+
+
+def group_order(dim):
+    """|G_d| = 2^d d!"""
+    order = 2 ** dim
+    for k in range(2, dim + 1):
+        order *= k
+    return order
+
+
+@lru_cache(maxsize=None)
+def Gd_table(dim):
+    """Every element of G_d, identity included, as a read-only contiguous
+    (|G_d|, dim, dim) int8 array in lexicographic order of the matrices."""
+    table = np.zeros((group_order(dim), dim, dim), dtype=np.int8)
+    rows = np.arange(dim)
+    k = 0
+    for perm in permutations(range(dim)):
+        for signs in product((-1, 1), repeat=dim):
+            table[k, rows, perm] = signs
+            k += 1
+    table = np.unique(table, axis=0)
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=None)
+def Gd_codes(dim):
+    """`sym_code` of every element of `Gd_table(dim)`, (|G_d|,) int64"""
+    codes = np.array([sym_code(sym) for sym in Gd_table(dim)], dtype=np.int64)
+    codes.flags.writeable = False
+    return codes
+
+
+def determinants(syms):
+    """Determinants (|G|,) of a stack of signed permutation matrices: +1 for
+    rotations and -1 for reflections"""
+    return np.rint(np.linalg.det(np.asarray(syms, dtype=np.float64))).astype(np.int64)
+
+
+@njit
+def sym_code(sym):
+    """Packs a signed permutation matrix (dim, dim), dim <= 8, into an int64.
+
+    Byte i holds the column of the nonzero entry of row i, with its top bit
+    set if that entry is -1.
+    """
+    dim = len(sym)
+    code = np.int64(0)
+    for i in range(dim):
+        for j in range(dim):
+            if sym[i, j] != 0:
+                byte = j | (128 if sym[i, j] < 0 else 0)
+                code |= np.int64(byte) << (8 * i)
+    return code
+
+
+@njit
+def identity_code(dim):
+    """`sym_code` of the (dim, dim) identity"""
+    code = np.int64(0)
+    for i in range(dim):
+        code |= np.int64(i) << (8 * i)
+    return code
+
+
+@njit
+def compose_codes(a, b, dim):
+    """`sym_code` of the product of the symmetries with codes a and b (b first)"""
+    code = np.int64(0)
+    for i in range(dim):
+        byte_a = (a >> (8 * i)) & 255
+        byte_b = (b >> (8 * (byte_a & 127))) & 255
+        code |= np.int64((byte_b & 127) | ((byte_a ^ byte_b) & 128)) << (8 * i)
+    return code
+
+
+@njit(inline='always')
+def transform_site_code(code, x, x0, y):
+    """y = sym @ (x - x0) for the symmetry with the given `sym_code`"""
+    dim = len(y)
+    for i in range(dim):
+        byte = (code >> (8 * i)) & 255
+        j = byte & 127
+        v = x[j] - x0[j]
+        y[i] = -v if byte & 128 else v
+
+
+@njit(inline='always')
+def rotate_site_code(code, x0, x, y):
+    """y = sym @ (x - x0) + x0 for the symmetry with the given `sym_code`,
+    as `polymers.pivot.fast.rotate_site` does with the matrix"""
+    dim = len(y)
+    for i in range(dim):
+        byte = (code >> (8 * i)) & 255
+        j = byte & 127
+        v = x[j] - x0[j]
+        y[i] = x0[i] + (-v if byte & 128 else v)
@@ -0,0 +1,205 @@
+"""Compact integer storage of walks.
+
+Every site of a walk with N sites lies within N of its first site, and a
+pivot about any site keeps every site within 2N of where the first site
+was. So a walk whose first site is at most `extent` from the origin can be
+pivoted once without overflow if extent + 2N fits into its dtype. Walks
+are stored in the narrowest of `WALK_DTYPES` that satisfies this, and
+promoted to a wider one once they have drifted too far.
+
+On disk, a walk is stored as its sites (N, dim), and a stack of walks as
+(count, N, dim), both C-contiguous. That is the layout the pivot engines
+work on, so a walk file can be memory-mapped and handed to them without
+transposing it. The original walk files hold (dim, N) instead; they can
+still be loaded, at the cost of a copy, or rewritten with `convert_walk`.
+
+Files ending in `PACKED_SUFFIX` instead hold every walk as its first site
+and its steps, at 2 bits per step in 2D and 3 in 3D (see `polymers.packed`),
+32 and 21 times smaller than int64 sites. They start with a header
+
+    magic b'SAWSTEPS', version, dim, stacked (all uint16), count, N (int64)
+
+followed by the first sites (count, dim) and the packed steps
+(count, `packed_words(N, dim)`), both int64, and end with the CRC-32 of
+everything before it (uint32), all little-endian. They cannot be
+memory-mapped; `load_walk` decodes them, optionally into a preallocated
+buffer.
+"""
+import os
+import struct
+import warnings
+import zlib
+
+import numpy as np
+
+from polymers.packed import packed_words, pack_walks, unpack_walks
+
+__all__ = ['WALK_DTYPES', 'PACKED_SUFFIX', 'walk_dtype', 'walk_limit', 'extent', 'compact',
+           'promote', 'is_legacy_layout', 'is_packed', 'load_walk', 'save_walk', 'convert_walk']
+
+# candidate storage types, narrowest first
+WALK_DTYPES = (np.int16, np.int32, np.int64)
+
+# suffix of walk files stored as packed steps
+PACKED_SUFFIX = '.steps'
+
+_MAGIC = b'SAWSTEPS'
+_VERSION = 1
+# magic, version, dim, stacked, count, N
+_HEADER = struct.Struct('<8sHHHxxqq')
+_CRC = struct.Struct('<I')
+
+
+def walk_limit(dtype, N):
+    """Largest coordinate magnitude the first site of a walk of N sites
+    stored as dtype may have for a pivot to be safe"""
+    return int(np.iinfo(dtype).max) - 2 * N
+
+
+def walk_dtype(N, extent=0):
+    """Narrowest dtype of `WALK_DTYPES` for a walk of N sites whose first
+    site is at most extent from the origin in every coordinate"""
+    for dtype in WALK_DTYPES:
+        if extent <= walk_limit(dtype, N):
+            return np.dtype(dtype)
+    raise OverflowError(f"a walk of {N} sites at {extent} does not fit into int64")
+
+
+def extent(walk):
+    """Largest coordinate magnitude of the first site of a walk (dim, N)"""
+    if walk.shape[1] == 0:
+        return 0
+    return int(np.abs(walk[:, 0].astype(np.int64)).max())
+
+
+def compact(walk):
+    """Walk (dim, N) in the narrowest safe dtype; not copied if it already is"""
+    return walk.astype(walk_dtype(walk.shape[1], extent(walk)), copy=False)
+
+
+def promote(walk):
+    """Walk (dim, N) in a dtype at least as wide as its own that is safe for
+    its current position; not copied if its own dtype still is"""
+    dtype = np.promote_types(walk.dtype, walk_dtype(walk.shape[1], extent(walk)))
+    return walk.astype(dtype, copy=False)
+
+
+def is_legacy_layout(shape):
+    """Whether an array of this shape holds walks as (..., dim, N) rather than
+    as (..., N, dim). Walks have at most 4 dimensions and, unless they are
+    shorter than that, more sites than dimensions."""
+    return len(shape) >= 2 and shape[-2] <= 4 < shape[-1]
+
+
+def is_packed(file):
+    """Whether a walk file holds packed steps rather than sites"""
+    return str(file).endswith(PACKED_SUFFIX)
+
+
+def load_walk(file, mmap=True, out=None):
+    """Loads a walk (N, dim), or a stack of walks (count, N, dim), from a .npy file
+    or a file of packed steps.
+
+    Parameters
+    ----------
+    file : str
+        .npy file written by `save_walk`, or in the legacy (dim, N) layout,
+        or a `PACKED_SUFFIX` file
+    mmap : bool, optional
+        Memory-map a .npy file read-only instead of reading it into memory
+    out : np.ndarray, optional
+        Buffer of the shape of the walks in a packed file, of any integer
+        dtype wide enough for them, to decode them into
+
+    Returns
+    -------
+    np.ndarray (N, dim) or (count, N, dim)
+        Sites of the walk(s), C-contiguous. Legacy files are transposed into
+        a copy in memory, with a warning to convert them. Packed files are
+        decoded into out, or else into a new array in the narrowest safe
+        dtype.
+    """
+    if is_packed(file):
+        return _load_packed(file, out)
+    if out is not None:
+        raise ValueError("only packed walk files are decoded into a buffer")
+    walks = np.load(file, mmap_mode='r' if mmap else None)
+    if is_legacy_layout(walks.shape):
+        warnings.warn(f"{file} holds walks as (dim, N); convert it with "
+                      f"polymers.walk.convert_walk to load it without a copy")
+        walks = np.ascontiguousarray(np.swapaxes(walks, -1, -2))
+    return walks
+
+
+def save_walk(file, sites):
+    """Saves a walk (N, dim), or a stack of walks (count, N, dim), to a .npy
+    file in the canonical layout, or as packed steps if file ends in
+    `PACKED_SUFFIX`. The file is replaced atomically."""
+    tmp = file + '.tmp'
+    with open(tmp, 'wb') as f:
+        if is_packed(file):
+            _save_packed(f, sites)
+        else:
+            np.save(f, np.ascontiguousarray(sites))
+    os.replace(tmp, file)
+
+
+def _save_packed(f, sites):
+    stacked = sites.ndim == 3
+    walks = sites if stacked else sites[None]
+    count, N, dim = walks.shape
+    origins, words = pack_walks(np.ascontiguousarray(walks))
+    data = (_HEADER.pack(_MAGIC, _VERSION, dim, stacked, count, N)
+            + origins.astype('<i8').tobytes() + words.astype('<i8').tobytes())
+    f.write(data)
+    f.write(_CRC.pack(zlib.crc32(data)))
+
+
+def _load_packed(file, out):
+    with open(file, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size + _CRC.size:
+        raise ValueError(f"{file} is too short to be a packed walk file")
+    magic, version, dim, stacked, count, N = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"{file} is not a packed walk file of version {_VERSION}")
+    if not 1 <= dim <= 4 or stacked not in (0, 1) or count < 0 or N < 0 or (
+            not stacked and count != 1):
+        raise ValueError(f"{file} has an invalid header: d={dim}, stacked={stacked}, "
+                         f"count={count}, N={N}")
+    size = _HEADER.size + 8 * count * (dim + packed_words(N, dim))
+    if len(data) != size + _CRC.size:
+        raise ValueError(f"{file} is truncated or has trailing data")
+    if _CRC.unpack_from(data, size)[0] != zlib.crc32(memoryview(data)[:size]):
+        raise ValueError(f"{file} is corrupt: its checksum does not match")
+    origins = np.frombuffer(data, dtype='<i8', count=count * dim,
+                            offset=_HEADER.size).reshape(count, dim)
+    words = np.frombuffer(data, dtype='<i8', count=count * packed_words(N, dim),
+                          offset=_HEADER.size + origins.nbytes).reshape(count, -1)
+    shape = (count, N, dim) if stacked else (N, dim)
+    first = int(np.abs(origins).max()) if origins.size else 0
+    if out is None:
+        out = np.empty(shape, dtype=walk_dtype(N, first))
+    elif out.shape[-1:] != (dim,):
+        raise ValueError(f"{file} holds walks in d={dim}, but out has shape {out.shape}")
+    elif out.shape != shape or not out.flags.c_contiguous:
+        raise ValueError(f"out must be C-contiguous of shape {shape}")
+    elif (not np.issubdtype(out.dtype, np.signedinteger)
+          or first + N > np.iinfo(out.dtype).max):
+        # every site lies within N - 1 of the first site of its walk
+        raise ValueError(f"out of dtype {out.dtype} cannot hold the walks of {file}")
+    unpack_walks(origins, words, out if stacked else out[None])
+    return out
+
+
+def convert_walk(file):
+    """Rewrites a walk file in the legacy (dim, N) layout as (N, dim), in the
+    narrowest safe dtype. Returns whether the file needed converting."""
+    walks = np.load(file, mmap_mode='r')
+    if not is_legacy_layout(walks.shape):
+        return False
+    N = walks.shape[-1]
+    first = np.asarray(walks[..., 0]).astype(np.int64)
+    dtype = walk_dtype(N, int(np.abs(first).max()) if first.size else 0)
+    save_walk(file, np.swapaxes(walks, -1, -2).astype(dtype))
+    return True
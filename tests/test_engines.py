@@ -0,0 +1,41 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+from polymers.pivot.chain import PivotChain
+from polymers.pivot.lazy import LazyChain
+from polymers.pivot.tree import TreeChain
+from polymers.random import Gd_array
+
+
+def straight_walk(N, dim):
+    walk = np.zeros((dim, N), dtype=np.int64)
+    walk[0] = np.arange(N)
+    return walk
+
+
+def assert_same_chain(engine, N, dim, steps=3000):
+    """engine draws the same moves as PivotChain from the same seed, so it
+    must accept the same pivots and reach the same walks"""
+    chains = [chain(straight_walk(N, dim), syms=Gd_array(dim), rng=np.random.default_rng(7))
+              for chain in (PivotChain, engine)]
+    for _ in range(steps // 500):
+        for chain in chains:
+            chain.step(500)
+        reference, walk = (np.asarray(chain.walk) for chain in chains)
+        assert np.array_equal(walk - walk[:, :1], reference - reference[:, :1])
+        assert np.allclose(chains[1].observables(), chains[0].observables())
+    assert chains[1].attempts == chains[0].attempts == steps
+    assert chains[1].accepted == chains[0].accepted > 0
+
+
+@pytest.mark.parametrize('dim', [2, 3])
+def test_tree_matches_pivot_chain(dim):
+    assert_same_chain(TreeChain, 300, dim)
+
+
+@pytest.mark.parametrize('dim', [2, 3])
+@pytest.mark.parametrize('max_segments', [4, 64])
+def test_lazy_matches_pivot_chain(dim, max_segments):
+    assert_same_chain(partial(LazyChain, max_segments=max_segments), 300, dim)
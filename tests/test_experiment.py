@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import polymers.experiment
+from polymers.experiment import run_SAW
+from polymers.results import ResultWriter, is_complete, load_checkpoint, load_results
+
+
+def straight_walk(N, dim=2):
+    walk = np.zeros((dim, N), dtype=np.int64)
+    walk[0] = np.arange(N)
+    return walk
+
+
+def test_resume_completes_result_sets_after_crash(tmp_path, monkeypatch):
+    """A run that stops after its final checkpoint but before marking its
+    result sets complete is completed by resuming it"""
+    out = str(tmp_path / 'walk.saw')
+    set_metadata = ResultWriter.set_metadata
+
+    def crash(self, **metadata):
+        if metadata.get('complete'):
+            raise RuntimeError("crash")
+        set_metadata(self, **metadata)
+
+    monkeypatch.setattr(ResultWriter, 'set_metadata', crash)
+    with pytest.raises(RuntimeError):
+        run_SAW(straight_walk(30), 10, 4, out, rng=np.random.default_rng(0), progress=False,
+                per_step=True)
+    monkeypatch.undo()
+    assert load_checkpoint(f'{out}/{polymers.experiment.CHECKPOINT}')['complete']
+    assert not is_complete(out)
+
+    stats = run_SAW(straight_walk(30), 10, 4, out, rng=np.random.default_rng(1),
+                    progress=False, per_step=True, resume=True)
+    assert is_complete(out) and is_complete(f'{out}/steps')
+    cols, meta = load_results(out)
+    assert len(cols['batch']) == 4
+    assert sum(meta['move_stats']['sym_attempts']) == 40
+    assert len(load_results(f'{out}/steps')[0]['Re2']) == 40
+    assert stats.blocking[0].n == 40
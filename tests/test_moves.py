@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from polymers.pivot.moves import move_set
+from polymers.random import Gd_array
+
+
+def test_weights_must_match_inverses():
+    syms = Gd_array(2)
+    quarter = [k for k, sym in enumerate(syms) if (sym == [[0, -1], [1, 0]]).all()][0]
+    half = [k for k, sym in enumerate(syms) if (sym == -np.eye(2)).all()][0]
+
+    weights = np.ones(len(syms))
+    weights[quarter] = 5
+    with pytest.raises(ValueError, match='inverse'):
+        move_set(syms, weights)
+
+    # the quarter turn's inverse is its transpose
+    weights[[k for k, sym in enumerate(syms) if (sym == syms[quarter].T).all()][0]] = 5
+    kept, cdf = move_set(syms, weights)
+    assert len(kept) == len(syms) and len(cdf) == len(syms)
+
+    # the half turn is its own inverse
+    weights = np.ones(len(syms))
+    weights[half] = 5
+    move_set(syms, weights)
+
+
+def test_weights_need_inverse_in_move_set():
+    syms = Gd_array(3)
+    rotations, _ = move_set(syms, 'rotations')
+    weights = np.ones(len(rotations))
+    move_set(rotations, weights)
+    # dropping a 3-fold rotation but keeping its inverse is asymmetric
+    order3 = [k for k, sym in enumerate(rotations)
+              if (np.linalg.matrix_power(sym, 3) == np.eye(3)).all()]
+    weights[order3[0]] = 0
+    with pytest.raises(ValueError, match='inverse'):
+        move_set(rotations, weights)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from polymers.results import ResultWriter, is_complete, load_results
+
+COLUMNS = [('batch', np.int64), ('Re2', np.float64)]
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(tmp_path, mmap):
+    path = str(tmp_path / 'run.saw')
+    with ResultWriter(path, COLUMNS, metadata=dict(N=10), buffer_rows=4) as writer:
+        for i in range(6):
+            writer.append(batch=i, Re2=i / 2)
+        writer.extend(batch=np.arange(6, 20), Re2=np.arange(6, 20) / 2)
+        writer.set_metadata(complete=True)
+    cols, meta = load_results(path, mmap=mmap)
+    assert np.array_equal(cols['batch'], np.arange(20))
+    assert np.array_equal(cols['Re2'], np.arange(20) / 2)
+    assert meta == dict(N=10, complete=True)
+    assert is_complete(path)
+
+
+def test_resume_drops_uncommitted_rows(tmp_path):
+    path = str(tmp_path / 'run.saw')
+    writer = ResultWriter(path, COLUMNS, buffer_rows=4)
+    writer.extend(batch=np.arange(5), Re2=np.zeros(5))
+    writer.flush()
+    # rows written after the last commit, as by a crash mid-flush
+    with open(tmp_path / 'run.saw' / 'batch.bin', 'ab') as f:
+        f.write(np.arange(3, dtype='<i8').tobytes())
+    writer.append(batch=99, Re2=0)
+    assert len(load_results(path)[0]['batch']) == 5
+    assert not is_complete(path)
+
+    writer = ResultWriter(path, COLUMNS, resume=True)
+    writer.append(batch=5, Re2=0)
+    writer.close()
+    assert np.array_equal(load_results(path)[0]['batch'], np.arange(6))
+
+    writer = ResultWriter(path, COLUMNS, resume=True)
+    writer.truncate(2)
+    assert np.array_equal(load_results(path)[0]['batch'], np.arange(2))
+    with pytest.raises(ValueError):
+        writer.truncate(3)
+    with pytest.raises(ValueError):
+        ResultWriter(path, [('batch', np.int32)], resume=True)
@@ -0,0 +1,24 @@
+import numpy as np
+
+from polymers.pivot.sitehash import _hash, add_key, contains_key, remove_key, site_set
+
+
+def test_remove_key_keeps_probe_sequences():
+    rng = np.random.default_rng(0)
+    ss = site_set(8)
+    mask = len(ss.lo) - 1
+    # keys sharing the last slot as their home, so that their probe sequence
+    # wraps around, mixed with random keys that interleave with it
+    shared = [k for k in range(10000) if _hash(np.int64(0), np.int64(k)) & mask == mask][:4]
+    for _ in range(200):
+        keys = list(rng.choice(shared, rng.integers(0, 5), replace=False))
+        keys += list(rng.integers(0, 2**40, 8 - len(keys)))
+        for k in keys:
+            assert add_key(ss, np.int64(0), np.int64(k))
+        order = rng.permutation(len(keys))
+        for n, i in enumerate(order):
+            assert remove_key(ss, np.int64(0), np.int64(keys[i]))
+            assert not remove_key(ss, np.int64(0), np.int64(keys[i]))
+            assert ss.meta[1] == (ss.stamp == ss.meta[0]).sum() == len(keys) - n - 1
+            for j, k in enumerate(keys):
+                assert contains_key(ss, np.int64(0), np.int64(k)) == (j in order[n + 1:])
@@ -0,0 +1,37 @@
+import numpy as np
+
+from polymers.stats import Blocking, equilibration, integrated_time
+
+
+def ar1(n, phi, rng):
+    """AR(1) series x_t = phi x_{t-1} + e_t with unit-variance noise, whose
+    integrated autocorrelation time is (1 + phi) / (2 (1 - phi))"""
+    noise = rng.standard_normal(n)
+    x = np.empty(n)
+    x[0] = noise[0] / np.sqrt(1 - phi**2)
+    for t in range(1, n):
+        x[t] = phi * x[t - 1] + noise[t]
+    return x
+
+
+def test_integrated_time_of_ar1():
+    rng = np.random.default_rng(0)
+    assert abs(integrated_time(rng.standard_normal(2**16)) - 0.5) < 0.05
+    x = ar1(2**17, 0.8, rng)
+    assert abs(integrated_time(x) / 4.5 - 1) < 0.1
+
+    blocking = Blocking()
+    blocking.add_many(x[:1000])
+    blocking.add_many(x[1000:])
+    assert blocking.n == len(x)
+    assert np.isclose(blocking.mean, x.mean())
+    assert abs(blocking.tau() / 4.5 - 1) < 0.2
+
+
+def test_equilibration_discards_transient():
+    rng = np.random.default_rng(1)
+    t = np.arange(4000)
+    # the drift 20 exp(-t / 200) falls below the noise (std 1.7) after ~500 samples
+    burn_in = equilibration(ar1(len(t), 0.8, rng) + 20 * np.exp(-t / 200))
+    assert 300 <= burn_in <= 1000
+    assert equilibration(ar1(len(t), 0.8, rng)) < 200
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from polymers.symmetry import (Gd_codes, Gd_table, compose_codes, determinants, group_order,
+                               identity_code, rotate_site_code, sym_code)
+
+
+@pytest.mark.parametrize('dim', [1, 2, 3, 4])
+def test_group_is_closed(dim):
+    table = Gd_table(dim).astype(np.int64)
+    assert len(table) == group_order(dim)
+    assert len(np.unique(table, axis=0)) == len(table)
+    assert (np.abs(determinants(table)) == 1).all()
+
+    codes = Gd_codes(dim)
+    index = {code: k for k, code in enumerate(codes)}
+    assert len(index) == len(codes) and identity_code(dim) in index
+    for a, A in zip(codes, table):
+        for b, B in zip(codes, table):
+            ab = compose_codes(a, b, dim)
+            assert ab in index
+            assert np.array_equal(table[index[ab]], A @ B)
+        # every element has an inverse
+        assert any(compose_codes(a, b, dim) == identity_code(dim) for b in codes)
+
+
+def test_rotate_site_code_matches_matrix():
+    rng = np.random.default_rng(0)
+    x0 = rng.integers(-5, 5, 3)
+    x = rng.integers(-5, 5, 3)
+    y = np.empty(3, dtype=np.int64)
+    for sym in Gd_table(3).astype(np.int64):
+        rotate_site_code(sym_code(sym), x0, x, y)
+        assert np.array_equal(y, sym @ (x - x0) + x0)
@@ -0,0 +1,48 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+
+from polymers.walk import load_walk, save_walk, _CRC, _HEADER
+
+
+def zigzag_walk(N, dim):
+    """Sites (N, dim) of a walk alternating between steps along the first
+    and the last axis"""
+    steps = np.zeros((N, dim), dtype=np.int64)
+    steps[1::2, 0] = 1
+    steps[2::2, -1] = -1
+    return np.cumsum(steps, axis=0) + 5
+
+
+@pytest.mark.parametrize('dim', [2, 3])
+def test_packed_round_trip(tmp_path, dim):
+    file = str(tmp_path / 'walks.steps')
+    walks = np.stack([zigzag_walk(70, dim), zigzag_walk(70, dim)[::-1]])
+    save_walk(file, walks)
+    assert np.array_equal(load_walk(file), walks)
+    out = np.empty(walks.shape, dtype=np.int32)
+    assert load_walk(file, out=out) is out
+    assert np.array_equal(out, walks)
+
+
+def test_packed_rejects_invalid_codes_and_buffers(tmp_path):
+    file = str(tmp_path / 'walk.steps')
+    save_walk(file, zigzag_walk(70, 3) + 100)
+    with pytest.raises(ValueError):
+        load_walk(file, out=np.empty((70, 2), dtype=np.int64))
+    # sites reach 105 + 69, beyond int8
+    with pytest.raises(ValueError):
+        load_walk(file, out=np.empty((70, 3), dtype=np.int8))
+
+    # code 7 is no direction in 3D; the checksum is fixed up so that only
+    # the decoder can catch it
+    with open(file, 'rb') as f:
+        data = bytearray(f.read()[:-_CRC.size])
+    offset = _HEADER.size + 8 * 3
+    struct.pack_into('<q', data, offset, struct.unpack_from('<q', data, offset)[0] | 7)
+    with open(file, 'wb') as f:
+        f.write(data + _CRC.pack(zlib.crc32(data)))
+    with pytest.raises(ValueError, match='invalid step code'):
+        load_walk(file)